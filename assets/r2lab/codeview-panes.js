@@ -0,0 +1,76 @@
+// -*- js-indent-level:4 -*-
+
+/*
+ * codeview panes that are not selected initially are left out
+ * of the page, and come with a data-pane-url attribute instead
+ * (see implement_codeview in md/views.py)
+ *
+ * we fetch them when their pill gets shown, and we start
+ * fetching as soon as the mouse hovers the pill
+ *
+ * diff panes are left out even when selected, those we
+ * fetch as soon as the page is loaded
+ */
+
+/* for eslint */
+/*global $ Prism */
+
+"use strict";
+
+// pane id -> promise of its html
+let fetched = {};
+
+function fetch_pane(pane) {
+    let url = pane.getAttribute('data-pane-url');
+    if ( ! url)
+	return undefined;
+    if ( ! (pane.id in fetched))
+	fetched[pane.id] = fetch(url).then(response => {
+	    if ( ! response.ok)
+		throw new Error(`${url}: ${response.status}`);
+	    return response.text();
+	});
+    return fetched[pane.id];
+}
+
+function pane_for(pill) {
+    let href = pill.getAttribute('href');
+    return (href && href[0] == '#')
+	? document.getElementById(href.substr(1)) : null;
+}
+
+function load_pane(pane) {
+    if ( ! pane)
+	return;
+    let promise = fetch_pane(pane);
+    if ( ! promise)
+	return;
+    promise
+	.then(html => {
+	    // so we do it only once
+	    pane.removeAttribute('data-pane-url');
+	    // jquery so that the r2lab_diff <script> gets to run
+	    $(pane).html(html);
+	    if (typeof Prism != 'undefined')
+		Prism.highlightAllUnder(pane);
+	})
+	.catch(error => {
+	    // try again next time
+	    delete fetched[pane.id];
+	    console.log(`could not load codeview pane ${pane.id}`, error);
+	});
+}
+
+$(function() {
+    $(".nav-pills a:not(.default-click)")
+	.on('mouseenter focus', function() {
+	    let pane = pane_for(this);
+	    if (pane) fetch_pane(pane);
+	})
+	.on('show.bs.tab', function() {
+	    load_pane(pane_for(this));
+	});
+    $(".tab-pane.active[data-pane-url]").each(function() {
+	load_pane(this);
+    });
+});
@@ -0,0 +1,42 @@
+// -*- js-indent-level:4 -*-
+
+"use strict";
+
+import {post_xhttp_django} from "/assets/r2lab/xhttp-django.js";
+
+// what the run and book pages need about the logged-in user -
+// slices, keys and upcoming leases - in a single round trip
+// see dashboard/plcapi_dashboard.py
+
+// liveslices and livekeys load at the same time, and share one request
+let dashboard_promise = null;
+
+// a promise of {slices, keys, leases}
+// pass fresh = true after a change, e.g. once a key has been added
+export function get_dashboard(fresh) {
+    if (dashboard_promise === null || fresh) {
+        let promise = new Promise(function(resolve, reject) {
+            post_xhttp_django('/dashboard/get', {}, function(xhttp) {
+                if (xhttp.readyState != 4)
+                    return;
+                if (xhttp.status != 200) {
+                    reject(`/dashboard/get: status ${xhttp.status}`);
+                    return;
+                }
+                let answer = JSON.parse(xhttp.responseText);
+                if (answer.error)
+                    reject(`/dashboard/get: ${answer.error}`);
+                else
+                    resolve(answer);
+            });
+        });
+        // so that the next call tries again
+        promise.catch(function(error) {
+            console.log(error);
+            if (dashboard_promise === promise)
+                dashboard_promise = null;
+        });
+        dashboard_promise = promise;
+    }
+    return dashboard_promise;
+}
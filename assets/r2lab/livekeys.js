@@ -9,11 +9,13 @@ import {load_css} from "/assets/r2lab/load-css.js";
 load_css("/assets/r2lab/livekeys.css");
 
 import {post_xhttp_django} from "/assets/r2lab/xhttp-django.js";
+import {get_dashboard} from "/assets/r2lab/dashboard.js";
 
 /* would need something cleaner .. */
 $(function() {
 
-    let display_keys = function(domid) {
+    // fresh is for after a change, see get_dashboard
+    let display_keys = function(domid, fresh) {
         let keysdiv = $("#" + domid);
         // create 1 div for the list of keys, and one for the add-key button
         let id_list = `keyslist-${domid}`;
@@ -42,10 +44,8 @@ $(function() {
         $('.add-key-area').tooltip(
             {title: 'Click to upload another public key'});
 
-        post_xhttp_django('/keys/get', {}, function(xhttp) {
-            if (! (xhttp.readyState == 4 && xhttp.status == 200))
-                return;
-            let keys = JSON.parse(xhttp.responseText);
+        get_dashboard(fresh).then(function(dashboard) {
+            let keys = dashboard.keys;
             if (keys.length) {
                 keys.forEach(function(key){
                     let ssh_key = key['ssh_key'];
@@ -73,7 +73,7 @@ $(function() {
         let request = { "uuid" : key_uuid };
         post_xhttp_django('/keys/delete', request, function(xhttp) {
             if (xhttp.readyState == 4 && xhttp.status == 200) {
-                display_keys("livekeys-container");
+                display_keys("livekeys-container", true);
                 // decoding
                 // let answer = JSON.parse(xhttp.responseText);
                 // console.log("answer from /keys/delete");
@@ -101,7 +101,7 @@ $(function() {
         let request = { "key" : key };
         post_xhttp_django('/keys/add', request, function(xhttp) {
             if (xhttp.readyState == 4 && xhttp.status == 200) {
-                display_keys("livekeys-container");
+                display_keys("livekeys-container", true);
                 // decoding
                 // let answer = JSON.parse(xhttp.responseText);
                 // console.log("answer from /keys/add");
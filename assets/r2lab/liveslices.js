@@ -2,7 +2,6 @@
 
 /* for eslint */
 /*global $  moment*/
-/*global r2lab_accounts */
 
 "use strict";
 
@@ -10,6 +9,7 @@ import {load_css} from "/assets/r2lab/load-css.js";
 load_css("/assets/r2lab/liveslices.css");
 
 import {post_xhttp_django} from "/assets/r2lab/xhttp-django.js";
+import {get_dashboard} from "/assets/r2lab/dashboard.js";
 
 $(function() {
 
@@ -51,7 +51,7 @@ $(function() {
     }
 
 
-    let get_slices = function(id, names) {
+    let get_slices = function(id) {
         let body = $(`#${id}`);
         body.html(
             "<div class='row slice-header'>"
@@ -59,57 +59,49 @@ $(function() {
           + "<div class='col-md-4'>Expiration Date</div>"
           + "<div class='col-md-2'>Renew</div>"
           + "</div>");
-        $.each(names, function(index, value){
+        // all the slices come at once, together with the keys
+        get_dashboard().then(function(dashboard) {
+            let responses = dashboard.slices;
+            if (responses.length <= 0)
+                return;
 
-            let request = {};
-            request['names'] = [value];
-
-            post_xhttp_django('/slices/get', request, function(xhttp) {
-
-                if ( ! (xhttp.readyState == 4 && xhttp.status == 200))
-                    return;
-                let responses = JSON.parse(xhttp.responseText);
-                if (responses.length <= 0)
-                    return;
-
-                let slice_manage_invitation = '\
+            let slice_manage_invitation = '\
 One or more of your slices has expired. \
 <a href="#" data-toggle="modal" data-target="#slices_keys_modal">\
 Click here to renew it!</a>';
-                for (let i = 0; i < responses.length; i++) {
-
-                    let response   = responses[i];
-                    let slicename  = response['name'];
-                    let normal_id  = normalize_id(slicename);
-                    let expiration = response['valid_until'];
-                    let closed     = response['closed_at'];
-                    //let expiration = '2016-01-22T09:25:31Z';
-
-                    let s_class   = 'in-green';
-                    let s_id = `renew-slice-${normal_id}`;
-                    let s_icon = `<span class='fa fa-refresh in-blue' id='${s_id}'>`;
-                    let the_date  = moment(expiration).format("YYYY-MM-DD HH:mm");
-                    if (is_past_date(expiration) || is_past_date(closed)){
-                        send_message(slice_manage_invitation, 'attention');
-
-                        if (is_past_date(closed)){
-                            the_date  = moment(closed).format("YYYY-MM-DD HH:mm");
-                        }
-
-                        s_class   = 'in-red';
+            for (let i = 0; i < responses.length; i++) {
+
+                let response   = responses[i];
+                let slicename  = response['name'];
+                let normal_id  = normalize_id(slicename);
+                let expiration = response['valid_until'];
+                let closed     = response['closed_at'];
+                //let expiration = '2016-01-22T09:25:31Z';
+
+                let s_class   = 'in-green';
+                let s_id = `renew-slice-${normal_id}`;
+                let s_icon = `<span class='fa fa-refresh in-blue' id='${s_id}'>`;
+                let the_date  = moment(expiration).format("YYYY-MM-DD HH:mm");
+                if (is_past_date(expiration) || is_past_date(closed)){
+                    send_message(slice_manage_invitation, 'attention');
+
+                    if (is_past_date(closed)){
+                        the_date  = moment(closed).format("YYYY-MM-DD HH:mm");
                     }
 
-                    $(body).append(
-                        `<div class='row'>`
-                      + `<div class='col-md-6'>${slicename}</div>`
-                      + `<div class='col-md-4' id='timestamp-expire${normal_id}'>`
-                      + `<span class='${s_class}'>${the_date}</span>`
-                      + `</div>`
-                      + `<div class='col-md-2'>${s_icon}</div>`);
-                    $(`#${s_id}`).click(function() {
-                        renew_slice(normalize_id(slicename), slicename)});
+                    s_class   = 'in-red';
                 }
-            })
+
+                $(body).append(
+                    `<div class='row'>`
+                  + `<div class='col-md-6'>${slicename}</div>`
+                  + `<div class='col-md-4' id='timestamp-expire${normal_id}'>`
+                  + `<span class='${s_class}'>${the_date}</span>`
+                  + `</div>`
+                  + `<div class='col-md-2'>${s_icon}</div>`);
+                $(`#${s_id}`).click(function() {
+                    renew_slice(normalize_id(slicename), slicename)});
+            }
         });
     }
 
@@ -134,9 +126,7 @@ Click here to renew it!</a>';
 
 
     function main(){
-        let slicenames = r2lab_accounts.map(
-            function(account){return account['name'];});
-        get_slices("liveslices-container", slicenames);
+        get_slices("liveslices-container");
     }
 
 
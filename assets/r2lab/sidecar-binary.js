@@ -0,0 +1,130 @@
+// the binary frames that the relay sends to the browsers
+// that ask for them - see relay/binary.py for the format
+//
+// this only decodes the MessagePack types that the relay uses,
+// i.e. the ones that json can express
+
+const msgpack_text_decoder = new TextDecoder();
+
+class MessagePackReader {
+
+    constructor(buffer) {
+        this.view = new DataView(buffer);
+        this.bytes = new Uint8Array(buffer);
+        this.offset = 0;
+    }
+
+    // the value at offset, and move past it
+    read() {
+        let marker = this.view.getUint8(this.offset++);
+        if (marker < 0x80)
+            return marker;
+        if (marker >= 0xe0)
+            return marker - 0x100;
+        if (marker >= 0xa0 && marker < 0xc0)
+            return this.string(marker & 0x1f);
+        if (marker >= 0x90 && marker < 0xa0)
+            return this.array(marker & 0x0f);
+        if (marker >= 0x80 && marker < 0x90)
+            return this.map(marker & 0x0f);
+        switch (marker) {
+        case 0xc0: return null;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xca: return this.fixed('getFloat32', 4);
+        case 0xcb: return this.fixed('getFloat64', 8);
+        case 0xcc: return this.fixed('getUint8', 1);
+        case 0xcd: return this.fixed('getUint16', 2);
+        case 0xce: return this.fixed('getUint32', 4);
+        case 0xcf: return Number(this.fixed('getBigUint64', 8));
+        case 0xd0: return this.fixed('getInt8', 1);
+        case 0xd1: return this.fixed('getInt16', 2);
+        case 0xd2: return this.fixed('getInt32', 4);
+        case 0xd3: return Number(this.fixed('getBigInt64', 8));
+        case 0xd9: return this.string(this.fixed('getUint8', 1));
+        case 0xda: return this.string(this.fixed('getUint16', 2));
+        case 0xdb: return this.string(this.fixed('getUint32', 4));
+        case 0xdc: return this.array(this.fixed('getUint16', 2));
+        case 0xdd: return this.array(this.fixed('getUint32', 4));
+        case 0xde: return this.map(this.fixed('getUint16', 2));
+        case 0xdf: return this.map(this.fixed('getUint32', 4));
+        }
+        throw new Error(`unsupported msgpack marker ${marker}`);
+    }
+
+    fixed(getter, size) {
+        let value = this.view[getter](this.offset);
+        this.offset += size;
+        return value;
+    }
+
+    string(size) {
+        let start = this.offset;
+        this.offset += size;
+        if (this.offset > this.bytes.length)
+            throw new Error(`truncated msgpack string`);
+        // most of our strings are short and ascii, like 'on' or 'off',
+        // and going through TextDecoder costs more than that
+        if (size <= 32) {
+            let result = '';
+            for (let i = start; i < this.offset; i++) {
+                let code = this.bytes[i];
+                if (code >= 0x80) {
+                    result = null;
+                    break;
+                }
+                result += String.fromCharCode(code);
+            }
+            if (result !== null)
+                return result;
+        }
+        return msgpack_text_decoder.decode(this.bytes.subarray(start, this.offset));
+    }
+
+    array(size) {
+        let result = [];
+        for (let i = 0; i < size; i++)
+            result.push(this.read());
+        return result;
+    }
+
+    // keys are field indexes, or strings in nested objects
+    map(size) {
+        let result = {};
+        for (let i = 0; i < size; i++) {
+            let key = this.read();
+            result[key] = this.read();
+        }
+        return result;
+    }
+}
+
+// schemas is a category -> list of fields object, that is kept
+// for the lifetime of the connection
+// returns the equivalent of the json umbrella, i.e.
+// {category, action, message}, or undefined for a schema frame
+export function decode_sidecar_frame(buffer, schemas) {
+    let [category, action, ...rest] = new MessagePackReader(buffer).read();
+    if (action == 'schema') {
+        schemas[category] = rest[0];
+        return undefined;
+    }
+    let fields = schemas[category] || [];
+    let record = function(row) {
+        let result = {};
+        if (Array.isArray(row)) {
+            for (let index = 0; index < row.length; index++)
+                result[fields[index]] = row[index];
+        } else {
+            for (let index in row)
+                result[fields[index]] = row[index];
+        }
+        return result;
+    };
+    if (action == 'delta') {
+        let [seq, full, rows] = rest;
+        return {category, action,
+                message: {seq, full, infos: rows.map(record)}};
+    }
+    return {category, action, message: rest[0].map(record)};
+}
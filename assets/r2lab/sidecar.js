@@ -4,6 +4,8 @@
 
 /*global sidecar_url*/
 
+import {decode_sidecar_frame} from "/assets/r2lab/sidecar-binary.js";
+
 // inspired from
 // https://github.com/websockets/ws/wiki/Websocket-client-implementation-for-auto-reconnect
 
@@ -29,6 +31,8 @@ class WebSocketReconnectable {
 
     connect() {
         this.websocket = new WebSocket(this.url);
+        // the relay may send binary frames, see sidecar-binary.js
+        this.websocket.binaryType = 'arraybuffer';
         let reconnectable = this;
         this.websocket.onopen =
             function() { reconnectable.onopen()
@@ -107,6 +111,21 @@ class WebSocketReconnectable {
 }
 
 
+// the page may come with the latest known status of some categories,
+// see md/templatetags/sidecar.py
+function embedded_snapshot() {
+    let element = document.getElementById('sidecar-snapshot');
+    if ( ! element)
+        return {};
+    try {
+        return JSON.parse(element.textContent);
+    } catch(err) {
+        console.log(`could not use the embedded snapshot`, err);
+        return {};
+    }
+}
+
+
 class SidecarImplementation {
 
 
@@ -116,6 +135,12 @@ class SidecarImplementation {
         this.callbacks_map = {};
         this.categories = [];
         this.reconnectable = null;
+        // category -> seq of the last delta, when talking to the relay
+        this.sequences = {};
+        // category -> fields, for the binary frames from the relay
+        this.schemas = {};
+        // category -> infos, until they are used
+        this.snapshot = embedded_snapshot();
     }
 
     // <key> is typically a sidecar category, which
@@ -138,6 +163,13 @@ class SidecarImplementation {
 
     register_categories(categories) {
         for (let category of categories) {
+            // paint right away, the websocket will tell us more
+            let infos = this.snapshot[category];
+            if (infos !== undefined) {
+                delete this.snapshot[category];
+                // once the widget is done registering
+                Promise.resolve().then(() => this.dispatch(category, infos));
+            }
             if (this.ready()) {
                 this.request(category);
             } else if (! (category in this.categories)) {
@@ -180,7 +212,9 @@ class SidecarImplementation {
         }
         let reconnectable = new WebSocketReconnectable(this.url);
         reconnectable.onmessage =
-            ((event, flags, number) => this.handle_incoming_json(event.data, number));
+            ((event, flags, number) => (event.data instanceof ArrayBuffer)
+             ? this.handle_incoming_binary(event.data, number)
+             : this.handle_incoming_json(event.data, number));
         reconnectable.onopen = ((event) => this.handle_connection_open(event));
         reconnectable.onerror = ((event) => this.handle_connection_error(event));
         reconnectable.onclose = ((event) => this.handle_status_changed(event));
@@ -197,6 +231,16 @@ class SidecarImplementation {
 
     handle_connection_open() {
         console.log(`websocket opened: ${this.url}`);
+        // the relay then sends deltas, as binary frames - see relay/server.py
+        // and the sidecar itself ignores this
+        this.sequences = {};
+        this.schemas = {};
+        this.reconnectable.send(
+            JSON.stringify({
+                category: 'relay',
+                action: 'features',
+                message: ['deltas', 'binary'],
+            }));
         for (let category of this.categories) {
             this.request(category);
         }
@@ -214,30 +258,40 @@ class SidecarImplementation {
         this.handle_status_changed();
     }
 
+    // the infos in a delta message, or undefined if
+    // we have missed one, in which case we ask for everything
+    accept_delta(category, delta) {
+        let last = this.sequences[category];
+        if ( ! delta.full && last !== undefined && delta.seq != last + 1) {
+            debug(`missed deltas on ${category}: ${last} -> ${delta.seq}`);
+            delete this.sequences[category];
+            this.request(category);
+            return undefined;
+        }
+        this.sequences[category] = delta.seq;
+        return delta.infos;
+    }
+
+    dispatch(category, infos) {
+        let callbacks = this.callbacks_map[category];
+        if (callbacks == undefined) {
+            // ignore categories not present in callbacks
+            return;
+        }
+        for (let callback of callbacks)
+            callback(infos);
+    }
+
     handle_incoming_json(json, number) {
         try {
-            let umbrella = JSON.parse(json);
-            debug(`sidecar [${number}]: incoming umbrella`, umbrella)
-            let category = umbrella.category;
-            let action = umbrella.action;
-            let infos = umbrella.message;
             // xxx somehow we get noise in the mix
             if (json == "" || json == null) {
                 console.log(`sidecar json fragment is empty..`);
                 return;
             }
-            if (action != "info") {
-                debug(`sidecar action ${action} on category ${category} ignored`);
-                return;
-            }
-            debug(`*** recv info about ${infos.length} ${category}`, infos);
-            let callbacks = this.callbacks_map[category];
-            if (callbacks == undefined) {
-                // ignore categories not present in callbacks
-                return;
-            }
-            for (let callback of callbacks)
-                callback(infos);
+            let umbrella = JSON.parse(json);
+            debug(`sidecar [${number}]: incoming umbrella`, umbrella)
+            this.handle_umbrella(umbrella);
         } catch(err) {
             console.log(`*** Could not handle news - ignored JSON is ${json.length} chars long`);
             console.log(json);
@@ -246,6 +300,40 @@ class SidecarImplementation {
         }
     }
 
+    handle_incoming_binary(buffer, number) {
+        try {
+            let umbrella = decode_sidecar_frame(buffer, this.schemas);
+            debug(`sidecar [${number}]: incoming binary umbrella`, umbrella)
+            // schema frames only update this.schemas
+            if (umbrella !== undefined)
+                this.handle_umbrella(umbrella);
+        } catch(err) {
+            console.log(`*** Could not handle news - ignored frame is ${buffer.byteLength} bytes long`);
+            console.log(err.stack);
+            console.log("***");
+        }
+    }
+
+    handle_umbrella(umbrella) {
+        let category = umbrella.category;
+        let action = umbrella.action;
+        let infos = umbrella.message;
+        // deltas only have the fields that have changed,
+        // which the callbacks merge like for partial infos
+        if (action == "delta") {
+            infos = this.accept_delta(category, infos);
+            if (infos === undefined)
+                return;
+            action = "info";
+        }
+        if (action != "info") {
+            debug(`sidecar action ${action} on category ${category} ignored`);
+            return;
+        }
+        debug(`*** recv info about ${infos.length} ${category}`, infos);
+        this.dispatch(category, infos);
+    }
+
 }
 
 let sidecar_singleton = null;
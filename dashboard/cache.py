@@ -0,0 +1,84 @@
+"""
+the answers of /dashboard/get are cached for each user, under a key
+that has a version number; bumping it is how the views that change
+the slices, keys or leases make the next answer a fresh one
+
+the answers of /users/get are the same for everyone, and have a single
+version, that gets bumped when a slice is renewed
+
+like the answers, the versions live in the django cache; so with
+several processes and a per-process cache, an answer can still be
+up to json_settings['cache_timeout'] old
+"""
+
+from functools import wraps
+
+from django.core.cache import cache
+
+
+def _session_email(request):
+    try:
+        return request.session['r2lab_context']['user_details']['email']
+    except KeyError:
+        return None
+
+
+def _version_key(email):
+    return f"dashboard-version:{email}"
+
+
+def forget_dashboard(request):
+    """
+    the next /dashboard/get from that user will go to the PLCAPI
+    """
+    email = _session_email(request)
+    if email is None:
+        return
+    version_key = _version_key(email)
+    cache.set(version_key, cache.get(version_key, 0) + 1, None)
+
+
+def dashboard_version(email):
+    return cache.get(_version_key(email), 0)
+
+
+USERS_VERSION_KEY = "users-version"
+
+
+def forget_users():
+    """
+    the next /users/get, from anyone, will go to the PLCAPI
+    """
+    cache.set(USERS_VERSION_KEY, cache.get(USERS_VERSION_KEY, 0) + 1, None)
+
+
+def users_version():
+    return cache.get(USERS_VERSION_KEY, 0)
+
+
+def _forgets(forget, verbs):
+    def decorator(post):
+        @wraps(post)
+        def wrapped(self, request, verb):
+            response = post(self, request, verb)
+            if verb in verbs:
+                forget(request)
+            return response
+        return wrapped
+    return decorator
+
+
+def forgets_dashboard(*verbs):
+    """
+    for the post() methods of the views whose verbs change
+    what the dashboard shows, e.g.
+        @forgets_dashboard('add', 'delete')
+    """
+    return _forgets(forget_dashboard, verbs)
+
+
+def forgets_users(*verbs):
+    """
+    likewise for the verbs that change what /users/get shows
+    """
+    return _forgets(lambda request: forget_users(), verbs)
@@ -0,0 +1,126 @@
+"""
+The PLCAPI version of the view that answers /dashboard/ xhttp requests
+
+this is what the run and book pages need about the logged-in user -
+their slices, keys and upcoming leases - in a single answer, instead
+of one request for the keys and one per slice; the PLCAPI calls are
+made in parallel, and the answer is cached for each user
+
+the views that change any of this forget the cached answer of the
+user who made the change, see dashboard/cache.py; for the other
+members of a slice, leases can be json_settings['cache_timeout'] late
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_protect
+
+from plc.plcapiview import PlcApiView, init_plcapi_proxy
+from r2lab.metrics import timer
+from slices.plcapi_slices import SlicesProxy
+from leases.plcapi_leases import LeasesProxy
+
+from .cache import dashboard_version
+
+
+def call_with_proxy(function):
+    # each thread needs its own connection to the API
+    return function(init_plcapi_proxy())
+
+
+class DashboardProxy(PlcApiView):
+    """
+    The view that receives /dashboard/ URLs when running against a PLCAPI
+    """
+
+    @method_decorator(csrf_protect)
+    def post(self, request, verb):
+        """
+        xhtp requests come using a POST http command
+        """
+        auth_error = self.not_authenticated_error(request)
+        if auth_error:
+            return auth_error
+        context = request.session['r2lab_context']
+        email = context['user_details']['email']
+        try:
+            record = self.decode_body_as_json(request)
+            if verb == 'get':
+                return self.get_dashboard(
+                    record, email, context.get('accounts', []))
+            else:
+                return self.http_response_from_struct(
+                    {'error': "Unknown verb {}".format(verb)})
+        except Exception as exc:
+            import traceback
+            traceback.print_exc()
+            return self.http_response_from_struct(
+                {'error': "Failure when running verb {}".format(verb),
+                 'message': exc})
+
+    def get_dashboard(self, record, email, accounts):
+        """
+        the slices are the ones in 'names' if provided, and otherwise
+        the ones the user had when logging in - like r2lab_accounts
+        """
+        error = self.check_record(record, (), ('names', ))
+        if error:
+            return self.http_response_from_struct(error)
+        names = record.get('names',
+                           [account['name'] for account in accounts])
+        return self.http_response_from_cache(
+            f"dashboard:{email}:{dashboard_version(email)}", {'names': sorted(names)},
+            lambda: self.dashboard_struct(email, names))
+
+    def dashboard_struct(self, email, names):
+        """
+        {'slices': [...], 'keys': [...], 'leases': [...]} with the
+        same contents as /slices/get, /keys/get, and the sidecar's
+        leases - only the ones of these slices that are not over yet
+        """
+        plc_names = [self.ensure_plc_slicename(name) for name in names]
+        plc_names = [x for x in plc_names if x]
+        parts = {
+            'slices': lambda proxy: self.slices_part(proxy, plc_names),
+            'keys': lambda proxy: self.keys_part(proxy, email),
+            'leases': lambda proxy: self.leases_part(proxy, plc_names),
+        }
+        with timer('dashboard'), \
+             ThreadPoolExecutor(max_workers=len(parts)) as executor:
+            futures = {part: executor.submit(call_with_proxy, function)
+                       for part, function in parts.items()}
+            return {part: future.result()
+                    for part, future in futures.items()}
+
+    @staticmethod
+    def slices_part(proxy, plc_names):
+        if not plc_names:
+            return []
+        plc_slices = proxy.GetSlices(
+            {'name': plc_names}, ['slice_id', 'name', 'expires'])
+        slices = [SlicesProxy.return_slice(plc_slice)
+                  for plc_slice in plc_slices]
+        slices.sort(key=lambda slice: slice['valid_until'])
+        return slices
+
+    @staticmethod
+    def keys_part(proxy, email):
+        persons = proxy.GetPersons({'email': email}, ['person_id'])
+        if not persons:
+            return []
+        plc_keys = proxy.GetKeys({'person_id': persons[0]['person_id']})
+        return [{'uuid': plc_key['key_id'], 'ssh_key': plc_key['key']}
+                for plc_key in plc_keys]
+
+    @staticmethod
+    def leases_part(proxy, plc_names):
+        if not plc_names:
+            return []
+        plc_leases = proxy.GetLeases(
+            {'name': plc_names, '>t_until': int(time.time())})
+        leases = [LeasesProxy.lease_info(plc_lease)
+                  for plc_lease in plc_leases]
+        leases.sort(key=lambda lease: lease['valid_from'])
+        return leases
@@ -0,0 +1 @@
+from .plcapi_dashboard import DashboardProxy
@@ -8,6 +8,7 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_protect
 
 from plc.plcapiview import PlcApiView
+from dashboard.cache import forgets_dashboard
 import plc.xrn
 
 # Create your views here.
@@ -17,6 +18,7 @@ class KeysProxy(PlcApiView):
     """
 
     @method_decorator(csrf_protect)
+    @forgets_dashboard('add', 'delete')
     def post(self, request, verb):
         """
         xhtp requests come using a POST http command
@@ -8,6 +8,9 @@ from django.views.decorators.csrf import csrf_protect
 # importing PlcApiProxy through this module because of the symlink hack
 from plc.plcapiview import PlcApiView
 
+from relay.bus import publish_lease_change
+from dashboard.cache import forgets_dashboard
+
 
 class LeasesProxy(PlcApiView):
     """
@@ -15,6 +18,7 @@ class LeasesProxy(PlcApiView):
     """
 
     @method_decorator(csrf_protect)
+    @forgets_dashboard('add', 'update', 'delete')
     def post(self, request, verb):
         """
         xhtp requests come using a POST http command
@@ -41,15 +45,24 @@ class LeasesProxy(PlcApiView):
                 {'error': "Failure when running verb {}".format(verb),
                  'message': exc})
 
-    def return_lease(self, plc_lease):
+    @staticmethod
+    def lease_info(plc_lease):
         """
-        what to return upon ADD or UPDATE
+        a lease as the sidecar describes it
         """
         return {'uuid': plc_lease['lease_id'],
                 'slicename': plc_lease['name'],
-                'valid_from': self.epoch_to_ui_ts(plc_lease['t_from']),
-                'valid_until': self.epoch_to_ui_ts(plc_lease['t_until']),
-                'ok': True}
+                'valid_from': PlcApiView.epoch_to_ui_ts(plc_lease['t_from']),
+                'valid_until': PlcApiView.epoch_to_ui_ts(plc_lease['t_until'])}
+
+    def return_lease(self, verb, plc_lease):
+        """
+        what to return upon ADD or UPDATE; the relay gets told as well,
+        so that the other users see the change right away
+        """
+        info = self.lease_info(plc_lease)
+        publish_lease_change(verb, info)
+        return dict(info, ok=True)
 
     def add_lease(self, record):
         """
@@ -72,7 +85,8 @@ class LeasesProxy(PlcApiView):
         lease_id = retcod['new_ids'][0]
         # go back to the API to get limits - possibly rectified wrt granularity
         lease = self.plcapi_proxy.GetLeases(int(lease_id))[0]
-        response = self.http_response_from_struct(self.return_lease(lease))
+        response = self.http_response_from_struct(
+            self.return_lease('add', lease))
         return response
 
     def update_lease(self, record):
@@ -94,7 +108,8 @@ class LeasesProxy(PlcApiView):
                 {'error': '\n'.join(retcod['errors'])})
         # go back to the API to get limits - possibly rectified wrt granularity
         lease = self.plcapi_proxy.GetLeases(int(lease_id))[0]
-        response = self.http_response_from_struct(self.return_lease(lease))
+        response = self.http_response_from_struct(
+            self.return_lease('update', lease))
         return response
 
     def delete_lease(self, record):
@@ -107,5 +122,7 @@ class LeasesProxy(PlcApiView):
         lease_id = record['uuid']
         self.init_plcapi_proxy()
         retcod = self.plcapi_proxy.DeleteLeases([int(lease_id)])
+        if retcod == 1:
+            publish_lease_change('delete', {'uuid': int(lease_id)})
         return self.http_response_from_struct(
             {'ok': retcod == 1})
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class MdConfig(AppConfig):
     name = 'md'
+
+    def ready(self):
+        # scan all pages once at startup
+        from .catalogue import catalogue
+        catalogue.all()
@@ -0,0 +1,99 @@
+"""
+the engines that can convert markdown into html
+
+the one in use is selected with markdown_settings['backend'];
+./manage.py comparebackends checks that another one would produce
+the same pages - in particular that our << tags >> still get detected,
+which depends on how each engine escapes the '<<' - and how fast it is
+
+all engines are imported upon first use, and only markdown2 is a
+hard requirement
+"""
+
+from importlib import import_module
+
+from r2lab.settings import markdown_settings
+
+
+class MarkdownBackend:
+    """
+    the interface: convert() returns a tuple (html, toc_html)
+    where toc_html is None if the engine has taken care of [TOC] itself
+    """
+    name = None
+    # the module that this engine needs
+    module_name = None
+
+    def __init__(self):
+        self.module = import_module(self.module_name)
+
+    def convert(self, markdown):
+        raise NotImplementedError
+
+
+class Markdown2Backend(MarkdownBackend):
+    """
+    the historical engine
+    WARNING: version 2.3.6 of markdown2 breaks it for me
+    see https://github.com/trentm/python-markdown2/issues/311
+    """
+    name = 'markdown2'
+    module_name = 'markdown2'
+
+    def convert(self, markdown):
+        html = self.module.markdown(
+            markdown, extras=['markdown-in-html', 'toc',
+                              'header-ids', 'fenced-code-blocks'])
+        return str(html), html.toc_html
+
+
+class PythonMarkdownBackend(MarkdownBackend):
+    """
+    the 'markdown' package, aka Python-Markdown
+    """
+    name = 'python-markdown'
+    module_name = 'markdown'
+
+    def convert(self, markdown):
+        # not thread-safe, so one instance per call
+        converter = self.module.Markdown(
+            extensions=['md_in_html', 'toc', 'fenced_code'])
+        # the toc extension replaces [TOC] by itself
+        return converter.convert(markdown), None
+
+
+class MistuneBackend(MarkdownBackend):
+    """
+    mistune is the fastest of the pure python engines,
+    but it has no support for markdown inside html
+    """
+    name = 'mistune'
+    module_name = 'mistune'
+
+    def __init__(self):
+        super().__init__()
+        self.converter = self.module.create_markdown(
+            escape=False, plugins=['strikethrough', 'table'])
+
+    def convert(self, markdown):
+        return self.converter(markdown), None
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (Markdown2Backend, PythonMarkdownBackend, MistuneBackend)
+}
+
+# instances, created upon first use
+_backends = {}
+
+
+def get_backend(name=None):
+    """
+    the backend instance for name, default being the one in settings
+    raises ImportError if the engine is not installed
+    """
+    name = name or markdown_settings['backend']
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
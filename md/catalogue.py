@@ -0,0 +1,192 @@
+"""
+the catalogue of the pages in markdown/, with their header metavars
+
+it is built when the app starts, and each lookup checks the mtime
+of the page, so edits are picked up without a restart
+
+this is what lets markdown_page know that e.g. run.md has
+'require_login' before it does any rendering
+
+names of pages that do not exist - typically probes from scanners
+like wp-login.php or .env - are remembered for a while in a bounded
+negative cache, so that answering them does not even cost a stat
+"""
+
+import re
+import time
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+
+from r2lab.settings import markdown_settings
+
+# search for markdown input in the markdown/ subdir
+MARKDOWN_SUBDIR = "markdown"
+
+METAVAR_RE = re.compile(r"\A(?P<name>[\S_]+):\s*(?P<value>.*)\Z")
+
+
+def match_meta(line):
+    """
+    for parsing the header that defines metavariables
+    returns a tuple (name, value), or None
+    """
+    # remove trailing newline
+    match = METAVAR_RE.match(line[:-1])
+    if match:
+        return match.group('name'), match.group('value')
+    return None
+
+
+def read_metavars(path):
+    """
+    the metavars defined in the header of a markdown file
+    """
+    metavars = {}
+    with path.open(encoding='utf-8') as file:
+        for line in file:
+            name_value_or_none = match_meta(line)
+            if not name_value_or_none:
+                break
+            name, value = name_value_or_none
+            metavars[name] = value
+    return metavars
+
+
+class Page:
+    """
+    what we know about one page without rendering it
+    """
+
+    def __init__(self, name, mtime, metavars):
+        self.name = name
+        self.mtime = mtime
+        self.metavars = metavars
+
+    @property
+    def url(self):
+        return f"/{self.name}"
+
+    @property
+    def title(self):
+        return self.metavars.get('title', self.name.replace(".md", ""))
+
+    @property
+    def require_login(self):
+        return 'require_login' in self.metavars
+
+
+class PageCatalogue:
+
+    def __init__(self, directory, *, negative_size, negative_ttl):
+        self.directory = Path(directory).resolve()
+        self.pages = {}
+        self.lock = threading.Lock()
+        # the mtime of the directory when we last listed it
+        self.listed_mtime = None
+        # name -> expiration time, oldest first
+        self.missing = OrderedDict()
+        self.negative_size = negative_size
+        self.negative_ttl = negative_ttl
+
+    def _missed(self, name):
+        """
+        remember that name is not a page
+        """
+        with self.lock:
+            self.pages.pop(name, None)
+            self.missing[name] = time.monotonic() + self.negative_ttl
+            self.missing.move_to_end(name)
+            while len(self.missing) > self.negative_size:
+                self.missing.popitem(last=False)
+
+    def known_missing(self, name):
+        """
+        whether name has recently been found not to be a page
+        """
+        expires = self.missing.get(name)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            with self.lock:
+                self.missing.pop(name, None)
+            return False
+        return True
+
+    def path(self, name):
+        """
+        the path for a page name like 'index.md', or None if that
+        name would take us out of the markdown directory
+        """
+        try:
+            path = (self.directory / name).resolve()
+        except (OSError, ValueError):
+            return None
+        if self.directory not in path.parents:
+            return None
+        return path
+
+    def get(self, name):
+        """
+        the Page object for name - a normalized name like 'index.md'
+
+        returns None if there is no such page
+        costs one stat, plus reading the header if the file has changed
+        """
+        if self.known_missing(name):
+            return None
+        path = self.path(name)
+        if path is None:
+            self._missed(name)
+            return None
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            self._missed(name)
+            return None
+        page = self.pages.get(name)
+        if page is None or page.mtime != mtime:
+            try:
+                page = Page(name, mtime, read_metavars(path))
+            except OSError:
+                # removed in the meantime
+                self._missed(name)
+                return None
+            with self.lock:
+                self.pages[name] = page
+        return page
+
+    def all(self):
+        """
+        all pages, sorted on their names; the directory is listed again
+        only if it has changed
+        """
+        mtime = self.directory.stat().st_mtime_ns
+        if mtime != self.listed_mtime:
+            names = {path.name for path in self.directory.glob("*.md")}
+            with self.lock:
+                for gone in set(self.pages) - names:
+                    del self.pages[gone]
+                # some of these may have been created since
+                self.missing.clear()
+            for name in names:
+                self.get(name)
+            self.listed_mtime = mtime
+        pages = dict(self.pages)
+        return [pages[name] for name in sorted(pages)]
+
+
+catalogue = PageCatalogue(
+    Path(settings.BASE_DIR) / MARKDOWN_SUBDIR,
+    negative_size=markdown_settings['negative_cache_size'],
+    negative_ttl=markdown_settings['negative_cache_ttl'])
+
+
+def page_catalogue(request):                        # pylint: disable=w0613
+    """
+    context processor, so that templates can build menus
+    e.g. {% for page in page_catalogue %}{{page.url}} {{page.title}}{% endfor %}
+    """
+    return {'page_catalogue': catalogue.all}
@@ -0,0 +1,114 @@
+"""
+a cache for the html fragments that our << tags >> expand into
+
+the same << codeview ... >> tag, with the same arguments, typically
+shows up in several pages, and gets expanded at each rendering;
+expanding a tag only depends on its arguments and on the contents
+of the files it includes, so that is what we use as a key
+
+this way a fragment is reused across pages and renders, even when
+the page that contains the tag has changed
+
+contents are identified by their sha256, which is computed again
+only when the file's mtime or size changes
+"""
+
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from .profiling import count
+
+
+class FileDigests:
+    """
+    path -> sha256 of its contents, memoized on (mtime, size)
+    """
+
+    def __init__(self):
+        self.digests = {}
+
+    def digest(self, path):
+        """
+        the digest for a Path object, or None if it cannot be read
+        """
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        known = self.digests.get(path)
+        if known and known[0] == signature:
+            return known[1]
+        try:
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        except OSError:
+            return None
+        self.digests[path] = (signature, digest)
+        return digest
+
+
+class FragmentCache:
+    """
+    a bounded LRU cache of html fragments
+
+    locate is a function that maps a filename as written in a tag
+    to the Path it gets included from, or None
+    """
+
+    def __init__(self, locate, *, size):
+        self.locate = locate
+        self.size = size
+        self.file_digests = FileDigests()
+        self.fragments = OrderedDict()
+        self.lock = threading.Lock()
+
+    def digest(self, filename):
+        if not filename:
+            return None
+        path = self.locate(filename)
+        return self.file_digests.digest(path) if path else None
+
+    def cached(self, *file_parameters):
+        """
+        decorator for a function that expands a tag; file_parameters
+        are the names of its parameters that refer to included files
+
+            @fragments.cached('file1', 'file2')
+            def implement_codediff(viewid, file1, file2, lang='python'):
+        """
+        def decorator(function):
+            signature = inspect.signature(function)
+
+            @wraps(function)
+            def wrapped(*args, **kwds):
+                bound = signature.bind(*args, **kwds)
+                bound.apply_defaults()
+                arguments = bound.arguments
+                key = (function.__name__,
+                       tuple(sorted(arguments.items())),
+                       tuple(self.digest(arguments[parameter])
+                             for parameter in file_parameters))
+                fragment = self.fragments.get(key)
+                if fragment is not None:
+                    count('fragment_hits')
+                    with self.lock:
+                        # may have been evicted in the meanwhile
+                        if key in self.fragments:
+                            self.fragments.move_to_end(key)
+                    return fragment
+                count('fragment_misses')
+                fragment = function(*args, **kwds)
+                with self.lock:
+                    self.fragments[key] = fragment
+                    while len(self.fragments) > self.size:
+                        self.fragments.popitem(last=False)
+                return fragment
+            return wrapped
+        return decorator
+
+    def clear(self):
+        with self.lock:
+            self.fragments.clear()
@@ -0,0 +1,150 @@
+"""
+server-side syntax highlighting of the code shown in codeviews
+
+the output uses the same token classes as prism - e.g.
+<span class="token keyword">def</span> - so that prism-default.css
+applies unchanged, and browsers do not have to tokenize anything
+
+this requires pygments, and is turned on with
+markdown_settings['server_highlight'] - off by default, as the
+pages get about twice as large; highlight() returns None
+when it cannot do the job, and callers should then leave it to prism
+
+results are cached on the (sha256 of the code, language) pair,
+so a file gets highlighted again only when it changes
+"""
+
+import re
+import html
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    from pygments.lexers import get_lexer_by_name
+    from pygments.token import Token
+    from pygments.util import ClassNotFound
+except ImportError:
+    Token = None
+
+from r2lab.settings import markdown_settings
+
+
+def split_lines(text):
+    """
+    like text.splitlines(keepends=True) but only on newlines
+    """
+    return [line for line in re.split(r'(?<=\n)', text) if line]
+
+
+def prism_classes():
+    """
+    pygments token type -> prism class
+    subtypes not mentioned here use the class of their parent
+    """
+    return {
+        Token.Comment: 'comment',
+        Token.Keyword: 'keyword',
+        Token.Keyword.Constant: 'boolean',
+        Token.Operator: 'operator',
+        Token.Operator.Word: 'keyword',
+        Token.Punctuation: 'punctuation',
+        Token.Name.Builtin: 'builtin',
+        Token.Name.Builtin.Pseudo: None,
+        Token.Name.Function: 'function',
+        Token.Name.Function.Magic: 'function',
+        Token.Name.Class: 'class-name',
+        Token.Name.Decorator: 'decorator',
+        Token.Name.Tag: 'tag',
+        Token.Name.Attribute: 'attr-name',
+        Token.Name.Variable: 'variable',
+        Token.String: 'string',
+        Token.Number: 'number',
+    }
+
+
+class Highlighter:
+
+    def __init__(self, *, size):
+        self.size = size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.classes = prism_classes() if Token is not None else {}
+
+    def prism_class(self, ttype):
+        while ttype is not None:
+            if ttype in self.classes:
+                return self.classes[ttype]
+            ttype = ttype.parent
+        return None
+
+    def lines(self, code, lang):
+        """
+        the highlighted html for code, as a list with one item per line
+        in split_lines(code); or None
+
+        each item is self-contained, so that lines can be cut
+        and reassembled, e.g. in a diff
+        """
+        if Token is None or not markdown_settings['server_highlight']:
+            return None
+        key = (hashlib.sha256(code.encode()).hexdigest(), lang)
+        with self.lock:
+            lines = self.cache.get(key)
+            if lines is not None:
+                self.cache.move_to_end(key)
+                return lines
+        try:
+            lexer = get_lexer_by_name(lang, stripnl=False, ensurenl=False)
+        except ClassNotFound:
+            return None
+        lines, line = [], ""
+        # consecutive tokens of the same class go in the same <span>
+        pending_class, pending = None, ""
+
+        def flush():
+            nonlocal line, pending
+            text = html.escape(pending, quote=False)
+            if text and pending_class:
+                line += f'<span class="token {pending_class}">{text}</span>'
+            else:
+                line += text
+            pending = ""
+
+        for ttype, value in lexer.get_tokens(code):
+            klass = self.prism_class(ttype)
+            if klass != pending_class:
+                flush()
+                pending_class = klass
+            *complete, last = value.split('\n')
+            for piece in complete:
+                pending += piece
+                flush()
+                lines.append(line + '\n')
+                line = ""
+            pending += last
+        flush()
+        if line:
+            lines.append(line)
+        # pygments turns \r into \n, and then our lines are off
+        if len(lines) != len(split_lines(code)):
+            return None
+        with self.lock:
+            self.cache[key] = lines
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+        return lines
+
+    def highlight(self, code, lang):
+        """
+        the highlighted html for code, or None
+        """
+        lines = self.lines(code, lang)
+        return None if lines is None else "".join(lines)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+
+highlighter = Highlighter(size=markdown_settings['highlight_cache_size'])
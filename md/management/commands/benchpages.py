@@ -0,0 +1,253 @@
+"""
+benchmark the rendering of the pages in markdown/
+
+    ./manage.py benchpages
+    ./manage.py benchpages --runs 50 --output bench.json
+    ./manage.py benchpages --baseline bench.json --threshold 0.2
+    ./manage.py benchpages --pages tuto README
+
+each page goes through the whole pipeline of md.views.markdown_page -
+parse, markdown, tags, template - as a logged-in user, so that pages
+with require_login get rendered too
+
+measurements take place in a fresh python process, so that they
+do not depend on what the current process has already imported or cached;
+for each page we report the median and 95th percentile latency, the peak
+of python memory allocated during one rendering, and the output size
+
+latencies come in 2 flavours: cold ones are measured after the
+in-memory caches (fragments, postprocess, highlight) have been cleared,
+so they show the actual cost of the pipeline; warm ones are measured
+on a page that was just rendered, so they show the cost of a cache hit
+
+with --baseline, pages whose cold p95 has grown by more than --threshold
+are reported as regressions, and the command fails
+"""
+
+import sys
+import math
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# the pages we care most about; they come first in reports
+KEY_PAGES = ('README-OAICI.md', 'tuto-')
+
+# a fake session, so that pages that require login get rendered
+FAKE_CONTEXT = {
+    'user_details': {
+        'email': 'bench@r2lab.inria.fr',
+        'hrn': 'onelab.bench',
+        'firstname': 'bench',
+        'lastname': 'mark',
+    },
+    'accounts': [],
+}
+
+
+def is_key(page):
+    return any(page.startswith(key) for key in KEY_PAGES)
+
+
+def percentile(values, ratio):
+    """
+    nearest-rank percentile of a non-empty list
+    """
+    ordered = sorted(values)
+    rank = max(1, math.ceil(ratio * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Command(BaseCommand):
+
+    help = "Benchmark the rendering of all markdown pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--runs", type=int, default=20,
+            help="how many times each page gets rendered")
+        parser.add_argument(
+            "--pages", nargs='*', default=[],
+            help="only pages whose name contains one of these")
+        parser.add_argument(
+            "--output", default=None,
+            help="store results in that JSON file")
+        parser.add_argument(
+            "--baseline", default=None,
+            help="a JSON file from a previous run to compare with")
+        parser.add_argument(
+            "--threshold", type=float, default=0.2,
+            help="p95 growth ratio above which a page is a regression")
+        # internal: run the measurements in this process,
+        # and store them in that file - stdout is not reliable as
+        # the rendering code has a few print() calls
+        parser.add_argument(
+            "--worker", default=None,
+            help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            results = self.measure(options['runs'], options['pages'])
+            with open(options['worker'], 'w') as output:
+                json.dump(results, output)
+            return
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as transfer:
+            manage = f"{settings.BASE_DIR}/manage.py"
+            command = [sys.executable, manage, "benchpages",
+                       "--worker", transfer.name,
+                       "--runs", str(options['runs'])]
+            if options['pages']:
+                command += ["--pages", *options['pages']]
+            completed = subprocess.run(command, capture_output=True,
+                                       text=True)
+            if completed.returncode != 0:
+                raise CommandError(completed.stderr)
+            with open(transfer.name) as feed:
+                results = json.load(feed)
+        self.report(results)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f"results stored in {options['output']}")
+        if options['baseline']:
+            with open(options['baseline']) as feed:
+                baseline = json.load(feed)
+            regressions = self.compare(results, baseline,
+                                       options['threshold'])
+            if regressions:
+                raise CommandError(f"{regressions} page(s) have regressed")
+
+    @staticmethod
+    def measure(runs, filters):
+        """
+        this runs in the worker process
+        """
+        # pylint: disable=import-outside-toplevel
+        import logging
+        import django
+        import markdown2
+        from django.test import RequestFactory
+        from django.contrib.auth.models import AnonymousUser
+        from md.catalogue import catalogue
+        from md.views import markdown_page, fragments
+        from md.postprocess import postprocessor
+        from md.highlight import highlighter
+        from r2lab.settings import markdown_settings
+
+        # we do not want to measure the log file
+        logging.getLogger('r2lab').setLevel(logging.WARNING)
+
+        factory = RequestFactory()
+
+        def request_for(page):
+            request = factory.get(f"/{page}")
+            request.session = {'r2lab_context': FAKE_CONTEXT}
+            request.user = AnonymousUser()
+            return request
+
+        def clear_caches():
+            fragments.clear()
+            postprocessor.clear()
+            highlighter.clear()
+
+        def timed(page, *, cold):
+            durations = []
+            for _ in range(runs):
+                if cold:
+                    clear_caches()
+                request = request_for(page)
+                start = time.perf_counter()
+                markdown_page(request, page)
+                durations.append(time.perf_counter() - start)
+            return durations
+
+        pages = [page.name for page in catalogue.all()
+                 if not filters
+                 or any(filter in page.name for filter in filters)]
+        results = {
+            'meta': {
+                'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'runs': runs,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'markdown2': markdown2.__version__,
+                'backend': markdown_settings['backend'],
+            },
+            'pages': {},
+        }
+        for page in pages:
+            # warm up - this also triggers the lazy imports
+            markdown_page(request_for(page), page)
+            clear_caches()
+            tracemalloc.start()
+            response = markdown_page(request_for(page), page)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            cold = timed(page, cold=True)
+            # the last cold run has filled the caches again
+            warm = timed(page, cold=False)
+            results['pages'][page] = {
+                'key': is_key(page),
+                'status': response.status_code,
+                'p50_ms': percentile(cold, .5) * 1000,
+                'p95_ms': percentile(cold, .95) * 1000,
+                'warm_p50_ms': percentile(warm, .5) * 1000,
+                'warm_p95_ms': percentile(warm, .95) * 1000,
+                'peak_kib': peak / 1024,
+                'bytes': len(response.content),
+            }
+        return results
+
+    def report(self, results):
+        pages = results['pages']
+        ordered = sorted(pages,
+                         key=lambda page: (not pages[page]['key'], page))
+        self.stdout.write(f"{'':<36} {'--- cold ms ---':>17}"
+                          f" {'--- warm ms ---':>17}")
+        self.stdout.write(f"{'page':<36} {'p50':>8} {'p95':>8}"
+                          f" {'p50':>8} {'p95':>8}"
+                          f" {'peak KiB':>9} {'bytes':>8}")
+        for page in ordered:
+            data = pages[page]
+            marker = "*" if data['key'] else " "
+            self.stdout.write(
+                f"{marker}{page:<35} {data['p50_ms']:8.1f}"
+                f" {data['p95_ms']:8.1f}"
+                f" {data['warm_p50_ms']:8.1f}"
+                f" {data['warm_p95_ms']:8.1f}"
+                f" {data['peak_kib']:9.0f} {data['bytes']:8}")
+        cold = sum(data['p50_ms'] for data in pages.values())
+        warm = sum(data['warm_p50_ms'] for data in pages.values())
+        self.stdout.write(f"{len(pages)} pages, sum of p50 = {cold:.1f} ms"
+                          f" cold, {warm:.1f} ms warm (* = key pages)")
+
+    def compare(self, results, baseline, threshold):
+        """
+        returns the number of regressions
+        """
+        regressions = 0
+        for page, data in sorted(results['pages'].items()):
+            before = baseline['pages'].get(page)
+            if before is None:
+                continue
+            ratio = data['p95_ms'] / before['p95_ms'] \
+                if before['p95_ms'] else 1.
+            if ratio > 1 + threshold:
+                regressions += 1
+                self.stdout.write(
+                    f"REGRESSION {page}: p95 {before['p95_ms']:.1f}"
+                    f" -> {data['p95_ms']:.1f} ms (x{ratio:.2f})")
+            elif ratio < 1 - threshold:
+                self.stdout.write(
+                    f"improved   {page}: p95 {before['p95_ms']:.1f}"
+                    f" -> {data['p95_ms']:.1f} ms (x{ratio:.2f})")
+        return regressions
@@ -0,0 +1,284 @@
+"""
+fingerprint and precompress the files in assets/r2lab
+
+    ./manage.py buildassets
+
+for each .js and .css file, this writes in assets/build/r2lab/
+* a copy named after a hash of its contents, e.g. livemap.1a2b3c4d5e.js
+* its .gz sibling, and its .br sibling if the brotli module is available
+
+references between these files - like in
+    import {Sidecar} from "/assets/r2lab/sidecar.js";
+    load_css("/assets/r2lab/livemap.css");
+are rewritten to point at the fingerprinted names, which is why
+files get processed in dependency order
+
+the mapping is stored in assets/build/manifest.json, see r2lab/assetmanifest.py
+
+in addition, for each family of pages that import the same modules,
+this writes in assets/build/bundles/ one bundle of these modules and one
+of their stylesheets - with source maps - and describes them in
+assets/build/bundles.json; see r2lab/bundler.py
+
+as this runs from make install every 10 minutes, nothing gets done if
+none of the inputs - the assets, but also the pages and what they
+include, and the code that renders them - has changed since the last
+build, unless --force is given; and the manifests are written only if
+their contents change, as their mtime invalidates some caches
+"""
+
+import gzip
+import json
+import hashlib
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from r2lab.assetmanifest import ASSETS_DIR, BUILD_DIR, MANIFEST, ASSET_URL_RE
+from r2lab.assetmanifest import BUNDLES_MANIFEST
+from r2lab import bundler
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+SOURCE_SUBDIR = "r2lab"
+SUFFIXES = ('.js', '.css')
+BUNDLES_SUBDIR = "bundles"
+# what the build depends on, relative to BASE_DIR
+INPUTS = ('assets/r2lab', 'markdown', 'templates', 'code', 'assets/code',
+          'md', 'r2lab/bundler.py', 'r2lab/assetmanifest.py')
+INPUTS_SUFFIXES = SUFFIXES + ('.md', '.html', '.py')
+# the digest of the inputs of the last build
+INPUTS_DIGEST = BUILD_DIR / "inputs.sha256"
+
+
+def write_precompressed(path, encoded):
+    """
+    write encoded in path, together with its .gz and .br siblings
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # names are hashes of the contents, so existing files are up to date
+    if not path.exists():
+        path.write_bytes(encoded)
+    # mtime=0 so that rebuilding yields the same bytes
+    gz = path.with_name(path.name + '.gz')
+    if not gz.exists():
+        gz.write_bytes(gzip.compress(encoded, compresslevel=9, mtime=0))
+    br = path.with_name(path.name + '.br')
+    if brotli and not br.exists():
+        br.write_bytes(brotli.compress(encoded))
+
+
+def inputs_digest():
+    """
+    a digest of the contents of all the inputs of the build
+    """
+    base = Path(settings.BASE_DIR)
+    paths = []
+    for name in INPUTS:
+        path = base / name
+        if path.is_file():
+            paths.append(path)
+        elif path.is_dir():
+            paths.extend(child for child in path.rglob('*')
+                         if child.suffix in INPUTS_SUFFIXES
+                         and child.is_file())
+    hasher = hashlib.sha256()
+    for path in sorted(paths):
+        hasher.update(str(path.relative_to(base)).encode('utf-8') + b'\0')
+        hasher.update(hashlib.sha256(path.read_bytes()).digest())
+    return hasher.hexdigest()
+
+
+class Command(BaseCommand):
+
+    help = "Build fingerprinted and precompressed versions of assets/r2lab"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action='store_true', default=False,
+            help="build even if no input has changed")
+
+    def handle(self, *args, **options):
+        inputs = inputs_digest()
+        if (not options['force'] and MANIFEST.exists()
+                and BUNDLES_MANIFEST.exists() and INPUTS_DIGEST.exists()
+                and INPUTS_DIGEST.read_text() == inputs):
+            self.stdout.write("no input has changed since the last build")
+            return
+        sources = {
+            f"{SOURCE_SUBDIR}/{path.name}": path.read_text(encoding='utf-8')
+            for path in sorted((ASSETS_DIR / SOURCE_SUBDIR).iterdir())
+            if path.suffix in SUFFIXES
+        }
+        manifest = {}
+        for path in self.dependency_order(sources):
+            # rewrite references using what is already in the manifest
+            contents = self.rewrite(sources[path], manifest)
+            encoded = contents.encode('utf-8')
+            digest = hashlib.sha256(encoded).hexdigest()[:10]
+            stem, suffix = path.rsplit('.', 1)
+            hashed = f"{BUILD_DIR.name}/{stem}.{digest}.{suffix}"
+            write_precompressed(ASSETS_DIR / hashed, encoded)
+            manifest[path] = hashed
+
+        self.cleanup(manifest)
+        self.store(MANIFEST, manifest)
+        compressions = ".gz and .br" if brotli else ".gz"
+        self.stdout.write(f"{len(manifest)} assets written in {BUILD_DIR}"
+                          f" with {compressions} siblings")
+
+        bundles = self.bundle(sources)
+        self.cleanup_bundles(bundles)
+        self.store(BUNDLES_MANIFEST, bundles)
+        self.stdout.write(f"{len(bundles['bundles'])} bundles written"
+                          f" for {len(bundles['pages'])} pages")
+        # last, so that a failed build gets done again
+        INPUTS_DIGEST.write_text(inputs)
+
+    @staticmethod
+    def store(path, contents):
+        text = json.dumps(contents, indent=2, sort_keys=True)
+        # the mtime of the manifests invalidates caches
+        if path.exists() and path.read_text() == text:
+            return
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(text)
+        tmp.replace(path)
+
+    def bundle(self, sources):
+        """
+        write the bundles, and return their manifest
+        """
+        # pylint: disable=import-outside-toplevel
+        from md.catalogue import catalogue
+        from md.backends import get_backend
+        from md.views import parse, resolve_tags
+        # what matters is what the pages actually import once rendered,
+        # including what they << include >>
+        pages = {}
+        for page in catalogue.all():
+            try:
+                html, _ = get_backend().convert(parse(page.name)[1])
+                pages[page.name] = resolve_tags(html)
+            except Exception as exc:            # pylint: disable=w0703
+                self.stderr.write(f"cannot render {page.name}:"
+                                  f" {type(exc).__name__} {exc}")
+        result = {'pages': {}, 'bundles': {}}
+        for entries, names in bundler.families(pages).items():
+            name = bundler.family_name(entries)
+            try:
+                modules = bundler.evaluation_order(entries, sources)
+                # nothing to gain with a single file
+                if len(modules) < 2:
+                    continue
+                stylesheets = []
+                for page in names:
+                    stylesheets.extend(bundler.page_entries(pages[page])[1])
+                for module in modules:
+                    stylesheets.extend(
+                        bundler.module_stylesheets(sources[module]))
+                stylesheets = list(dict.fromkeys(stylesheets))
+                css = None
+                if stylesheets:
+                    contents, source_map = bundler.bundle_css(
+                        stylesheets, sources, f"{name}.css")
+                    css = self.write_bundle(name, 'css', contents, source_map)
+                contents, source_map = bundler.bundle_js(
+                    modules, sources, f"{name}.js",
+                    f"/assets/{css}" if css else None)
+                js = self.write_bundle(name, 'js', contents, source_map)
+            except bundler.BundleError as exc:
+                self.stderr.write(f"cannot bundle {name}: {exc}")
+                continue
+            result['bundles'][name] = {
+                'entries': list(entries), 'modules': modules,
+                'stylesheets': stylesheets, 'js': js, 'css': css}
+            for page in names:
+                result['pages'][page] = name
+        return result
+
+    def write_bundle(self, name, suffix, contents, source_map):
+        """
+        returns the path of the bundle, relative to assets/
+        """
+        encoded = contents.encode('utf-8')
+        digest = hashlib.sha256(encoded).hexdigest()[:10]
+        hashed = f"{BUILD_DIR.name}/{BUNDLES_SUBDIR}/{name}.{digest}.{suffix}"
+        map_name = f"{name}.{digest}.{suffix}.map"
+        reference = f"//# sourceMappingURL={map_name}" if suffix == 'js' \
+            else f"/*# sourceMappingURL={map_name} */"
+        write_precompressed(ASSETS_DIR / hashed,
+                            encoded + f"{reference}\n".encode('utf-8'))
+        write_precompressed(ASSETS_DIR / f"{hashed}.map",
+                            source_map.json().encode('utf-8'))
+        return hashed
+
+    @staticmethod
+    def rewrite(contents, manifest):
+        def replace(match):
+            hashed = manifest.get(match.group('path'))
+            return f"/assets/{hashed}" if hashed else match.group(0)
+        return ASSET_URL_RE.sub(replace, contents)
+
+    def dependency_order(self, sources):
+        """
+        files that reference others come after them
+
+        in case of a cycle, the remaining files come in any order,
+        and keep their references to the non-fingerprinted names
+        """
+        depends = {
+            path: {match.group('path')
+                   for match in ASSET_URL_RE.finditer(contents)} & set(sources)
+            for path, contents in sources.items()
+        }
+        ordered = []
+        while depends:
+            ready = sorted(path for path, deps in depends.items()
+                           if deps - {path} <= set(ordered))
+            if not ready:
+                cycle = sorted(depends)
+                self.stderr.write(f"cyclic references between {cycle}")
+                ordered.extend(cycle)
+                break
+            for path in ready:
+                ordered.append(path)
+                del depends[path]
+        return ordered
+
+    @staticmethod
+    def cleanup_bundles(bundles):
+        """
+        remove the bundles of previous builds
+        """
+        keep = set()
+        for bundle in bundles['bundles'].values():
+            for hashed in (bundle['js'], bundle['css']):
+                if hashed:
+                    keep.add(ASSETS_DIR / hashed)
+                    keep.add(ASSETS_DIR / f"{hashed}.map")
+        directory = BUILD_DIR / BUNDLES_SUBDIR
+        if not directory.exists():
+            return
+        for path in directory.iterdir():
+            original = path.with_name(path.name.rsplit('.', 1)[0]) \
+                if path.suffix in ('.gz', '.br') else path
+            if original not in keep:
+                path.unlink()
+
+    @staticmethod
+    def cleanup(manifest):
+        """
+        remove the outputs of previous builds
+        """
+        keep = {ASSETS_DIR / hashed for hashed in manifest.values()}
+        for path in (BUILD_DIR / SOURCE_SUBDIR).iterdir():
+            original = path.with_name(path.name.rsplit('.', 1)[0]) \
+                if path.suffix in ('.gz', '.br') else path
+            if original not in keep:
+                path.unlink()
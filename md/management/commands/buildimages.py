@@ -0,0 +1,145 @@
+"""
+resized and webp versions of the images in assets/img and assets/code
+
+    ./manage.py buildimages
+    ./manage.py buildimages --jobs 8
+
+for each .png and .jpg file, and for each width in
+assets_settings['image_widths'] that is smaller than the image,
+this writes in assets/build/images/ a resized copy in the same format;
+and for each format in assets_settings['image_formats'], a copy
+in that format at each of these widths, plus the original one
+
+files are named after a hash of the source, e.g. D4.480w.1a2b3c4d5e.webp,
+so they can be cached forever, and are not computed again if present;
+images get processed in parallel, in a pool of processes
+
+the result is described in assets/build/images.json, which
+md/postprocess.py uses to turn <img> tags into <picture>s
+
+this requires Pillow; without it, this only prints a warning, and
+pages keep using the original images
+"""
+
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from r2lab.settings import assets_settings
+from r2lab.assetmanifest import (
+    ASSETS_DIR, BUILD_DIR, IMAGES_MANIFEST, IMAGE_TYPES)
+
+SOURCE_SUBDIRS = ('img', 'code')
+# pillow format names
+FORMATS = {'image/png': 'PNG', 'image/jpeg': 'JPEG', 'image/webp': 'WEBP'}
+IMAGES_SUBDIR = "images"
+
+
+def derive(relative, widths, formats):
+    """
+    runs in a worker process
+    creates the derivatives for one image, e.g. relative='code/D4.png'
+    and returns its entry in the manifest, or None
+    """
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image
+
+    source = ASSETS_DIR / relative
+    contents = source.read_bytes()
+    digest = hashlib.sha256(contents).hexdigest()[:10]
+    mimetype = IMAGE_TYPES[source.suffix.lower()]
+    stem = relative.rsplit('.', 1)[0]
+    variants = []
+    with Image.open(source) as image:
+        width, height = image.size
+        smaller = [w for w in widths if w < width]
+        wanted = [(w, mimetype) for w in smaller]
+        wanted += [(w, other) for other in formats
+                   for w in smaller + [width]]
+        for target_width, target_type in wanted:
+            extension = target_type.split('/')[1].replace('jpeg', 'jpg')
+            path = (f"{BUILD_DIR.name}/{IMAGES_SUBDIR}/"
+                    f"{stem}.{target_width}w.{digest}.{extension}")
+            output = ASSETS_DIR / path
+            if not output.exists():
+                target_height = round(height * target_width / width)
+                resized = image if target_width == width \
+                    else image.resize((target_width, target_height),
+                                      Image.LANCZOS)
+                if target_type == 'image/jpeg' and resized.mode != 'RGB':
+                    resized = resized.convert('RGB')
+                output.parent.mkdir(parents=True, exist_ok=True)
+                tmp = output.with_name(output.name + '.tmp')
+                resized.save(tmp, format=FORMATS[target_type],
+                             optimize=True, quality=80)
+                tmp.replace(output)
+            variants.append({'path': path, 'width': target_width,
+                             'type': target_type})
+    if not variants:
+        return None
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+class Command(BaseCommand):
+
+    help = "Build resized and webp versions of assets/img and assets/code"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--jobs", type=int, default=os.cpu_count(),
+            help="how many images to process in parallel")
+
+    def handle(self, *args, **options):
+        try:
+            import PIL                  # pylint: disable=import-outside-toplevel, unused-import
+        except ImportError:
+            self.stderr.write("buildimages requires Pillow - skipped")
+            return
+        sources = sorted(
+            f"{subdir}/{path.name}"
+            for subdir in SOURCE_SUBDIRS
+            for path in (ASSETS_DIR / subdir).iterdir()
+            if path.suffix.lower() in IMAGE_TYPES)
+        widths = sorted(assets_settings['image_widths'])
+        formats = [f"image/{format}"
+                   for format in assets_settings['image_formats']]
+        images = {}
+        with ProcessPoolExecutor(max_workers=options['jobs']) as executor:
+            futures = {relative: executor.submit(derive, relative,
+                                                 widths, formats)
+                       for relative in sources}
+            for relative, future in futures.items():
+                try:
+                    entry = future.result()
+                except Exception as exc:        # pylint: disable=w0703
+                    self.stderr.write(f"{relative}: {exc}")
+                    continue
+                if entry:
+                    images[relative] = entry
+
+        self.cleanup(images)
+        BUILD_DIR.mkdir(parents=True, exist_ok=True)
+        text = json.dumps(images, indent=2, sort_keys=True)
+        # its mtime invalidates caches, see buildassets
+        if (not IMAGES_MANIFEST.exists()
+                or IMAGES_MANIFEST.read_text() != text):
+            tmp = IMAGES_MANIFEST.with_suffix('.tmp')
+            tmp.write_text(text)
+            tmp.replace(IMAGES_MANIFEST)
+        count = sum(len(entry['variants']) for entry in images.values())
+        self.stdout.write(f"{count} versions of {len(images)} images"
+                          f" in {BUILD_DIR / IMAGES_SUBDIR}")
+
+    @staticmethod
+    def cleanup(images):
+        """
+        remove the outputs of previous builds
+        """
+        keep = {ASSETS_DIR / variant['path']
+                for entry in images.values() for variant in entry['variants']}
+        for path in (BUILD_DIR / IMAGES_SUBDIR).rglob('*'):
+            if path.is_file() and path not in keep:
+                path.unlink()
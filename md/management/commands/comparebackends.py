@@ -0,0 +1,150 @@
+"""
+compare two markdown engines over all the pages in markdown/
+
+    ./manage.py comparebackends --candidate python-markdown
+    ./manage.py comparebackends --candidate mistune --pages tuto --show-diffs
+
+for each page, the markdown contents is converted by both engines
+and our << tags >> resolved, just like md.views.render_markdown does;
+we then report
+* whether the resulting html is the same once normalized - i.e. ignoring
+  whitespace between tags, attribute order, and the various ways of
+  writing the same character
+* any << tag >> that was left unresolved, which would mean that the
+  engine escapes '<<' in a way our patterns do not know about
+* the speedup of the candidate over the reference
+* pages that one of the engines fails to convert
+"""
+
+import re
+import html
+import time
+import difflib
+from html.parser import HTMLParser
+
+from django.core.management.base import BaseCommand, CommandError
+
+from md.backends import BACKENDS, get_backend
+from md.catalogue import catalogue
+from md.views import parse, resolve_tags
+
+UNRESOLVED_RE = re.compile(
+    r'(&lt;|<)(&lt;|<)\s*(include|tuto_tabs|codediff|togglableoutput|codeview)\b')
+
+
+class Normalizer(HTMLParser):
+    """
+    turns html into a list of canonical lines, one per tag or text
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+
+    def handle_starttag(self, tag, attrs):
+        attributes = " ".join(f'{name}="{html.escape(value or "")}"'
+                              for name, value in sorted(attrs))
+        self.lines.append(f"<{tag} {attributes}>" if attributes
+                          else f"<{tag}>")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self.lines.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        text = " ".join(data.split())
+        if text:
+            self.lines.append(text)
+
+    @staticmethod
+    def normalize(text):
+        normalizer = Normalizer()
+        normalizer.feed(text)
+        normalizer.close()
+        return normalizer.lines
+
+
+class Command(BaseCommand):
+
+    help = "Compare the output and speed of two markdown engines"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reference", default='markdown2', choices=list(BACKENDS),
+            help="the engine used as a reference")
+        parser.add_argument(
+            "--candidate", required=True, choices=list(BACKENDS),
+            help="the engine to compare with the reference")
+        parser.add_argument(
+            "--runs", type=int, default=5,
+            help="how many conversions to time for each page")
+        parser.add_argument(
+            "--pages", nargs='*', default=[],
+            help="only pages whose name contains one of these")
+        parser.add_argument(
+            "--show-diffs", action='store_true', default=False,
+            help="show the first differences for each page")
+
+    def handle(self, *args, **options):
+        try:
+            backends = [get_backend(options['reference']),
+                        get_backend(options['candidate'])]
+        except ImportError as exc:
+            raise CommandError(f"engine not available: {exc}")
+
+        pages = [page.name for page in catalogue.all()
+                 if not options['pages']
+                 or any(filter in page.name for filter in options['pages'])]
+        same = 0
+        totals = [0., 0.]
+        self.stdout.write(f"{'page':<36} {'same':>5} {'unresolved':>11}"
+                          f" {'speedup':>8}")
+        for page in pages:
+            _, markdown = parse(page)
+            outputs, durations, unresolved = [], [], []
+            try:
+                for backend in backends:
+                    output, duration = self.convert(backend, markdown,
+                                                    options['runs'])
+                    outputs.append(Normalizer.normalize(output))
+                    durations.append(duration)
+                    unresolved.append(len(UNRESOLVED_RE.findall(output)))
+            except Exception as exc:                # pylint: disable=w0703
+                self.stdout.write(f"{page:<36} {backend.name} failed:"
+                                  f" {type(exc).__name__} {exc}")
+                continue
+            identical = outputs[0] == outputs[1]
+            same += identical
+            totals[0] += durations[0]
+            totals[1] += durations[1]
+            speedup = durations[0] / durations[1] if durations[1] else 0
+            self.stdout.write(
+                f"{page:<36} {'yes' if identical else 'NO':>5}"
+                f" {unresolved[0]:>5}/{unresolved[1]:<5} {speedup:7.2f}x")
+            if not identical and options['show_diffs']:
+                diff = difflib.unified_diff(
+                    outputs[0], outputs[1], lineterm="",
+                    fromfile=backends[0].name, tofile=backends[1].name, n=1)
+                for line in list(diff)[:30]:
+                    self.stdout.write(f"    {line}")
+        overall = totals[0] / totals[1] if totals[1] else 0
+        self.stdout.write(
+            f"{same}/{len(pages)} pages identical;"
+            f" {backends[1].name} is {overall:.2f}x as fast as"
+            f" {backends[0].name} overall")
+
+    @staticmethod
+    def convert(backend, markdown, runs):
+        """
+        returns the html - tags resolved - and the average time
+        """
+        start = time.perf_counter()
+        for _ in range(runs):
+            output, toc = backend.convert(markdown)
+        duration = (time.perf_counter() - start) / runs
+        output = resolve_tags(output)
+        if toc:
+            output = output.replace('[TOC]', toc)
+        return output, duration
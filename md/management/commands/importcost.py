@@ -0,0 +1,95 @@
+"""
+report on what a worker pays at startup, module by module
+
+runs a fresh python with -X importtime, that sets up django and loads
+the URL configuration - i.e. what a gunicorn worker does before it can
+serve its first request - and sums up the output
+
+    ./manage.py importcost
+    ./manage.py importcost --first-request --top 40
+"""
+
+import sys
+import os
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+
+# what a worker does at startup
+STARTUP = """
+import django
+django.setup()
+import r2lab.urls
+"""
+
+# what gets imported lazily upon the first requests
+FIRST_REQUEST = """
+import md.views
+import md.backends
+md.backends.get_backend()
+import plc.plcapiview
+import leases.views, slices.views, users.views, keys.views
+import mfauth.views
+import rhubarbe.plcapiproxy
+"""
+
+
+class Command(BaseCommand):
+
+    help = "Measure the cost of importing modules at worker startup"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--top", type=int, default=25,
+            help="how many modules to show, sorted on cumulative time")
+        parser.add_argument(
+            "--first-request", action='store_true', default=False,
+            help="also import what is deferred until the first requests")
+
+    def handle(self, *args, **options):
+        code = STARTUP
+        if options['first_request']:
+            code += FIRST_REQUEST
+        env = dict(os.environ)
+        env.setdefault("DJANGO_SETTINGS_MODULE", "r2lab.settings")
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(completed.stderr)
+        modules = self.parse(completed.stderr)
+        if not modules:
+            raise CommandError("could not find any importtime output")
+        # top-level imports are the ones with no indentation
+        total = sum(cumulative for _, cumulative, depth, _ in modules
+                    if depth == 0)
+        self.stdout.write(f"{len(modules)} modules imported"
+                          f" in {total/1000:.1f} ms")
+        self.stdout.write(f"{'self ms':>9} {'cumul ms':>9}  module")
+        ranked = sorted(modules, key=lambda t: t[1], reverse=True)
+        for self_us, cumulative, depth, name in ranked[:options['top']]:
+            self.stdout.write(f"{self_us/1000:9.1f} {cumulative/1000:9.1f}"
+                              f"  {'  '*depth}{name}")
+
+    @staticmethod
+    def parse(stderr):
+        """
+        returns a list of tuples (self_us, cumulative_us, depth, name)
+
+        lines look like
+        import time:       161 |        161 |     encodings.aliases
+        """
+        modules = []
+        for line in stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            try:
+                self_us, cumulative, name = line[12:].split("|")
+                self_us, cumulative = int(self_us), int(cumulative)
+            except ValueError:
+                # the header line
+                continue
+            stripped = name.lstrip()
+            depth = (len(name) - len(stripped) - 1) // 2
+            modules.append((self_us, cumulative, depth, stripped))
+        return modules
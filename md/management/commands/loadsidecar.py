@@ -0,0 +1,98 @@
+"""
+load-test the sidecar, or the relay, see relay/loadtest.py
+
+    ./manage.py standinsidecar --port 10002
+    ./manage.py runrelay --upstream ws://localhost:10002
+    ./manage.py loadsidecar --inject ws://localhost:10002 \\
+        --target ws://localhost:10001 --clients 200 --deltas \\
+        --rate nodes=50 --rate leases=0.5 --duration 30
+
+the changes are sent as info messages to the --inject url, so this is
+meant for the stand-in, never for the actual sidecar
+"""
+
+import json
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from r2lab.settings import relay_settings
+from relay.loadtest import LoadTest
+
+
+class Command(BaseCommand):
+
+    help = "Measure the latency and throughput of the sidecar or the relay"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--inject", default="ws://localhost:10000",
+            help="the sidecar to send the changes to")
+        parser.add_argument(
+            "--target", default=None,
+            help="where the clients connect - defaults to --inject")
+        parser.add_argument("--clients", type=int, default=10)
+        parser.add_argument(
+            "--rate", action='append', default=[],
+            help="category=changes-per-second, can be repeated;"
+                 " defaults to nodes=10")
+        parser.add_argument(
+            "--deltas", action='store_true', default=False,
+            help="have the clients ask the relay for deltas")
+        parser.add_argument(
+            "--binary", action='store_true', default=False,
+            help="have the clients ask the relay for binary frames")
+        parser.add_argument(
+            "--duration", type=float, default=10, help="in seconds")
+        parser.add_argument(
+            "--drain", type=float, default=1,
+            help="how long to wait for the last messages, in seconds")
+        parser.add_argument(
+            "--json", action='store_true', default=False,
+            help="output the report as json, e.g. to compare runs")
+
+    def handle(self, *args, **options):
+        if options['inject'] == relay_settings['upstream_url']:
+            raise CommandError("refusing to inject changes"
+                               " in the actual sidecar")
+        rates = {}
+        for rate in options['rate'] or ["nodes=10"]:
+            try:
+                category, per_second = rate.split('=')
+                rates[category] = float(per_second)
+            except ValueError:
+                raise CommandError(f"invalid rate {rate}")
+            if category not in relay_settings['categories']:
+                raise CommandError(f"unknown category {category}")
+        load_test = LoadTest(
+            inject_url=options['inject'],
+            target_url=options['target'] or options['inject'],
+            rates=rates, nb_clients=options['clients'],
+            deltas=options['deltas'], binary=options['binary'],
+            duration=options['duration'],
+            drain=options['drain'])
+        try:
+            report = asyncio.run(load_test.run())
+        except (OSError, ConnectionError) as exc:
+            raise CommandError(f"cannot inject in {options['inject']}"
+                               f" - {exc}")
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f"{report['connected']}/{report['clients']} clients"
+            f" over {report['elapsed']:.1f}s")
+        for error in report['errors']:
+            self.stderr.write(f"  {error}")
+        self.stdout.write(
+            f"injected {report['injected_per_second']:.1f} changes/s"
+            f" {report['injected']}")
+        self.stdout.write(
+            f"delivered {report['delivered']}"
+            f" ({100 * report['delivered_ratio']:.1f}%),"
+            f" {report['messages_per_second']:.0f} messages/s,"
+            f" {report['bytes_per_second'] / 1024:.0f} KiB/s")
+        self.stdout.write(
+            "latency " + ", ".join(f"{point} {value:.1f}ms"
+                                   for point, value
+                                   in report['latency_ms'].items()))
@@ -0,0 +1,53 @@
+"""
+run the relay between the browsers and the sidecar, see relay/
+
+    ./manage.py runrelay
+    ./manage.py runrelay --upstream ws://localhost:10002 --port 10001
+"""
+
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from r2lab.settings import relay_settings
+from relay.server import Relay
+from relay.snapshot import SNAPSHOT_FILE
+from relay.history import History
+from relay.bus import BUS_ADDRESS
+
+
+class Command(BaseCommand):
+
+    help = "Relay the sidecar to the browsers over a single connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--upstream", default=relay_settings['upstream_url'],
+            help="the url of the sidecar")
+        parser.add_argument(
+            "--host", default=relay_settings['host'])
+        parser.add_argument(
+            "--port", type=int, default=relay_settings['port'])
+
+    def handle(self, *args, **options):
+        relay = Relay(
+            options['upstream'],
+            categories=relay_settings['categories'],
+            merged_categories=relay_settings['merged_categories'],
+            forwarded_requests=relay_settings['forwarded_requests'],
+            reconnect_delay=relay_settings['reconnect_delay'],
+            snapshot_every=relay_settings['snapshot_every'],
+            snapshot_file=SNAPSHOT_FILE,
+            snapshot_period=relay_settings['snapshot_period'],
+            history=History(relay_settings['history_dir'],
+                            resolutions=relay_settings['history_resolutions'],
+                            writable=True),
+            history_fields=relay_settings['history_fields'],
+            bus_address=BUS_ADDRESS,
+            bus_timeout=relay_settings['bus_timeout'])
+        self.stdout.write(f"relaying {options['upstream']}"
+                          f" on {options['host']}:{options['port']}")
+        try:
+            asyncio.run(relay.serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
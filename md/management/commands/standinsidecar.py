@@ -0,0 +1,33 @@
+"""
+run a stand-in for the sidecar, to test the relay - or the pages - locally
+
+    ./manage.py standinsidecar --port 10002 --period 2
+    ./manage.py runrelay --upstream ws://localhost:10002
+"""
+
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from relay.standin import StandinSidecar
+
+
+class Command(BaseCommand):
+
+    help = "Run a local stand-in for the sidecar, with made-up nodes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default='localhost')
+        parser.add_argument("--port", type=int, default=10000)
+        parser.add_argument(
+            "--period", type=float, default=0,
+            help="change a node every so many seconds - 0 for never")
+
+    def handle(self, *args, **options):
+        sidecar = StandinSidecar(period=options['period'])
+        self.stdout.write(f"stand-in sidecar on"
+                          f" {options['host']}:{options['port']}")
+        try:
+            asyncio.run(sidecar.serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,172 @@
+"""
+local copies of the third-party libraries in templates/r2lab/corelibs.html
+
+    ./manage.py vendorlibs
+    ./manage.py vendorlibs --mirror /path/to/a/copy/of/the/cdn
+
+for each library in vendor_settings['libraries'], this fetches the
+pinned files from the cdn, and writes in assets/build/vendor/
+* a copy - or the concatenation of the files - named after a hash
+  of its contents, e.g. jquery.1a2b3c4d5e.js
+* its .gz and .br siblings, like buildassets does
+
+the font-awesome stylesheets are reduced to the icons that we use,
+and only refer to woff2 and woff fonts, that get vendored as well;
+if fontTools is available, the fonts are reduced to the same icons
+so this needs to run again when a page starts using a new icon
+
+the result, including the sha384 of each file for subresource
+integrity, is described in assets/build/vendor.json; the {% vendored %}
+template tag uses it, and falls back on the cdn if it is not there
+
+this is not part of make install, it is meant to run by hand when
+vendor_settings change; if a file cannot be fetched, this fails,
+and the results of the previous run are left untouched
+"""
+
+import json
+import hashlib
+from urllib.parse import urljoin
+from urllib.request import urlopen
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from r2lab.settings import vendor_settings
+from r2lab.assetmanifest import ASSETS_DIR, BUILD_DIR, VENDOR_MANIFEST
+from r2lab import vendoring
+from md.management.commands.buildassets import write_precompressed
+
+VENDOR_SUBDIR = "vendor"
+SOURCE_SUFFIXES = ('.html', '.md', '.js', '.css', '.py')
+
+
+class FetchError(Exception):
+    pass
+
+
+class Command(BaseCommand):
+
+    help = "Fetch the third-party libraries, to serve them ourselves"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mirror", default=None,
+            help="a directory to read the files from, laid out like the cdn")
+
+    def handle(self, *args, **options):
+        self.mirror = options['mirror']
+        self.written = set()
+        sources = self.icon_sources()
+        names = (vendoring.used_icons(sources)
+                 | set(vendor_settings['extra_icons']))
+        codepoints = vendoring.used_codepoints(sources)
+
+        vendored = {}
+        for name, paths in vendor_settings['libraries'].items():
+            suffix = paths[0].rsplit('.', 1)[1]
+            try:
+                pieces = [(path, self.fetch(path).decode('utf-8'))
+                          for path in paths]
+                if name in vendor_settings['icon_libraries']:
+                    pieces = self.subset(pieces, names, codepoints)
+            except (FetchError, UnicodeDecodeError) as exc:
+                # before writing vendor.json or cleaning up
+                raise CommandError(f"{name}: {exc}"
+                                   " - keeping the previous copies")
+            contents = "\n".join(vendoring.strip_source_map(text)
+                                 for _, text in pieces)
+            encoded = contents.encode('utf-8')
+            digest = hashlib.sha256(encoded).hexdigest()[:10]
+            hashed = (f"{BUILD_DIR.name}/{VENDOR_SUBDIR}/"
+                      f"{name}.{digest}.{suffix}")
+            write_precompressed(ASSETS_DIR / hashed, encoded)
+            self.written.add(ASSETS_DIR / hashed)
+            vendored[name] = {
+                'path': hashed,
+                'integrity': vendoring.integrity(encoded),
+                'sources': [f"{vendor_settings['cdn']}{path}"
+                            for path in paths],
+            }
+            self.stdout.write(f"{name}: {len(encoded)} bytes in {hashed}")
+
+        self.cleanup()
+        tmp = VENDOR_MANIFEST.with_suffix('.tmp')
+        tmp.write_text(json.dumps(vendored, indent=2, sort_keys=True))
+        tmp.replace(VENDOR_MANIFEST)
+
+    def fetch(self, path):
+        """
+        the contents of a file, given its path relative to the cdn
+        raises FetchError if it cannot be read
+        """
+        try:
+            if self.mirror:
+                return (Path(self.mirror) / path).read_bytes()
+            with urlopen(f"{vendor_settings['cdn']}{path}",
+                         timeout=30) as feed:
+                return feed.read()
+        except OSError as exc:
+            raise FetchError(f"{path}: {exc}") from exc
+
+    @staticmethod
+    def icon_sources():
+        base = Path(settings.BASE_DIR)
+        return sorted(
+            path
+            for subdir in vendor_settings['icon_sources']
+            for path in (base / subdir).rglob('*')
+            if path.suffix in SOURCE_SUFFIXES and path.is_file())
+
+    def subset(self, pieces, names, codepoints):
+        """
+        the stylesheets in pieces, reduced to the icons in names,
+        and with their fonts vendored
+        """
+        subsets = []
+        for path, text in pieces:
+            text, shown = vendoring.subset_icons(text, names)
+            subsets.append((path, text))
+            codepoints = codepoints | shown
+
+        result = []
+        for path, text in subsets:
+            def replace(url, path=path):
+                # relative to the stylesheet, e.g. ../fonts/x.woff2?v=4.7.0
+                font_path = urljoin(path, url.split('?')[0].split('#')[0])
+                return self.vendor_font(font_path, codepoints)
+            result.append((path, vendoring.rewrite_font_faces(text, replace)))
+        return result
+
+    def vendor_font(self, path, codepoints):
+        """
+        returns the name of our copy, that sits next to the stylesheets
+        """
+        contents = self.fetch(path)
+        stem, suffix = path.rsplit('/', 1)[-1].rsplit('.', 1)
+        subset = vendoring.subset_font(contents, codepoints, suffix)
+        if subset is None:
+            self.stderr.write(f"{path}: could not subset,"
+                              " keeping the whole font")
+        else:
+            contents = subset
+        digest = hashlib.sha256(contents).hexdigest()[:10]
+        hashed = f"{stem}.{digest}.{suffix}"
+        output = BUILD_DIR / VENDOR_SUBDIR / hashed
+        output.parent.mkdir(parents=True, exist_ok=True)
+        # fonts are compressed already
+        output.write_bytes(contents)
+        self.written.add(output)
+        self.stdout.write(f"  {path}: {len(contents)} bytes")
+        return hashed
+
+    def cleanup(self):
+        """
+        remove the outputs of previous runs
+        """
+        for path in (BUILD_DIR / VENDOR_SUBDIR).iterdir():
+            original = path.with_name(path.name.rsplit('.', 1)[0]) \
+                if path.suffix in ('.gz', '.br') else path
+            if original not in self.written:
+                path.unlink()
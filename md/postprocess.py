@@ -0,0 +1,297 @@
+"""
+the last stage in rendering a page, once its html is complete
+
+* whitespace is collapsed and comments removed, except inside
+  <pre>, <textarea>, <script> and <style>
+* images get loading="lazy" and decoding="async", and width and height
+  when we can read them from the file, so the layout does not jump
+  while they come in
+* images that ./manage.py buildimages has derived smaller or webp versions
+  of are turned into a <picture> with srcset's
+* we collect preload hints for the assets used in the page body,
+  including what the es modules there import in turn
+
+this is turned off with markdown_settings['postprocess']; results are
+cached on the sha256 of the html, so pages get processed again only
+when their contents - or the assets manifests - change
+"""
+
+import re
+import struct
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+from django.conf import settings
+
+from r2lab.settings import markdown_settings
+from r2lab.assetmanifest import ASSETS_DIR, IMAGE_TYPES, images
+from r2lab.assetmanifest import version as asset_manifest_version
+
+# comments, and the elements where whitespace matters
+PROTECTED_RE = re.compile(
+    r'<!--.*?-->|<(?P<tag>pre|textarea|script|style)\b.*?</(?P=tag)\s*>',
+    re.DOTALL | re.IGNORECASE)
+WHITESPACE_RE = re.compile(r'\s+')
+
+IMG_RE = re.compile(r'<img\b(?P<attributes>[^>]*?)\s*/?>', re.IGNORECASE)
+SRC_RE = re.compile(r'''\bsrc\s*=\s*["']?(?P<src>[^"'\s>]+)''', re.IGNORECASE)
+WIDTH_RE = re.compile(r'''\bwidth\s*=\s*["']?(?P<width>\d+)(px)?["'\s]''',
+                      re.IGNORECASE)
+HEIGHT_RE = re.compile(r'''\bheight\s*=\s*["']?(?P<height>\d+)(px)?["'\s]''',
+                       re.IGNORECASE)
+
+# local references to assets
+IMPORT_RE = re.compile(
+    r'''\bimport\s*(?:[\w{}\s,*]*?\bfrom\s*)?["'](?P<url>/assets/[^"']+\.js)["']''')
+CSS_RE = re.compile(
+    r'''(?:load_css\(|@import\s+url\()\s*["'](?P<url>/assets/[^"']+\.css)["']''')
+SCRIPT_SRC_RE = re.compile(
+    r'''<script\b[^>]*\bsrc=["'](?P<url>/assets/[^"']+\.js)["']''')
+
+# the directories that images can be served from, see r2lab/urls.py
+STATIC_DIRS = ('assets', 'raw', 'code')
+
+
+# rel is 'preload' or 'modulepreload', kind is the 'as' attribute
+Hint = namedtuple('Hint', ['rel', 'url', 'kind'])
+
+
+def local_path(url):
+    """
+    the file behind a url like /assets/img/foo.png, or None
+    """
+    url = url.split('?')[0].split('#')[0].lstrip('/')
+    if '..' in url or url.split('/')[0] not in STATIC_DIRS:
+        return None
+    return Path(settings.BASE_DIR) / url
+
+
+def read_image_size(path):
+    """
+    (width, height) from the header of a png, gif or jpeg file, or None
+    """
+    with path.open('rb') as feed:
+        head = feed.read(26)
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if not head.startswith(b'\xff\xd8'):
+            return None
+        # jpeg: walk the segments until a start-of-frame
+        feed.seek(2)
+        while True:
+            marker = feed.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return None
+            if marker[1] in (0xd8, 0x01) or 0xd0 <= marker[1] <= 0xd7:
+                continue
+            length = feed.read(2)
+            if len(length) < 2:
+                return None
+            length, = struct.unpack('>H', length)
+            if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+                frame = feed.read(5)
+                if len(frame) < 5:
+                    return None
+                height, width = struct.unpack('>HH', frame[1:5])
+                return width, height
+            feed.seek(length - 2, 1)
+
+
+class FileMemo:
+    """
+    path -> function(path), computed again when the file's mtime changes
+    None if the file cannot be read
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.memo = {}
+
+    def __call__(self, path):
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return None
+        known = self.memo.get(path)
+        if known and known[0] == mtime:
+            return known[1]
+        try:
+            value = self.function(path)
+        except (OSError, struct.error):
+            value = None
+        self.memo[path] = (mtime, value)
+        return value
+
+
+image_size = FileMemo(read_image_size)
+
+
+def read_references(path):
+    """
+    the js modules and css files that a js module refers to
+    """
+    text = path.read_text(encoding='utf-8')
+    return ([match.group('url') for match in IMPORT_RE.finditer(text)],
+            [match.group('url') for match in CSS_RE.finditer(text)])
+
+
+module_references = FileMemo(read_references)
+
+
+def minify(html):
+    """
+    collapse whitespace and remove comments outside of protected elements
+    """
+    def collapse(text):
+        # keep newlines, in case some inline js depends on them
+        return WHITESPACE_RE.sub(
+            lambda match: '\n' if '\n' in match.group() else ' ', text)
+    pieces, end = [], 0
+    for match in PROTECTED_RE.finditer(html):
+        pieces.append(collapse(html[end:match.start()]))
+        protected = match.group()
+        # keep ie conditional comments
+        if not protected.startswith('<!--') or protected.startswith('<!--[if'):
+            pieces.append(protected)
+        end = match.end()
+    pieces.append(collapse(html[end:]))
+    return "".join(pieces)
+
+
+def derived_picture(attributes, src, path, entry):
+    """
+    the <img> tag gets a srcset with the versions in its own format,
+    and if other formats are available it goes in a <picture> with one
+    <source> for each
+
+    entry describes the derived versions, see r2lab/assetmanifest.images()
+    """
+    # how wide the image shows, if we can tell
+    width = WIDTH_RE.search(attributes + " ")
+    height = HEIGHT_RE.search(attributes + " ")
+    if width:
+        shown = int(width.group('width'))
+    elif height:
+        shown = round(int(height.group('height'))
+                      * entry['width'] / entry['height'])
+    else:
+        shown = None
+    sizes = f"(max-width: {shown}px) 100vw, {shown}px" if shown else "100vw"
+    own_type = IMAGE_TYPES.get(path.suffix.lower())
+    srcsets = OrderedDict()
+    for variant in entry['variants']:
+        srcsets.setdefault(variant['type'], []).append(
+            f"/assets/{variant['path']} {variant['width']}w")
+    # the original is the largest one in its format
+    srcsets.setdefault(own_type, []).append(f"{src} {entry['width']}w")
+    img = (f'<img{attributes} srcset="{", ".join(srcsets[own_type])}"'
+           f' sizes="{sizes}">')
+    sources = "".join(
+        f'<source type="{mimetype}" srcset="{", ".join(srcset)}"'
+        f' sizes="{sizes}">'
+        for mimetype, srcset in srcsets.items() if mimetype != own_type)
+    return f"<picture>{sources}{img}</picture>" if sources else img
+
+
+def improve_images(html):
+    """
+    lazy loading, async decoding, intrinsic size where possible,
+    and derived versions if they have been built
+    """
+    derived = images()
+
+    def improve(match):
+        attributes = match.group('attributes')
+        lower = attributes.lower()
+        additions = ""
+        if 'loading=' not in lower:
+            additions += ' loading="lazy"'
+        if 'decoding=' not in lower:
+            additions += ' decoding="async"'
+        src = SRC_RE.search(attributes)
+        path = local_path(src.group('src')) if src else None
+        if 'width=' not in lower and 'height=' not in lower:
+            size = image_size(path) if path else None
+            if size:
+                additions += f' width="{size[0]}" height="{size[1]}"'
+        entry = None
+        if path and 'srcset=' not in lower:
+            try:
+                entry = derived.get(str(path.relative_to(ASSETS_DIR)))
+            except ValueError:
+                pass
+        if entry:
+            return derived_picture(attributes + additions,
+                                   src.group('src'), path, entry)
+        if not additions:
+            return match.group()
+        return f"<img{attributes}{additions}>"
+    return IMG_RE.sub(improve, html)
+
+
+def preload_hints(html):
+    """
+    the list of Hint's for the assets used in html
+    """
+    hints = OrderedDict()
+    modules = [match.group('url') for match in IMPORT_RE.finditer(html)]
+    for match in SCRIPT_SRC_RE.finditer(html):
+        hints.setdefault(match.group('url'),
+                         Hint('preload', match.group('url'), 'script'))
+    for match in CSS_RE.finditer(html):
+        hints.setdefault(match.group('url'),
+                         Hint('preload', match.group('url'), 'style'))
+    # follow the imports
+    while modules:
+        url = modules.pop(0)
+        if url in hints:
+            continue
+        hints[url] = Hint('modulepreload', url, None)
+        path = local_path(url)
+        references = module_references(path) if path else None
+        if references:
+            imports, stylesheets = references
+            modules.extend(imports)
+            for css in stylesheets:
+                hints.setdefault(css, Hint('preload', css, 'style'))
+    return list(hints.values())
+
+
+class PostProcessor:
+
+    def __init__(self, *, size):
+        self.size = size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def process(self, html):
+        """
+        returns a tuple (html, hints)
+        """
+        if not markdown_settings['postprocess']:
+            return html, []
+        # the images manifest matters too
+        key = (hashlib.sha256(html.encode()).hexdigest(),
+               asset_manifest_version())
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                return result
+        result = (minify(improve_images(html)), preload_hints(html))
+        with self.lock:
+            self.cache[key] = result
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+
+postprocessor = PostProcessor(size=markdown_settings['postprocess_cache_size'])
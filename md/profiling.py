@@ -0,0 +1,190 @@
+"""
+where does the time go when rendering a markdown page
+
+* each rendering is split in stages - parse, markdown, tags, assets,
+  template - that are timed, together with a few counters like the
+  number of includes and the size of what each stage produces;
+  this ends up in the log, in the r2lab_render_seconds histograms
+  on /metrics, and in the Server-Timing header
+
+* superusers can add ?profile=<mode> to a page URL to get, instead of
+  the page, a profile of its rendering; mode is one of
+  * text: the top of a cProfile report, sorted on cumulative time
+  * pstats: a cProfile dump, for snakeviz or flameprof
+  * collapsed: one line per call stack with its self time in
+    microseconds, the input format of flamegraph.pl or speedscope
+"""
+
+import io
+import sys
+import time
+import marshal
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+from django.http import HttpResponse
+
+from r2lab.settings import logger
+from r2lab.metrics import registry, record_stage
+
+# the stats for the rendering going on in the current thread, if any
+_current = threading.local()
+
+# page -> stage -> [count, total seconds], for the averages in the log
+_aggregated = defaultdict(lambda: defaultdict(lambda: [0, 0.]))
+_aggregated_lock = threading.Lock()
+
+
+class RenderStats:
+    """
+    the timings and counters for one rendering
+    """
+
+    def __init__(self, page):
+        self.page = page
+        # stage -> seconds, in order of appearance
+        self.stages = {}
+        # e.g. 'includes' -> how many, or 'html_bytes' -> size
+        self.counters = defaultdict(int)
+
+    def summary(self):
+        parts = [f"{stage}={duration*1000:.1f}ms"
+                 for stage, duration in self.stages.items()]
+        parts += [f"{counter}={value}"
+                  for counter, value in self.counters.items()]
+        return " ".join(parts)
+
+
+@contextmanager
+def rendering(page):
+    """
+    collect stats for the rendering of page in the enclosed block
+    """
+    stats = RenderStats(page)
+    _current.stats = stats
+    try:
+        yield stats
+    finally:
+        _current.stats = None
+    with _aggregated_lock:
+        aggregates = _aggregated[page]
+        for name, duration in stats.stages.items():
+            aggregates[name][0] += 1
+            aggregates[name][1] += duration
+        averages = " ".join(f"{name}={total/number*1000:.1f}ms"
+                            for name, (number, total) in aggregates.items())
+        renders = max((number for number, _ in aggregates.values()),
+                      default=0)
+    logger.info(f"Rendered {page}: {stats.summary()}"
+                f" - average over {renders} renders: {averages}")
+
+
+@contextmanager
+def stage(name):
+    """
+    time a stage of the current rendering; a no-op outside of rendering()
+    """
+    stats = getattr(_current, 'stats', None)
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        stats.stages[name] = stats.stages.get(name, 0.) + duration
+        registry.observe('r2lab_render_seconds',
+                         {'stage': name, 'page': stats.page}, duration)
+        record_stage(name, duration)
+
+
+def count(counter, value=1):
+    """
+    bump a counter of the current rendering, if any
+    """
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats.counters[counter] += value
+
+
+########## one-shot profiles
+def profile_text(function):
+    profile = cProfile.Profile()
+    profile.runcall(function)
+    output = io.StringIO()
+    pstats.Stats(profile, stream=output) \
+        .sort_stats('cumulative').print_stats(60)
+    return HttpResponse(output.getvalue(), content_type='text/plain')
+
+
+def profile_pstats(function):
+    profile = cProfile.Profile()
+    profile.runcall(function)
+    profile.create_stats()
+    response = HttpResponse(marshal.dumps(profile.stats),
+                            content_type='application/octet-stream')
+    response['Content-Disposition'] = 'attachment; filename="render.prof"'
+    return response
+
+
+def profile_collapsed(function):
+    """
+    trace all python calls, and accumulate self time per call stack
+    """
+    # the labels of the functions currently running
+    stack = []
+    # ';'-joined stack -> seconds spent in its topmost function
+    self_time = defaultdict(float)
+    # when the last event occurred
+    last = [time.perf_counter()]
+
+    def label(frame):
+        code = frame.f_code
+        filename = code.co_filename.rsplit('/', 1)[-1]
+        return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+    def tracer(frame, event, arg):                  # pylint: disable=w0613
+        now = time.perf_counter()
+        if stack:
+            self_time[";".join(stack)] += now - last[0]
+        if event == 'call':
+            stack.append(label(frame))
+        elif event == 'c_call':
+            stack.append(f"{arg.__qualname__} (builtin)")
+        elif event in ('return', 'c_return', 'c_exception') and stack:
+            stack.pop()
+        last[0] = time.perf_counter()
+
+    sys.setprofile(tracer)
+    try:
+        function()
+    finally:
+        sys.setprofile(None)
+    lines = [f"{path} {int(seconds * 1_000_000)}"
+             for path, seconds in self_time.items()
+             if seconds >= 1e-6]
+    return HttpResponse("\n".join(lines) + "\n", content_type='text/plain')
+
+
+PROFILERS = {
+    'text': profile_text,
+    'pstats': profile_pstats,
+    'collapsed': profile_collapsed,
+}
+
+
+def profiled_response(mode, function):
+    """
+    run function - that renders a page - under the profiler for mode
+    and return the profile instead of the page
+    """
+    profiler = PROFILERS.get(mode)
+    if profiler is None:
+        return HttpResponse(
+            f"unknown profile mode {mode}, use one of {', '.join(PROFILERS)}",
+            status=400, content_type='text/plain')
+    return profiler(function)
@@ -0,0 +1,12 @@
+from django.template import Library
+from django.utils.safestring import mark_safe
+
+from r2lab.assetmanifest import asset_url, vendored_tags
+
+register = Library()
+register.simple_tag(asset_url, name='asset')
+
+
+@register.simple_tag
+def vendored(name):
+    return mark_safe(vendored_tags(name))
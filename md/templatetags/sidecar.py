@@ -0,0 +1,25 @@
+import json
+
+from django.template import Library
+from django.utils.safestring import mark_safe
+
+from relay.snapshot import embedded_snapshot
+
+register = Library()
+
+
+@register.simple_tag
+def sidecar_snapshot(categories):
+    """
+    categories comes from the page's sidecar_snapshot metavar,
+    e.g. "nodes phones"; sidecar.js picks this up
+    """
+    if not categories:
+        return ""
+    snapshot = embedded_snapshot(categories.split())
+    if snapshot is None:
+        return ""
+    # so that no string can close the <script>
+    text = json.dumps(snapshot).replace('<', '\\u003c')
+    return mark_safe(f'<script type="application/json"'
+                     f' id="sidecar-snapshot">{text}</script>')
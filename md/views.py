@@ -8,19 +8,31 @@ mostly concerned with expanding our local macros like << codeview ... >>>
 
 from pathlib import Path
 import re
+import difflib
 import traceback
-
-# WARNING: version 2.3.6 of markdown2 breaks it for me
-# see https://github.com/trentm/python-markdown2/issues/311
-import markdown2 as markdown_module
+from urllib.parse import urlencode
 
 from django.shortcuts import render
-from django.http import HttpResponseNotFound, HttpResponseRedirect
+from django.template.loader import render_to_string
+from django.http import HttpResponse, HttpResponseNotFound, \
+    HttpResponseRedirect, HttpResponseBadRequest
+from django.utils.cache import patch_cache_control
+from django.utils.html import escape, escapejs
 from django.views.decorators.csrf import csrf_protect
 from django.utils.safestring import mark_safe
 
 from django.conf import settings
-from r2lab.settings import logger, sidecar_url
+from r2lab.settings import logger, sidecar_url, markdown_settings
+from r2lab.assetmanifest import rewrite_asset_urls, rewrite_bundle_urls
+from r2lab.assetmanifest import version as asset_manifest_version
+
+from .catalogue import catalogue, match_meta, MARKDOWN_SUBDIR
+from .profiling import rendering, stage, count, profiled_response
+# the markdown engine is configurable, see backends.py
+from .backends import get_backend
+from .fragments import FragmentCache
+from .highlight import highlighter, split_lines
+from .postprocess import postprocessor
 
 """
 Initially a simple view to translate a .md into html on the fly
@@ -41,11 +53,11 @@ looks a little scary / time-consuming
 """
 
 # pages that require login sohuld define the 'require_login' metavar
+# this is known before rendering, see catalogue.py
 
-# search for markdown input in the markdown/ subdir
+# search for markdown input in the markdown/ subdir - see catalogue.py
 # and code in the "code/" subdir
 # xxx should be configurable
-MARKDOWN_SUBDIR = "markdown"
 INCLUDE_PATHS = [
     MARKDOWN_SUBDIR,
     "templates",
@@ -53,26 +65,29 @@ INCLUDE_PATHS = [
     "assets/code",
 ]
 
-METAVAR_RE = re.compile(r"\A(?P<name>[\S_]+):\s*(?P<value>.*)\Z")
-
 
-def normalize(filename):
+def locate_include(filename):
     """
-    returns foo.md for an input that would be either foo, foo.md or foo.html
+    the Path where filename gets included from, or None
     """
-    return filename.replace(".md", "") + ".md"
+    for path in INCLUDE_PATHS:
+        fullpath = Path(settings.BASE_DIR) / path / filename
+        if fullpath.is_file():
+            return fullpath
+    return None
+
 
+# the expansions of codediff, togglableoutput and codeview tags
+# are cached, see fragments.py
+fragments = FragmentCache(
+    locate_include, size=markdown_settings['fragment_cache_size'])
 
-def match_meta(line):
+
+def normalize(filename):
     """
-    for parsing the header that defines metavariables
-    returns a tuple (name, value), or None
+    returns foo.md for an input that would be either foo, foo.md or foo.html
     """
-    # remove trailing newline
-    match = METAVAR_RE.match(line[:-1])
-    if match:
-        return match.group('name'), match.group('value')
-    return None
+    return filename.replace(".md", "") + ".md"
 
 
 def parse(markdown_file):
@@ -310,8 +325,9 @@ def implement_include(filename, tag):
     """
     if not filename:
         return ""
-    for path in INCLUDE_PATHS:
-        fullpath = Path(settings.BASE_DIR) / path / filename
+    count('includes')
+    fullpath = locate_include(filename)
+    if fullpath:
         try:
             with fullpath.open() as i:
                 return i.read()
@@ -342,6 +358,7 @@ data-toggle="tab" href="#{divid}" role="tab">{title}</a></li>'''
     return result
 
 
+@fragments.cached('file1', 'file2')
 def implement_codediff(viewid, file1, file2, lang='python'):
     """
     the html code to generate for one codediff
@@ -350,23 +367,54 @@ def implement_codediff(viewid, file1, file2, lang='python'):
     inc1 = implement_include(file1, 'codediff')
     inc2 = implement_include(file2, 'codediff')
 
+    # when both files can be highlighted here, we compute the diff
+    # as well, and browsers have nothing left to do
+    lines1 = highlighter.lines(inc1, lang)
+    lines2 = highlighter.lines(inc2, lang)
+    if lines1 is not None and lines2 is not None:
+        return implement_highlighted_diff(
+            viewid, inc1, inc2, lines1, lines2)
+
     # two files must be provided
     result = ""
     # create 2 invisible <pres> for storing both contents
-    result += f'<pre id="{viewid}_a" style="display:none">{inc1}</pre>\n'
-    result += f'<pre id="{viewid}_b" style="display:none">{inc2}</pre>\n'
+    result += f'<pre id="{escape(viewid)}_a" style="display:none">{inc1}</pre>\n'
+    result += f'<pre id="{escape(viewid)}_b" style="display:none">{inc2}</pre>\n'
     # create a <pre> to receive the result
-    result += f'<pre id="{viewid}_diff" class="r2lab-diff"></pre>\n'
+    result += f'<pre id="{escape(viewid)}_diff" class="r2lab-diff"></pre>\n'
     # arm a callback for when the document is fully loaded
     # this callback with populate the <pre> tag with elements
     # tagges either <code>, <ins> or <del>
     result += '<script>'
-    result += f'$(function(){{r2lab_diff("{viewid}", "{lang}");}})'
+    result += (f'$(function(){{r2lab_diff("{escapejs(viewid)}",'
+               f' "{escapejs(lang)}");}})')
     result += '</script>'
 
     return result
 
 
+def implement_highlighted_diff(viewid, inc1, inc2, lines1, lines2):
+    """
+    what r2lab_diff in r2lab-diff.js would produce, i.e. a <pre> with
+    <code>, <del> and <ins> chunks, but with highlighted contents
+    """
+    chunks = []
+    matcher = difflib.SequenceMatcher(
+        None, split_lines(inc1), split_lines(inc2), autojunk=False)
+    for opcode, start1, end1, start2, end2 in matcher.get_opcodes():
+        if opcode == 'equal':
+            chunks.append(f'<code>{"".join(lines1[start1:end1])}</code>')
+            continue
+        # like in r2lab-diff.js, removed comes before added
+        if end1 > start1:
+            chunks.append(f'<del>{"".join(lines1[start1:end1])}</del>')
+        if end2 > start2:
+            chunks.append(f'<ins>{"".join(lines2[start2:end2])}</ins>')
+    return (f'<pre id="{escape(viewid)}_diff" class="r2lab-diff">'
+            f'{"".join(chunks)}</pre>\n')
+
+
+@fragments.cached('file')
 def implement_togglable(viewid, file, header, start_expanded):
     """
     implements togglables
@@ -409,6 +457,7 @@ def implement_togglable(viewid, file, header, start_expanded):
 '''
     return result
 
+@fragments.cached('main', 'previous')
 def implement_codeview(viewid, main, *,                 # pylint: disable=r0914
                        previous=None, selected=None,
                        graph=None, previous_graph=None,
@@ -501,44 +550,216 @@ download target="_blank" title="Download {main}">
     result += "</ul></div></nav>"
 
     # the contents of the various tabs
+    # in lazy mode only the selected one is inlined, the others
+    # are fetched from codeview_pane() when their pill gets clicked;
+    # except for the diffs, that hold both files and are by far
+    # the largest, and that get fetched right away when selected
+    lazy = markdown_settings['lazy_codeview_panes']
+    pane_args = dict(viewid=viewid, main=main, previous=previous,
+                     graph=graph, previous_graph=previous_graph, lang=lang)
+
+    def pane(name, div_id, body_class, extra=""):
+        if lazy and (name != selected or name == 'diff'):
+            query = urlencode({'pane': name, **{
+                key: value for key, value in pane_args.items() if value}})
+            return (f'<div id="{div_id}"\nclass="tab-pane fade {body_class}"{extra}'
+                    f' data-pane-url="/codeview/pane?{escape(query)}">'
+                    f'</div>')
+        return (f'<div id="{div_id}"\nclass="tab-pane fade {body_class}"{extra}>'
+                + implement_codeview_pane(name, **pane_args)
+                + '</div>')
 
     result += '<div class="tab-content" markdown="0">\n'
 
     # plain
-    result += f'''<div id="view-{viewid}-plain"
-class="tab-pane fade {plain_body_class}" markdown="0">'''
-    result += f'<pre>\n'
-    result += implement_include(main, "codeview")
-    result += f'</pre>\n'
-    result += f'</div>'
+    result += pane('plain', f"view-{viewid}-plain",
+                   plain_body_class, ' markdown="0"')
 
     # graph
     if graph:
-        result += f'''<div id="view-{viewid}-graph"
-class="tab-pane fade {graph_body_class}">'''
-        result += f'<img src="/assets/code/{graph}" style="max-width:100%;">'
-        result += f'</div>'
+        result += pane('graph', f"view-{viewid}-graph", graph_body_class)
 
     # diff
     if previous:
-        result += f'''<div id="view-{viewid}-diff"
-class="tab-pane fade {diff_body_class}" markdown="0">'''
-        result += implement_codediff(f'diff-{viewid}',
-                                     previous, main, lang=lang)
-        result += f'</div>'
+        result += pane('diff', f"view-{viewid}-diff",
+                       diff_body_class, ' markdown="0"')
 
     # graph
     if previous_graph:
-        result += f'''<div id="view-{viewid}-previous-graph"
-class="tab-pane fade {previous_graph_body_class}">'''
-        result += f'''<img src="/assets/code/{previous_graph}"
-style="max-width:100%;">'''
-        result += f'</div>'
+        result += pane('previous_graph', f"view-{viewid}-previous-graph",
+                       previous_graph_body_class)
 
     result += "</div><!-- pills targets-->"
     return result
 
 
+@fragments.cached('main', 'previous')
+def implement_codeview_pane(pane, viewid, main, *,
+                            previous=None, graph=None, previous_graph=None,
+                            lang='python'):
+    """
+    the contents of one of the panes in a codeview
+
+    pane is one of 'plain', 'diff', 'graph', 'previous_graph'
+    """
+    if pane == 'plain':
+        code = implement_include(main, "codeview")
+        return '<pre>\n' + (highlighter.highlight(code, lang) or code) \
+            + '</pre>\n'
+    elif pane == 'graph':
+        return f'<img src="/assets/code/{escape(graph)}" style="max-width:100%;">'
+    elif pane == 'diff':
+        return implement_codediff(f'diff-{viewid}', previous, main, lang=lang)
+    elif pane == 'previous_graph':
+        return f'''<img src="/assets/code/{escape(previous_graph)}"
+style="max-width:100%;">'''
+    raise ValueError(f"unknown codeview pane {pane}")
+
+
+# the code that codeview_pane is willing to show
+CODEVIEW_PATHS = ["code", "assets/code"]
+# where the graphs of the codeviews are served from
+CODEVIEW_GRAPHS = "assets/code"
+# the languages that prism knows about, see assets/js/prism-default.js
+CODEVIEW_LANGUAGES = {
+    'bash', 'clike', 'css', 'git', 'html', 'javascript', 'js', 'markup',
+    'mathml', 'powershell', 'python', 'svg', 'xml',
+}
+re_codeview_viewid = re.compile(r'^[\w-]+$')
+# what panes get rendered and cached with, in lieu of the actual viewid
+# and that escape() and escapejs() leave unchanged
+CODEVIEW_VIEWID = "r2lab_codeview_viewid"
+
+
+def codeview_pane(request):
+    """
+    the view that serves the panes left out of the page
+    in lazy mode, e.g.
+    /codeview/pane?pane=diff&viewid=A2&main=A2-ping.py&previous=A1-ping.py
+    """
+    args = {key: request.GET.get(key) for key in (
+        'pane', 'viewid', 'main', 'previous', 'graph', 'previous_graph')}
+    args['lang'] = request.GET.get('lang', 'python')
+    if not args['pane'] or not args['viewid'] or not args['main']:
+        return HttpResponseBadRequest("pane, viewid and main are required")
+    # all of these end up in the html, and in the fragment cache keys
+    if not re_codeview_viewid.match(args['viewid']):
+        return HttpResponseBadRequest("invalid viewid")
+    if args['lang'] not in CODEVIEW_LANGUAGES:
+        return HttpResponseBadRequest("invalid lang")
+    # only plain filenames, in the code directories
+    for key in ('main', 'previous', 'graph', 'previous_graph'):
+        filename = args[key]
+        if filename is None:
+            continue
+        if '..' in filename or filename.startswith('/'):
+            return HttpResponseBadRequest(f"invalid {key}")
+    # graphs are only links, so they must exist
+    graphs = Path(settings.BASE_DIR) / CODEVIEW_GRAPHS
+    for key in ('graph', 'previous_graph'):
+        if args[key] is not None and not (graphs / args[key]).is_file():
+            return HttpResponseBadRequest(f"invalid {key}")
+    # the page itself renders missing files inline, so there is no
+    # point in doing it here - and in filling the caches with them
+    for key in ('main', 'previous'):
+        fullpath = locate_include(args[key]) if args[key] else None
+        if args[key] and (fullpath is None or not any(
+                Path(settings.BASE_DIR) / path in fullpath.parents
+                for path in CODEVIEW_PATHS)):
+            return HttpResponseNotFound(f"no such file {args[key]}")
+    # likewise the caches do not depend on viewid
+    viewid = args.pop('viewid')
+    try:
+        html = implement_codeview_pane(args.pop('pane'), CODEVIEW_VIEWID,
+                                       **args)
+    except ValueError as exc:
+        return HttpResponseBadRequest(str(exc))
+    html, _ = postprocessor.process(rewrite_asset_urls(html))
+    response = HttpResponse(html.replace(CODEVIEW_VIEWID, viewid))
+    patch_cache_control(
+        response, max_age=markdown_settings['codeview_pane_max_age'])
+    return response
+
+
+def render_markdown(markdown_file, backend=None):
+    """
+    the request-independent part of rendering a page
+
+    returns the metavars defined in the page header, together with
+    'html_from_markdown' that holds the converted contents,
+    and 'preload_hints' for the assets that these use
+
+    backend is the name of the markdown engine, default is from settings
+    """
+    # fill in metavars: 'title', 'html_from_markdown',
+    # and any other defined in header
+    with stage('parse'):
+        metavars, markdown = parse(markdown_file)
+    count('markdown_bytes', len(markdown))
+    # convert markdown
+    with stage('markdown'):
+        html, toc = get_backend(backend).convert(markdown)
+    # handle our tags
+    with stage('tags'):
+        html = resolve_tags(html)
+        # handle [TOC] if present
+        if toc:
+            html = html.replace('[TOC]', toc)
+    # use bundles and fingerprinted assets if they have been built
+    with stage('assets'):
+        html = rewrite_bundle_urls(html, markdown_file)
+        html = rewrite_asset_urls(html)
+    # minify, lazy images, and preload hints for the template
+    with stage('postprocess'):
+        html, metavars['preload_hints'] = postprocessor.process(html)
+    count('html_bytes', len(html))
+    # and mark safe to prevent further escaping
+    metavars['html_from_markdown'] = mark_safe(html)
+    return metavars
+
+
+# the oops page as served for missing pages, rendered only once
+# keyed on what it depends on
+_not_found_key = None
+_not_found_metavars = None
+_not_found_body = None
+
+
+def not_found_response(request):
+    """
+    the 404 answer for pages that do not exist
+
+    as this is mostly about scanners probing for e.g. wp-login.php,
+    we serve a pre-rendered copy of the oops page, that only
+    gets rendered again if oops.md or the assets change
+
+    that copy is the one for anonymous users; logged-in users
+    get their own menu, so only the markdown part is reused for them
+    """
+    # pylint: disable=w0603
+    global _not_found_key, _not_found_metavars, _not_found_body
+    oops = catalogue.get('oops.md')
+    key = (oops.mtime if oops else None, asset_manifest_version())
+    if key != _not_found_key:
+        if oops is None:
+            metavars = None
+            body = "<h1>Oops - page not found</h1>"
+        else:
+            metavars = render_markdown('oops.md')
+            metavars['title'] = oops.title
+            metavars['sidecar_url'] = sidecar_url
+            body = render_to_string('r2lab/r2lab.html',
+                                    dict(metavars, r2lab_context={}))
+        _not_found_key, _not_found_metavars, _not_found_body = \
+            key, metavars, body.encode()
+    r2lab_context = request.session.get('r2lab_context', {})
+    if not r2lab_context or _not_found_metavars is None:
+        return HttpResponseNotFound(_not_found_body)
+    return HttpResponseNotFound(render_to_string(
+        'r2lab/r2lab.html',
+        dict(_not_found_metavars, r2lab_context=r2lab_context), request))
+
+
 @csrf_protect
 def markdown_page(request, markdown_file, extra_metavars=None):
     """
@@ -553,46 +774,46 @@ def markdown_page(request, markdown_file, extra_metavars=None):
     """
     if extra_metavars is None:
         extra_metavars = {}
-    logger.info(f"Rendering markdown page {markdown_file}")
+    markdown_file = normalize(markdown_file)
     try:
-        markdown_file = normalize(markdown_file)
-        # fill in metavars: 'title', 'html_from_markdown',
-        # and any other defined in header
-        metavars, markdown = parse(markdown_file)
-        # convert markdown
-        html = markdown_module.markdown(
-            markdown, extras=['markdown-in-html', 'toc', 
-                              'header-ids', 'fenced-code-blocks'])
-        toc = html.toc_html
-        # handle our tags
-        html = resolve_tags(html)
-        # handle [TOC] if present
-        if toc:
-            html = html.replace('[TOC]', toc)
-        # and mark safe to prevent further escaping
-        metavars['html_from_markdown'] = mark_safe(html)
-        # set default for the 'title' metavar if not specified in header
-        if 'title' not in metavars:
-            metavars['title'] = markdown_file.replace(".md", "")
+        # the catalogue knows about the header metavars
+        # so we can answer without rendering anything
+        page = catalogue.get(markdown_file)
+        if page is None:
+            return not_found_response(request)
+        logger.info(f"Rendering markdown page {markdown_file}")
         # define the 'r2lab_context' metavar from current session
         r2lab_context = request.session.get('r2lab_context', {})
-        if not r2lab_context and 'require_login' in metavars:
+        if not r2lab_context and page.require_login:
             return HttpResponseRedirect("/index.md")
-        metavars['r2lab_context'] = r2lab_context
-        metavars['sidecar_url'] = sidecar_url
-        metavars.update(extra_metavars)
-        return render(request, 'r2lab/r2lab.html', metavars)
-    except Exception as exc:                            # pylint: disable=w0703
+
+        def render_page():
+            with rendering(markdown_file):
+                metavars = render_markdown(markdown_file)
+                # set default for the 'title' metavar if not specified
+                metavars['title'] = page.title
+                metavars['r2lab_context'] = r2lab_context
+                metavars['sidecar_url'] = sidecar_url
+                metavars.update(extra_metavars)
+                with stage('template'):
+                    response = render(request, 'r2lab/r2lab.html', metavars)
+                count('page_bytes', len(response.content))
+            return response
+
+        # superusers can get a profile instead, see profiling.py
+        profile_mode = request.GET.get('profile')
+        if profile_mode and request.user.is_superuser:
+            return profiled_response(profile_mode, render_page)
+        return render_page()
+    except FileNotFoundError:
+        # removed since we have looked it up
+        return not_found_response(request)
+    except Exception:                                   # pylint: disable=w0703
         error_message = f"<h1>Oops - cannot render markdown file" \
                         f" {markdown_file}</h1>"
-        if isinstance(exc, FileNotFoundError):
-            # turned off following an advice from inria's security cell
-            # error_message += str(exc)
-            error_message += " file not found"
-        else:
-            stack = traceback.format_exc()
-            logger.info(f"Storing stacktrace in previous_message - {stack}")
-            error_message += "<pre>\n{}\n</pre>".format(stack)
+        stack = traceback.format_exc()
+        logger.info(f"Storing stacktrace in previous_message - {stack}")
+        error_message += "<pre>\n{}\n</pre>".format(stack)
         error_message = mark_safe(error_message)
         if settings.DEBUG:
             return HttpResponseNotFound(error_message)
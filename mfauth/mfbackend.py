@@ -3,10 +3,6 @@
 from django.contrib.auth.models import User
 
 ##################################################
-from manifoldapi.manifoldapi import ManifoldException
-
-from .mfdetails import manifold_details
-
 from r2lab.settings import manifold_url as config_manifold_url
 from r2lab.settings import logger
 from plc.plcsfauser import get_r2lab_user
@@ -36,6 +32,9 @@ class ManifoldBackend:
         token = kwds['token']
         if token is None:
             return
+        # manifold is heavy and not needed until someone logs in
+        from manifoldapi.manifoldapi import ManifoldException
+        from .mfdetails import manifold_details
 
         try:
             email = token['username']
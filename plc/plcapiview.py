@@ -6,16 +6,17 @@ import asyncio
 from django.http import HttpResponse
 
 from r2lab.testbedapiview import TestbedApiView
+from r2lab.metrics import TimedProxy
 
 # essentially, this describes the OMF REST API endpoint details
 from r2lab.settings import plcapi_settings, logger
 
-from rhubarbe.plcapiproxy import PlcApiProxy
-
 debug = False
 debug = True
 
 def init_plcapi_proxy():
+    # imported here so that loading the views does not pull rhubarbe
+    from rhubarbe.plcapiproxy import PlcApiProxy
     # we use this location on r2lab.inria.fr which is readable by apache
     found = False
     for credentials in plcapi_settings['credentials']:
@@ -31,11 +32,12 @@ def init_plcapi_proxy():
         for credentials in plcapi_settings['credentials']:
             logger.error("have tried in {}".format(credentials))
 
-    return PlcApiProxy(plcapi_settings['url'],
-                       email=email,
-                       password=password,
-                       debug=debug,
-    )
+    # time each remote call, see /metrics
+    return TimedProxy(PlcApiProxy(plcapi_settings['url'],
+                                  email=email,
+                                  password=password,
+                                  debug=debug,
+    ))
 
 class PlcApiView(TestbedApiView):
 
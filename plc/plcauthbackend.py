@@ -3,8 +3,6 @@
 from django.contrib.auth.models import User
 
 ##################################################
-from rhubarbe.plcapiproxy import PlcApiProxy
-
 from r2lab.settings import plcapi_settings
 from r2lab.settings import logger
 
@@ -36,6 +34,9 @@ class PlcAuthBackend:
         token = kwds['token']
         if token is None:
             return
+        # imported here as this module is loaded on every
+        # request that has a session
+        from rhubarbe.plcapiproxy import PlcApiProxy
 
         try:
             email = token['username']
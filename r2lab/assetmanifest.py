@@ -0,0 +1,222 @@
+"""
+fingerprinted copies of the files in assets/r2lab
+
+./manage.py buildassets writes them in assets/build/ - together with
+their .gz and .br compressed siblings - and a manifest.json that maps e.g.
+    r2lab/livemap.js -> build/r2lab/livemap.1a2b3c4d5e.js
+
+as the names change with the contents, these can be cached forever
+by browsers; this module is about using them in place of the originals
+
+buildassets also writes bundles of these files, one for each family
+of pages, see r2lab/bundler.py, and describes them in bundles.json
+
+likewise ./manage.py buildimages writes resized and webp versions
+of the images in assets/img and assets/code, and describes them
+in images.json
+
+and ./manage.py vendorlibs writes local copies of the third-party
+libraries, and describes them in vendor.json, see r2lab/vendoring.py
+"""
+
+import re
+import json
+from pathlib import Path
+
+from django.conf import settings
+
+from r2lab.settings import assets_settings, vendor_settings
+from r2lab.bundler import PAGE_IMPORT_RE
+
+ASSETS_DIR = Path(settings.BASE_DIR) / "assets"
+BUILD_DIR = ASSETS_DIR / assets_settings['build_subdir']
+MANIFEST = BUILD_DIR / "manifest.json"
+IMAGES_MANIFEST = BUILD_DIR / "images.json"
+BUNDLES_MANIFEST = BUILD_DIR / "bundles.json"
+VENDOR_MANIFEST = BUILD_DIR / "vendor.json"
+
+# the references that we know how to fingerprint
+ASSET_URL_RE = re.compile(r'/assets/(?P<path>r2lab/[\w.-]+\.(js|css))\b')
+
+# the images that buildimages knows how to derive
+IMAGE_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg'}
+
+# how fingerprinted files are named
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{10}\.\w+$')
+
+class ManifestFile:
+    """
+    the contents of a json file written by a build command,
+    read again whenever the file changes on disk
+
+    an empty dict if the file is not there
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.contents = {}
+        # the mtime of the file when last read
+        self.mtime = None
+
+    def get(self):
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self.contents, self.mtime = {}, None
+            return self.contents
+        if mtime != self.mtime:
+            with self.path.open() as feed:
+                self.contents = json.load(feed)
+            self.mtime = mtime
+        return self.contents
+
+
+_manifest = ManifestFile(MANIFEST)
+_images = ManifestFile(IMAGES_MANIFEST)
+_bundles = ManifestFile(BUNDLES_MANIFEST)
+_vendor = ManifestFile(VENDOR_MANIFEST)
+
+
+def manifest():
+    """
+    the current manifest, e.g.
+    {'r2lab/livemap.js': 'build/r2lab/livemap.1a2b3c4d5e.js', ...}
+
+    an empty dict if the assets have not been built
+    """
+    return _manifest.get()
+
+
+def images():
+    """
+    the current images manifest, e.g.
+    {'code/D4.png': {'width': 657, 'height': 387, 'variants': [
+        {'path': 'build/images/code/D4.480w.1a2b3c4d5e.webp',
+         'width': 480, 'type': 'image/webp'}, ...]}}
+
+    an empty dict if the images have not been built
+    """
+    return _images.get()
+
+
+def bundles():
+    """
+    the current bundles manifest, e.g.
+    {'pages': {'map.md': 'livemap', ...},
+     'bundles': {'livemap': {
+         'entries': ['r2lab/livemap.js'],
+         'modules': ['r2lab/load-css.js', ..., 'r2lab/livemap.js'],
+         'stylesheets': ['r2lab/livemap.css'],
+         'js': 'build/bundles/livemap.1a2b3c4d5e.js',
+         'css': 'build/bundles/livemap.5e4d3c2b1a.css'}}}
+
+    an empty dict if the assets have not been built
+    """
+    return _bundles.get()
+
+
+def vendored():
+    """
+    the current vendor manifest, e.g.
+    {'jquery': {'path': 'build/vendor/jquery.1a2b3c4d5e.js',
+                'integrity': 'sha384-...',
+                'sources': ['https://cdnjs.cloudflare.com/ajax/libs/...']}}
+
+    an empty dict if the libraries have not been vendored
+    """
+    return _vendor.get()
+
+
+def version():
+    """
+    changes each time one of the manifests does
+    """
+    manifest_files = (_manifest, _images, _bundles, _vendor)
+    for manifest_file in manifest_files:
+        manifest_file.get()
+    return tuple(manifest_file.mtime for manifest_file in manifest_files)
+
+
+def asset_url(url):
+    """
+    /assets/r2lab/r2lab.css -> /assets/build/r2lab/r2lab.1a2b3c4d5e.css
+
+    urls that are not in the manifest are returned unchanged
+    """
+    match = ASSET_URL_RE.fullmatch(url)
+    if not match:
+        return url
+    hashed = manifest().get(match.group('path'))
+    return f"/assets/{hashed}" if hashed else url
+
+
+def rewrite_asset_urls(text):
+    """
+    replace all references to known assets in text
+    """
+    current = manifest()
+    if not current:
+        return text
+
+    def replace(match):
+        hashed = current.get(match.group('path'))
+        return f"/assets/{hashed}" if hashed else match.group(0)
+    return ASSET_URL_RE.sub(replace, text)
+
+
+def is_fingerprinted(path):
+    """
+    whether path is named after its contents
+    """
+    return HASHED_NAME_RE.search(str(path)) is not None
+
+
+def rewrite_bundle_urls(text, page):
+    """
+    in the html for page, replace references to the modules and
+    stylesheets that are in the page's bundle
+
+    this is done only if the page imports the same modules as when
+    the bundle was built; otherwise modules like sidecar.js could end up
+    being loaded twice, once in the bundle and once on their own
+    """
+    current = bundles()
+    name = current.get('pages', {}).get(page)
+    if not name:
+        return text
+    bundle = current['bundles'][name]
+    imported = {match.group('path')
+                for match in PAGE_IMPORT_RE.finditer(text)}
+    if imported != set(bundle['entries']):
+        return text
+
+    def replace(match):
+        path = match.group('path')
+        if path in bundle['modules']:
+            return f"/assets/{bundle['js']}"
+        if bundle['css'] and path in bundle['stylesheets']:
+            return f"/assets/{bundle['css']}"
+        return match.group(0)
+    return ASSET_URL_RE.sub(replace, text)
+
+
+def vendored_tags(name):
+    """
+    the html tags that load one of the libraries in vendor_settings,
+    our own copy if we have one, or else the cdn's
+    """
+    entry = vendored().get(name)
+    if entry:
+        urls = [(f"/assets/{entry['path']}", entry['integrity'])]
+    else:
+        urls = [(f"{vendor_settings['cdn']}{path}", None)
+                for path in vendor_settings['libraries'][name]]
+    tags = []
+    for url, sri in urls:
+        extra = f' integrity="{sri}"' if sri else ""
+        if url.endswith('.css'):
+            tags.append(f'<link rel="stylesheet" type="text/css"'
+                        f' href="{url}"{extra}>')
+        else:
+            tags.append(f'<script src="{url}"{extra}></script>')
+    return "\n".join(tags)
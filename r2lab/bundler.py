@@ -0,0 +1,264 @@
+"""
+bundles of the es modules in assets/r2lab, one per family of pages
+
+a page family is a set of pages that use the same modules - e.g.
+map.md and iframe-livemap.md both import livemap.js; the bundle for a
+family holds these modules and everything they import, in the order
+the browser would evaluate them, together with one stylesheet that
+gathers all the css they load
+
+bundling is done at the source level, by removing the import statements
+and the load_css() calls; this works because our modules import names
+as they are exported, and do not define the same top-level names -
+which gets checked
+
+families are computed from the imports in the pages' markdown, since
+all pages share the same template; and each page gets exactly the
+modules it used to, because the live* modules start themselves when
+they are loaded
+
+minification is only about comments, indentation and blank lines,
+so a source map with one segment per line is exact
+"""
+
+import re
+import json
+from collections import OrderedDict
+
+# the references we know how to follow
+MODULE_URL = r'/assets/(?P<path>r2lab/[\w.-]+\.js)'
+CSS_URL = r'/assets/(?P<path>r2lab/[\w.-]+\.css)'
+
+PAGE_IMPORT_RE = re.compile(
+    rf'''\bimport\s*(?:[\w{{}}\s,*]*?\bfrom\s*)?["']{MODULE_URL}["']''')
+PAGE_CSS_RE = re.compile(rf'''@import\s+url\(\s*["']{CSS_URL}["']''')
+
+IMPORT_LINE_RE = re.compile(
+    rf'''^\s*import\s*(?P<names>[\w{{}}\s,*]*?\bfrom\s*)?["']{MODULE_URL}["']\s*;?\s*$''')
+LOAD_CSS_LINE_RE = re.compile(
+    rf'''^\s*load_css\(\s*["']{CSS_URL}["']\s*\)\s*;?\s*$''')
+# what remains of an import we could not handle
+ANY_IMPORT_RE = re.compile(r'^\s*import\b')
+TOP_LEVEL_RE = re.compile(
+    r'^(export\s+)?(function\*?|class|let|const|var)\s+(?P<name>[\w$]+)')
+
+LOAD_CSS_MODULE = "r2lab/load-css.js"
+
+
+class BundleError(Exception):
+    pass
+
+
+########## families
+def page_entries(markdown):
+    """
+    the modules imported, and stylesheets @imported, by a page
+    """
+    modules = [match.group('path')
+               for match in PAGE_IMPORT_RE.finditer(markdown)]
+    stylesheets = [match.group('path')
+                   for match in PAGE_CSS_RE.finditer(markdown)]
+    return (tuple(OrderedDict.fromkeys(modules)),
+            tuple(OrderedDict.fromkeys(stylesheets)))
+
+
+def module_imports(source):
+    return [match.group('path')
+            for line in source.splitlines()
+            for match in [IMPORT_LINE_RE.match(line)] if match]
+
+
+def module_stylesheets(source):
+    return [match.group('path')
+            for line in source.splitlines()
+            for match in [LOAD_CSS_LINE_RE.match(line)] if match]
+
+
+def evaluation_order(entries, sources):
+    """
+    the modules reachable from entries, in the order they get evaluated,
+    i.e. a depth-first post-order
+    """
+    ordered = []
+
+    def visit(path, stack):
+        if path in ordered:
+            return
+        if path in stack:
+            raise BundleError(f"cyclic imports through {path}")
+        if path not in sources:
+            raise BundleError(f"unknown module {path}")
+        for imported in module_imports(sources[path]):
+            visit(imported, stack + [path])
+        ordered.append(path)
+
+    for entry in entries:
+        visit(entry, [])
+    return ordered
+
+
+def families(pages):
+    """
+    pages is a dict page_name -> markdown
+    returns a dict entries -> list of page names, where entries is
+    the tuple of modules imported by these pages
+    """
+    result = OrderedDict()
+    for name in sorted(pages):
+        modules, _ = page_entries(pages[name])
+        if modules:
+            result.setdefault(tuple(sorted(modules)), []).append(name)
+    return result
+
+
+def family_name(entries):
+    return "_".join(entry.split('/')[-1].rsplit('.', 1)[0]
+                    for entry in entries)
+
+
+########## minification and source maps
+def minified_lines(text, js):
+    """
+    yields tuples (line_number, column, line) for the lines worth keeping,
+    where column is the number of characters removed in front
+    """
+    in_comment = False
+    in_template = False
+    for number, line in enumerate(text.splitlines()):
+        # inside a multi-line template literal, everything matters
+        if in_template:
+            yield number, 0, line
+            in_template = (line.count('`') - line.count('\\`')) % 2 == 0
+            continue
+        offset = 0
+        if in_comment:
+            if '*/' not in line:
+                continue
+            in_comment = False
+            rest = line.split('*/', 1)[1]
+            offset, line = len(line) - len(rest), rest
+        stripped = line.strip()
+        column = offset + len(line) - len(line.lstrip())
+        if not stripped:
+            continue
+        if js and stripped.startswith('//'):
+            continue
+        if stripped.startswith('/*'):
+            if '*/' not in stripped:
+                in_comment = True
+                continue
+            if not stripped.split('*/', 1)[1].strip():
+                continue
+        if js and (stripped.count('`') - stripped.count('\\`')) % 2 == 1:
+            in_template = True
+        yield number, column, stripped
+
+
+BASE64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+
+def vlq(value):
+    """
+    base64 VLQ encoding, as used in source maps
+    """
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    encoded = ""
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        encoded += BASE64[digit]
+        if not value:
+            return encoded
+
+
+class SourceMap:
+    """
+    a version 3 source map, with one segment per generated line
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.sources = []
+        self.lines = []
+        # segments are relative to the previous one
+        self.previous = (0, 0, 0)
+
+    def add_source(self, url):
+        self.sources.append(url)
+        return len(self.sources) - 1
+
+    def add_line(self, source, line, column):
+        if source is None:
+            self.lines.append("")
+            return
+        last_source, last_line, last_column = self.previous
+        self.lines.append(vlq(0) + vlq(source - last_source)
+                          + vlq(line - last_line) + vlq(column - last_column))
+        self.previous = (source, line, column)
+
+    def json(self):
+        return json.dumps({
+            'version': 3,
+            'file': self.filename,
+            'sources': self.sources,
+            'names': [],
+            'mappings': ";".join(self.lines),
+        })
+
+
+########## bundles
+def bundle_css(paths, sources, filename):
+    """
+    returns (css, source map)
+    """
+    output = []
+    source_map = SourceMap(filename)
+    for path in paths:
+        index = source_map.add_source(f"/assets/{path}")
+        for number, column, line in minified_lines(sources[path], js=False):
+            output.append(line)
+            source_map.add_line(index, number, column)
+    return "\n".join(output) + "\n", source_map
+
+
+def bundle_js(modules, sources, filename, css_url):
+    """
+    returns (js, source map)
+
+    css_url is the stylesheet that gathers what the modules
+    would have loaded with load_css(), if any
+    """
+    output = []
+    source_map = SourceMap(filename)
+    defined = {}
+    for path in modules:
+        index = source_map.add_source(f"/assets/{path}")
+        for number, column, line in minified_lines(sources[path], js=True):
+            match = IMPORT_LINE_RE.match(line)
+            if match:
+                names = match.group('names') or ""
+                if ' as ' in names or '*' in names:
+                    raise BundleError(f"{path}: cannot bundle renamed imports")
+                continue
+            if ANY_IMPORT_RE.match(line):
+                raise BundleError(f"{path}: cannot bundle import {line}")
+            if css_url and LOAD_CSS_LINE_RE.match(line):
+                continue
+            if column == 0:
+                match = TOP_LEVEL_RE.match(line)
+                if match:
+                    name = match.group('name')
+                    if name in defined and defined[name] != path:
+                        raise BundleError(f"{name} is defined in both"
+                                          f" {defined[name]} and {path}")
+                    defined[name] = path
+            output.append(line)
+            source_map.add_line(index, number, column)
+        if path == LOAD_CSS_MODULE and css_url:
+            output.append(f'load_css("{css_url}");')
+            source_map.add_line(None, 0, 0)
+    if css_url and LOAD_CSS_MODULE not in modules:
+        raise BundleError(f"{LOAD_CSS_MODULE} is needed to load {css_url}")
+    return "\n".join(output) + "\n", source_map
@@ -0,0 +1,68 @@
+"""
+JSON encoders for the answers sent back by the xhttp views
+
+an encoder turns a python struct into bytes, so that the result
+can be stored as-is in a cache, and sent as many times as needed
+without being serialized again
+
+we use orjson when it is available as it is a lot faster,
+and fall back to the stdlib json module otherwise
+"""
+
+import json
+
+
+def default(obj):
+    """
+    for objects that are not natively serializable; in practice
+    this is about exceptions that the views expose as a 'message' field
+    """
+    return str(obj)
+
+
+class StdlibEncoder:
+    """
+    the plain json module from the standard library
+    """
+    name = 'json'
+
+    @staticmethod
+    def dumps(struct):
+        return json.dumps(struct, default=default,
+                          separators=(',', ':')).encode()
+
+
+class OrjsonEncoder:
+    """
+    orjson is a C extension, and it already returns bytes
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, struct):
+        return self.orjson.dumps(struct, default=default,
+                                 option=self.orjson.OPT_NON_STR_KEYS)
+
+
+ENCODERS = {
+    'orjson': OrjsonEncoder,
+    'json': StdlibEncoder,
+}
+
+
+def get_encoder(name='auto'):
+    """
+    returns an encoder instance
+
+    name is one of the keys in ENCODERS, or 'auto' to pick the fastest
+    one available
+    """
+    if name != 'auto':
+        return ENCODERS[name]()
+    try:
+        return OrjsonEncoder()
+    except ImportError:
+        return StdlibEncoder()
@@ -0,0 +1,41 @@
+"""
+deferred imports, so that workers and manage.py come up fast
+
+heavy dependencies (rhubarbe, manifold, markdown2) and the views
+that use them get imported upon first use, rather than when the
+URL configuration is loaded
+"""
+
+from importlib import import_module
+
+
+def import_dotted(dotted_path):
+    """
+    import_dotted('md.views.markdown_page') returns the function
+    """
+    module_name, name = dotted_path.rsplit('.', 1)
+    return getattr(import_module(module_name), name)
+
+
+def lazy_view(dotted_path, *, as_view=False):
+    """
+    returns a view function, suitable for use in urlpatterns,
+    that imports dotted_path only when the first request comes in
+
+    set as_view for class-based views
+    """
+    view = None
+
+    def lazy(request, *args, **kwds):
+        nonlocal view
+        if view is None:
+            target = import_dotted(dotted_path)
+            view = target.as_view() if as_view else target
+        return view(request, *args, **kwds)
+
+    # so that resolver_match.view_name, and thus /metrics,
+    # show the actual view
+    module_name, name = dotted_path.rsplit('.', 1)
+    lazy.__module__ = module_name
+    lazy.__name__ = lazy.__qualname__ = name
+    return lazy
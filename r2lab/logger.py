@@ -1,32 +1,207 @@
+import atexit
+import json
+import queue
+import threading
 import logging
 import logging.config
+import logging.handlers
 
-def init_logger(filename):
+# the formats used in the log file
+FORMATS = {
+    'standard': {
+        'format': '%(asctime)s %(levelname)s %(filename)s:%(lineno)d %(message)s',
+        'datefmt': '%m-%d %H:%M:%S'
+    },
+    'shorter': {
+        'format': '%(asctime)s %(levelname)s %(message)s',
+        'datefmt': '%d %H:%M:%S'
+    },
+}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    one JSON object per line, for feeding log processors
+    """
+
+    def format(self, record):
+        line = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'file': record.filename,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+        # in queued mode the traceback is already part of the message
+        if record.exc_info:
+            line['exception'] = self.formatException(record.exc_info)
+        return json.dumps(line)
+
+
+class BatchWriting:
+    """
+    for file handlers that can also write a whole batch
+    of records with a single write and flush
+    """
+
+    def emit_batch(self, records):
+        try:
+            text = "".join(self.format(record) + self.terminator
+                           for record in records)
+        except Exception:                           # pylint: disable=w0703
+            for record in records:
+                self.handleError(record)
+            return
+        with self.lock:
+            try:
+                self.before_write()
+                if self.stream is None:
+                    self.open_stream()
+                self.stream.write(text)
+                self.stream.flush()
+                self.after_write()
+            except Exception:                       # pylint: disable=w0703
+                # e.g. disk full; the records are lost, but not
+                # the ones that come next
+                for record in records:
+                    self.handleError(record)
+
+    def open_stream(self):
+        self.stream = self._open()
+
+    def before_write(self):
+        pass
+
+    def after_write(self):
+        pass
+
+
+class BatchFileHandler(BatchWriting, logging.handlers.RotatingFileHandler):
+    """
+    rotates the file when it reaches maxBytes; this is only safe
+    if a single process writes in the file
+    """
+
+    def after_write(self):
+        if self.maxBytes and self.stream.tell() >= self.maxBytes:
+            self.doRollover()
+
+
+class BatchWatchedFileHandler(BatchWriting,
+                              logging.handlers.WatchedFileHandler):
+    """
+    opens the file again when it has been moved away,
+    typically by logrotate
+    """
+
+    def open_stream(self):
+        super().open_stream()
+        self._statstream()
+
+    def before_write(self):
+        self.reopenIfNeeded()
+
+
+class BatchQueueListener:
+    """
+    the background thread that empties the queue fed by request threads
+
+    it waits for one record, then grabs whatever else is pending
+    so that bursts result in a single write
+    """
+
+    _sentinel = None
+
+    def __init__(self, record_queue, handler, batch_size=256):
+        self.queue = record_queue
+        self.handler = handler
+        self.batch_size = batch_size
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self._run, name='r2lab-logger', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.queue.put_nowait(self._sentinel)
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if self._sentinel in batch:
+                done = True
+                batch = [record for record in batch
+                         if record is not self._sentinel]
+            batch = [record for record in batch
+                     if record.levelno >= self.handler.level]
+            if not batch:
+                continue
+            # this thread is the only one that writes, so
+            # it must not die whatever happens
+            try:
+                self.handler.emit_batch(batch)
+            except Exception:                       # pylint: disable=w0703
+                for record in batch:
+                    self.handler.handleError(record)
+
+
+def init_logger(filename, *, queued=False, json_lines=False,
+                max_bytes=0, backup_count=5):
+    """
+    returns the 'r2lab' logger, that writes in filename
+
+    queued: if set, request threads only enqueue records, and
+      a background thread takes care of writing them in batches
+    json_lines: if set, write one JSON object per line
+    max_bytes: if non zero, rotate the file when it reaches that size
+      and keep backup_count old copies; this is only safe if a single
+      process writes in the file; otherwise leave it to 0, and have
+      logrotate do the job - the file gets opened again once moved
+    """
+
+    formatter = 'json' if json_lines else 'standard'
+    formatters = dict(FORMATS)
+    formatters['json'] = {'()': JsonLinesFormatter}
+
+    # in queued mode the handler is attached below, once the
+    # background thread is started
+    handlers = {}
+    if not queued and max_bytes:
+        handlers['r2lab'] = {
+            'level': 'INFO',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'formatter': formatter,
+            'filename' : filename,
+            'maxBytes': max_bytes,
+            'backupCount': backup_count,
+        }
+    elif not queued:
+        handlers['r2lab'] = {
+            'level': 'INFO',
+            'class': 'logging.handlers.WatchedFileHandler',
+            'formatter': formatter,
+            'filename' : filename,
+        }
 
     logging_config = {
         'version' : 1,
         'disable_existing_loggers' : False,
-        'formatters': {
-            'standard': {
-                'format': '%(asctime)s %(levelname)s %(filename)s:%(lineno)d %(message)s',
-                'datefmt': '%m-%d %H:%M:%S'
-            },
-            'shorter': {
-                'format': '%(asctime)s %(levelname)s %(message)s',
-                'datefmt': '%d %H:%M:%S'
-            },
-        },
-        'handlers': {
-            'r2lab': {
-                'level': 'INFO',
-                'class': 'logging.FileHandler',
-                'formatter': 'standard',
-                'filename' : filename,
-            },
-        },
+        'formatters': formatters,
+        'handlers': handlers,
         'loggers': {
             'r2lab': {
-                'handlers': ['r2lab'],
+                'handlers': list(handlers),
                 'level': 'INFO',
                 'propagate': False,
             },
@@ -34,5 +209,26 @@ def init_logger(filename):
     }
 
     logging.config.dictConfig(logging_config)
+    logger = logging.getLogger('r2lab')
+
+    if queued:
+        record_queue = queue.SimpleQueue()
+        if max_bytes:
+            file_handler = BatchFileHandler(
+                filename, maxBytes=max_bytes, backupCount=backup_count,
+                delay=True)
+        else:
+            file_handler = BatchWatchedFileHandler(filename, delay=True)
+        file_handler.setLevel(logging.INFO)
+        if json_lines:
+            file_handler.setFormatter(JsonLinesFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter(
+                FORMATS[formatter]['format'], FORMATS[formatter]['datefmt']))
+        listener = BatchQueueListener(record_queue, file_handler)
+        listener.start()
+        # flush what is pending upon exit
+        atexit.register(listener.stop)
+        logger.addHandler(logging.handlers.QueueHandler(record_queue))
 
-    return logging.getLogger('r2lab')
+    return logger
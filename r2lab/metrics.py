@@ -0,0 +1,218 @@
+"""
+latency instrumentation for the r2lab views
+
+* TimingMiddleware measures each request as a whole
+* TimedProxy wraps a PlcApiProxy so that each remote method call is timed
+* timer() is a context manager for timing any other stage, like JSON decoding
+
+all this ends up in histograms that metrics_view exposes in the
+Prometheus text format on /metrics; in addition each response gets a
+Server-Timing header with the breakdown for that very request
+
+the histograms live in the memory of each process: with several
+apache workers, a scrape of /metrics only sees the one that answers;
+so all series have a 'pid' label, that tells them apart and keeps the
+counters of a given series from going backwards; complete figures
+require either a single process, or summing over the pids
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from django.http import HttpResponse, HttpResponseForbidden
+
+from r2lab.settings import metrics_settings
+
+# any other method, as sent by clients, is labelled 'other', so that
+# they cannot create as many histograms as they like
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class Histogram:
+    """
+    a Prometheus-like histogram, with cumulative buckets
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.count += 1
+            self.sum += value
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += 1
+
+
+class Registry:
+    """
+    all histograms, indexed on (name, labels)
+    where labels is a tuple of (label, value) tuples
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(
+                    key, Histogram(self.buckets))
+        histogram.observe(value)
+
+    @staticmethod
+    def _labels(labels, extra=None):
+        # not known at import time, as workers may be forked later on
+        pairs = [('pid', os.getpid()), *labels]
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        inside = ",".join(f'{label}="{value}"' for label, value in pairs)
+        return f"{{{inside}}}"
+
+    def exposition(self):
+        """
+        the contents of /metrics
+        """
+        lines = []
+        # requests may add histograms in the meantime
+        with self.lock:
+            items = sorted(self.histograms.items())
+        for name in sorted({name for (name, _), _ in items}):
+            lines.append(f"# TYPE {name} histogram")
+            for (hname, labels), histogram in items:
+                if hname != name:
+                    continue
+                with histogram.lock:
+                    for bound, count in zip(histogram.buckets,
+                                            histogram.counts):
+                        lines.append(
+                            f"{name}_bucket"
+                            f"{self._labels(labels, ('le', bound))} {count}")
+                    lines.append(
+                        f"{name}_bucket"
+                        f"{self._labels(labels, ('le', '+Inf'))}"
+                        f" {histogram.count}")
+                    lines.append(f"{name}_sum{self._labels(labels)}"
+                                 f" {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{self._labels(labels)}"
+                                 f" {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(metrics_settings['buckets'])
+
+# the stages measured so far in the current request, for Server-Timing
+_current = threading.local()
+
+
+def _stages():
+    if not hasattr(_current, 'stages'):
+        _current.stages = {}
+    return _current.stages
+
+
+def record_stage(stage, duration):
+    """
+    accumulate duration in the Server-Timing entry for stage
+    """
+    stages = _stages()
+    total, count = stages.get(stage, (0., 0))
+    stages[stage] = (total + duration, count + 1)
+
+
+@contextmanager
+def timer(stage):
+    """
+    times the enclosed block, both in the histogram named
+    r2lab_stage_seconds, and in the Server-Timing header
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        registry.observe('r2lab_stage_seconds', {'stage': stage}, duration)
+        record_stage(stage, duration)
+
+
+class TimedProxy:
+    """
+    wraps a PlcApiProxy so that each remote call is timed,
+    with the method name as a label
+    """
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+
+    def __getattr__(self, name):
+        method = getattr(self._proxy, name)
+        if not callable(method):
+            return method
+
+        def timed_method(*args, **kwds):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwds)
+            finally:
+                duration = time.perf_counter() - start
+                registry.observe('r2lab_plcapi_seconds',
+                                 {'method': name}, duration)
+                record_stage('plcapi', duration)
+        return timed_method
+
+
+class TimingMiddleware:
+    """
+    times each request, and adds the Server-Timing header
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _current.stages = {}
+        start = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - start
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        method = request.method if request.method in METHODS else 'other'
+        registry.observe('r2lab_request_seconds',
+                         {'view': view, 'method': method,
+                          'status': response.status_code},
+                         duration)
+        response['Server-Timing'] = self.server_timing(duration)
+        _current.stages = {}
+        return response
+
+    @staticmethod
+    def server_timing(duration):
+        entries = []
+        for stage, (total, count) in _stages().items():
+            entries.append(f'{stage};dur={total*1000:.1f}'
+                           f';desc="{count} call(s)"')
+        entries.append(f'total;dur={duration*1000:.1f}')
+        return ", ".join(entries)
+
+
+def metrics_view(request):
+    """
+    expose all histograms in the Prometheus text format
+    """
+    if request.META.get('REMOTE_ADDR') not in metrics_settings['allowed_ips']:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.exposition(),
+                        content_type='text/plain; version=0.0.4')
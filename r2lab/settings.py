@@ -36,8 +36,22 @@ RUNTIME_DIR = '/var/lib/r2lab.inria.fr' if PRODUCTION else BASE_DIR
 # on r2lab.inria.fr we have a a symlink in place in /var/log as well
 LOG_FILE = os.path.join(RUNTIME_DIR, "django.log")
 
+# see logger.py for details
+LOG_SETTINGS = {
+    # write from a background thread, not from the request threads
+    'queued' : True,
+    # set to True to get one JSON object per line
+    'json_lines' : False,
+    # the web workers and the manage.py commands all write in this
+    # file, so rotation is left to logrotate; a non-zero max_bytes
+    # rotates when the file reaches that size, keeping backup_count
+    # old copies, and is only safe if a single process writes in it
+    'max_bytes' : 0,
+    'backup_count' : 5,
+}
+
 from .logger import init_logger
-logger = init_logger(LOG_FILE)
+logger = init_logger(LOG_FILE, **LOG_SETTINGS)
 
 ########## details on the R2lab API
 
@@ -54,6 +68,52 @@ plcapi_settings = {
     'nodename_match' : 'faraday',
 }
 
+########## how the xhttp views encode their answers
+json_settings = {
+    # 'auto' picks orjson if installed, and the stdlib json module otherwise
+    # can be set to 'orjson' or 'json' to force one or the other
+    'encoder' : 'auto',
+    # answers larger than this get gzipped if the client accepts it
+    'gzip_min_size' : 4096,
+    # how long (in seconds) we keep pre-serialized answers like /users/get
+    'cache_timeout' : 60,
+}
+
+########## latency histograms, exposed on /metrics
+metrics_settings = {
+    # upper bounds, in seconds
+    'buckets' : (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10),
+    # only the prometheus scraper needs to see this
+    'allowed_ips' : ['127.0.0.1', '::1'],
+}
+
+########## rendering of the pages in markdown/
+markdown_settings = {
+    # the engine that converts markdown, see md/backends.py
+    'backend' : 'markdown2',
+    # how many names of missing pages to remember, see md/catalogue.py
+    'negative_cache_size' : 1024,
+    # and for how long (in seconds), so that new pages show up eventually
+    'negative_cache_ttl' : 60,
+    # how many expanded codeview/codediff/togglable tags to keep,
+    # see md/fragments.py
+    'fragment_cache_size' : 512,
+    # inline only the selected pane of codeviews, the others
+    # are fetched when clicked - see codeview-panes.js
+    'lazy_codeview_panes' : True,
+    # and how long browsers can keep these
+    'codeview_pane_max_age' : 600,
+    # highlight codeviews with pygments if available, rather than prism
+    # this saves browsers the work, but one <span> per token roughly
+    # doubles the size of the code in the pages, so it is off by default
+    'server_highlight' : False,
+    # how many highlighted files to keep, see md/highlight.py
+    'highlight_cache_size' : 256,
+    # minify pages, lazy images and preload hints, see md/postprocess.py
+    'postprocess' : True,
+    'postprocess_cache_size' : 128,
+}
+
 ####################
 
 # Quick-start development settings - unsuitable for production
@@ -98,6 +158,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so that it measures all the rest
+    'r2lab.metrics.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -121,6 +183,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                # expose the list of pages, see md/catalogue.py
+                'md.catalogue.page_catalogue',
             ],
         },
     },
@@ -181,6 +245,45 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "assets"),
 ]
 
+# see r2lab/assetmanifest.py and r2lab/staticviews.py
+assets_settings = {
+    # where ./manage.py buildassets writes, relative to assets/
+    'build_subdir' : 'build',
+    # how long browsers can keep the non-fingerprinted files
+    'max_age' : 600,
+    # the widths that ./manage.py buildimages resizes images to
+    'image_widths' : (480, 960),
+    # and the extra formats it writes, with <source> tags in pages
+    'image_formats' : ('webp',),
+}
+
+# the libraries in templates/r2lab/corelibs.html
+# ./manage.py vendorlibs fetches them from the cdn, and then we
+# serve our own copies; until then, pages load them from the cdn
+vendor_settings = {
+    'cdn' : "https://cdnjs.cloudflare.com/ajax/libs/",
+    # name -> the files, relative to the cdn, that make up the library
+    # several files get concatenated in this order
+    'libraries' : {
+        'jquery' : ["jquery/3.2.1/jquery.min.js"],
+        # popper is required by bootstrap for tooltips
+        'popper' : ["popper.js/1.12.9/umd/popper.min.js"],
+        'bootstrap-css' : ["twitter-bootstrap/4.1.3/css/bootstrap.min.css"],
+        'bootstrap' : ["twitter-bootstrap/4.1.3/js/bootstrap.min.js"],
+        'd3' : ["d3/4.7.4/d3.min.js"],
+        # 4.7 for svg/d3 (see livemap.js), 5.15 for all other uses
+        'font-awesome' : ["font-awesome/4.7.0/css/font-awesome.min.css",
+                          "font-awesome/5.15.4/css/all.min.css"],
+    },
+    # the libraries that get reduced to the icons that we use
+    'icon_libraries' : ('font-awesome',),
+    # where we look for icon names like fa-remove, relative to BASE_DIR
+    'icon_sources' : ('templates', 'markdown', 'assets/r2lab',
+                      'md', 'leases', 'slices', 'users', 'keys'),
+    # icons that we use but whose names are computed
+    'extra_icons' : (),
+}
+
 manifold_url = "https://portal.onelab.eu:7080/"
 sidecar_url = "wss://r2lab.inria.fr:999/"
 
@@ -202,6 +305,62 @@ if not PRODUCTION:
         sidecar_url = SIDECAR
     print("Using sidecar_url = {sidecar_url}".format(**locals()))
 
+# the relay that browsers can connect to instead of the sidecar,
+# so that the sidecar sees a single connection, see relay/
+#   ./manage.py runrelay
+# to use it, point sidecar_url - or SIDECAR - at the relay
+relay_settings = {
+    # where the relay gets its data from
+    'upstream_url' : "wss://r2lab.inria.fr:999/",
+    # where it listens for browsers
+    'host' : 'localhost',
+    'port' : 10001,
+    # the categories that get cached; requests on other ones are dropped
+    'categories' : ('nodes', 'phones', 'leases'),
+    # the categories whose info messages only mention the records,
+    # and fields, that have changed; the other ones come in full
+    'merged_categories' : ('nodes', 'phones'),
+    # requests that we answer, but also pass on to the sidecar;
+    # after a change, liveleases requests the leases so that
+    # the sidecar gets them again from the API
+    'forwarded_requests' : ('leases',),
+    # in seconds
+    'reconnect_delay' : 5,
+    # browsers that support it get only the fields that change, and
+    # every so many updates on a category they get it in full again
+    'snapshot_every' : 100,
+    # where the relay writes the state it knows, so that pages can
+    # embed it and draw right away, see md/templatetags/sidecar.py
+    'snapshot_file' : os.path.join(RUNTIME_DIR, "sidecar-snapshot.json"),
+    # how often at most, in seconds
+    'snapshot_period' : 2,
+    # older snapshots are not embedded, e.g. if the relay is down
+    'snapshot_max_age' : 120,
+    # where the relay keeps the history of the nodes' status,
+    # see relay/history.py and /history/query
+    'history_dir' : os.path.join(RUNTIME_DIR, "history"),
+    # category -> the fields that we keep track of; for leases,
+    # 'occupied' tells whether a lease is running
+    'history_fields' : {
+        'nodes' : ('available', 'cmc_on_off', 'control_ping',
+                   'control_ssh', 'usrp_on_off'),
+        'phones' : ('airplane_mode',),
+        'leases' : ('occupied',),
+    },
+    # in seconds, each one a multiple of the previous one;
+    # we record a sample with the first one
+    'history_resolutions' : (60, 900, 21600),
+    # queries use the finest resolution that fits
+    'history_max_points' : 2000,
+    # where the relay listens for the changes that the web app makes,
+    # e.g. to the leases, see relay/bus.py; udp, on the loopback only
+    'bus_host' : '127.0.0.1',
+    'bus_port' : 10003,
+    # in seconds; the changes heard on the bus are shown on top of
+    # what the sidecar says, until it has them too or for that long
+    'bus_timeout' : 120,
+}
+
 # transitioning to plcauthbackend
 AUTHENTICATION_BACKENDS = (
     'plc.plcauthbackend.PlcAuthBackend',
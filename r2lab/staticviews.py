@@ -0,0 +1,188 @@
+"""
+serving files under /assets/, /raw/ and /code/
+
+compared with django.views.static.serve, this one
+* serves the precompressed .br or .gz sibling of a file if there is one
+  and the client accepts it, with an ETag of its own
+* honours single-range Range: requests
+* answers 304 on If-None-Match / If-Modified-Since
+* tells browsers to cache fingerprinted files forever
+"""
+
+import re
+import mimetypes
+from pathlib import Path
+
+from django.http import (
+    Http404, HttpResponse, HttpResponseNotModified, FileResponse)
+from django.utils.http import http_date, parse_http_date_safe
+
+from r2lab.settings import assets_settings
+from r2lab.assetmanifest import is_fingerprinted
+
+RANGE_RE = re.compile(r'bytes=(?P<start>\d*)-(?P<end>\d*)$')
+
+# in order of preference - the suffix also tells the ETags apart
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def locate(document_root, path):
+    """
+    the file to serve, or raises Http404
+    makes sure we do not escape document_root
+    """
+    root = Path(document_root).resolve()
+    try:
+        fullpath = (root / path).resolve()
+    except (OSError, ValueError):
+        raise Http404(path)
+    if root not in fullpath.parents or not fullpath.is_file():
+        raise Http404(path)
+    return fullpath
+
+
+def accepted_encodings(header):
+    """
+    the content-codings in an Accept-Encoding: header, as a dict
+    coding -> q-value, e.g. 'gzip, br;q=0' -> {'gzip': 1.0, 'br': 0.0}
+    """
+    result = {}
+    for item in header.split(','):
+        coding, *params = item.split(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        result[coding] = quality
+    return result
+
+
+def precompressed(request, fullpath):
+    """
+    the (encoding, suffix, path) of the precompressed version to serve,
+    or None if there is none that the client accepts
+    """
+    accepted = accepted_encodings(
+        request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    default = accepted.get('*', 0.0)
+    candidates = []
+    for preference, (encoding, suffix) in enumerate(ENCODINGS):
+        quality = accepted.get(encoding, default)
+        if quality <= 0:
+            continue
+        compressed = fullpath.with_name(fullpath.name + suffix)
+        if compressed.is_file():
+            candidates.append(
+                (-quality, preference, encoding, suffix, compressed))
+    if not candidates:
+        return None
+    _, _, encoding, suffix, compressed = min(candidates)
+    return encoding, suffix, compressed
+
+
+def not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag in (tag.strip() for tag in if_none_match.split(','))
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def byte_range(header, size):
+    """
+    returns (start, end) - end being inclusive - for a Range: header
+    None if the header is absent or not something we support,
+    and raises ValueError if it is not satisfiable
+    """
+    match = RANGE_RE.match(header or '')
+    if not match:
+        return None
+    start, end = match.group('start'), match.group('end')
+    if not start and not end:
+        return None
+    if not start:
+        # bytes=-500 : the last 500 bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def serve(request, path, document_root):
+    """
+    the view, to be used with a document_root keyword in the URLconf
+    """
+    fullpath = locate(document_root, path)
+    stat = fullpath.stat()
+    cache_control = IMMUTABLE if is_fingerprinted(fullpath) \
+        else f"public, max-age={assets_settings['max_age']}"
+    # each encoding is a different representation, with its own ETag
+    chosen = precompressed(request, fullpath)
+    if chosen:
+        encoding, suffix, compressed = chosen
+        compressed_stat = compressed.stat()
+        etag = (f'"{compressed_stat.st_mtime_ns:x}'
+                f'-{compressed_stat.st_size:x}-{suffix[1:]}"')
+    else:
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    if not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+    content_type, _ = mimetypes.guess_type(str(fullpath))
+    content_type = content_type or 'application/octet-stream'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control,
+        'Vary': 'Accept-Encoding',
+    }
+
+    # precompressed version if any
+    if chosen:
+        response = FileResponse(compressed.open('rb'),
+                                content_type=content_type)
+        response['Content-Encoding'] = encoding
+        response['Content-Length'] = compressed_stat.st_size
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+    headers['Accept-Ranges'] = 'bytes'
+    try:
+        requested = byte_range(request.META.get('HTTP_RANGE'), stat.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{stat.st_size}"
+        return response
+    if requested:
+        start, end = requested
+        with fullpath.open('rb') as feed:
+            feed.seek(start)
+            chunk = feed.read(end - start + 1)
+        response = HttpResponse(chunk, status=206, content_type=content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{stat.st_size}"
+    else:
+        response = FileResponse(fullpath.open('rb'),
+                                content_type=content_type)
+        response['Content-Length'] = stat.st_size
+    for key, value in headers.items():
+        response[key] = value
+    return response
@@ -11,13 +11,23 @@
 #
 
 import json
+import gzip
+import hashlib
 
 from django.http import HttpResponse
+from django.core.cache import cache
 
 from django.views.generic import View
 
+from r2lab.settings import json_settings
+from r2lab.jsonencoding import get_encoder
+from r2lab.metrics import timer
+
 class TestbedApiView(View):
-    
+
+    # how answers get serialized, see r2lab/jsonencoding.py
+    json_encoder = get_encoder(json_settings['encoder'])
+
     def not_authenticated_error(self, request):
         """
         The error to return as-is if user is not authenticated
@@ -29,16 +39,70 @@ class TestbedApiView(View):
         
 
     def decode_body_as_json(self, request):
-        utf8 = request.body.decode()
-        return json.loads(utf8)
+        with timer('decode'):
+            utf8 = request.body.decode()
+            return json.loads(utf8)
     
     def http_method_not_allowed(self, request):
+        import md.views
         env = {'previous_message' : 'HTTP method not allowed'}
         return md.views.markdown_page(request, 'oops', env)
     
     # JSON encode and wrap into a HttpResponse
     def http_response_from_struct(self, answer):
-        return HttpResponse(json.dumps(answer))
+        with timer('encode'):
+            payload = self.json_encoder.dumps(answer)
+        return self.http_response_from_bytes(payload)
+
+    def accepts_gzip(self):
+        request = getattr(self, 'request', None)
+        if request is None:
+            return False
+        return 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+    def http_response_from_bytes(self, payload, gzipped=None):
+        """
+        wrap an already encoded answer into a HttpResponse
+
+        large payloads get compressed if the client supports it;
+        gzipped, if provided, is the compressed version of payload;
+        either way their answer depends on Accept-Encoding, so that
+        caches must not serve the plain one to a gzip-capable client
+        or the other way around
+        """
+        large = len(payload) >= json_settings['gzip_min_size']
+        if large and self.accepts_gzip():
+            if gzipped is None:
+                gzipped = gzip.compress(payload)
+            response = HttpResponse(gzipped, content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(payload, content_type='application/json')
+        if large:
+            response['Vary'] = 'Accept-Encoding'
+        return response
+
+    def http_response_from_cache(self, key, record, builder):
+        """
+        for answers that are expensive to compute and that are the same
+        for all users, like /users/get
+
+        key and record are used to compute the cache key; builder is called
+        without argument if needed, and must return the struct to send back
+
+        what we store in the cache is the encoded payload, so serialization
+        and compression happen only once per timeout period
+        """
+        digest = hashlib.sha1(json.dumps(record, sort_keys=True).encode())
+        cache_key = f"json:{key}:{digest.hexdigest()}"
+        payload, gzipped = cache.get(cache_key, (None, None))
+        if payload is None:
+            payload = self.json_encoder.dumps(builder())
+            if len(payload) >= json_settings['gzip_min_size']:
+                gzipped = gzip.compress(payload)
+            cache.set(cache_key, (payload, gzipped),
+                      json_settings['cache_timeout'])
+        return self.http_response_from_bytes(payload, gzipped)
 
     def check_record(self, record, mandatory, optional):
         """
@@ -17,15 +17,12 @@ from django.urls import include, re_path
 from django.contrib import admin
 
 from django.conf import settings
-from django.conf.urls.static import static
 from django.views.generic.base import RedirectView
 
-import md.views
-import mfauth.views
-import leases.views
-import slices.views
-import users.views
-import keys.views
+import r2lab.metrics
+import r2lab.staticviews
+# views are imported upon first request, see lazyimport.py
+from r2lab.lazyimport import lazy_view
 
 from pathlib import Path
 
@@ -34,16 +31,22 @@ BASE = Path(settings.BASE_DIR)
 urlpatterns = [
     # default: empty or just / -> md/index.md
     re_path(r'^(/)?$', RedirectView.as_view(url='/index.md', permanent=False)),
+    # prometheus scraper - needs to come before the markdown catch-all
+    re_path(r'^metrics$', r2lab.metrics.metrics_view),
     # no subdir
-    re_path(r'^(?P<markdown_file>[^/]*)$', md.views.markdown_page),
-    re_path(r'^md/(?P<markdown_file>.*)$', md.views.markdown_page),
-    re_path(r'^login/', mfauth.views.Login.as_view()),
-    re_path(r'^logout/', mfauth.views.Logout.as_view()),
-    re_path(r'^leases/(?P<verb>(add|update|delete))', leases.views.LeasesProxy.as_view()),
-    re_path(r'^slices/(?P<verb>(get|renew))', slices.views.SlicesProxy.as_view()),
-    re_path(r'^users/(?P<verb>(get|renew))', users.views.UsersProxy.as_view()),
-    re_path(r'^keys/(?P<verb>(get|add|delete))', keys.views.KeysProxy.as_view()),
+    re_path(r'^(?P<markdown_file>[^/]*)$', lazy_view('md.views.markdown_page')),
+    re_path(r'^md/(?P<markdown_file>.*)$', lazy_view('md.views.markdown_page')),
+    re_path(r'^codeview/pane$', lazy_view('md.views.codeview_pane')),
+    re_path(r'^history/query$', lazy_view('relay.views.history_query')),
+    re_path(r'^login/', lazy_view('mfauth.views.Login', as_view=True)),
+    re_path(r'^logout/', lazy_view('mfauth.views.Logout', as_view=True)),
+    re_path(r'^leases/(?P<verb>(add|update|delete))', lazy_view('leases.views.LeasesProxy', as_view=True)),
+    re_path(r'^slices/(?P<verb>(get|renew))', lazy_view('slices.views.SlicesProxy', as_view=True)),
+    re_path(r'^users/(?P<verb>(get|renew))', lazy_view('users.views.UsersProxy', as_view=True)),
+    re_path(r'^keys/(?P<verb>(get|add|delete))', lazy_view('keys.views.KeysProxy', as_view=True)),
+    re_path(r'^dashboard/(?P<verb>(get))', lazy_view('dashboard.views.DashboardProxy', as_view=True)),
 ]
-urlpatterns.extend(static('/assets/', document_root=str(BASE / 'assets/')))
-urlpatterns.extend(static('/raw/', document_root=str(BASE / 'raw/')))
-urlpatterns.extend(static('/code/', document_root=str(BASE / 'code/')))
+for subdir in ('assets', 'raw', 'code'):
+    urlpatterns.append(
+        re_path(rf'^{subdir}/(?P<path>.*)$', r2lab.staticviews.serve,
+                {'document_root': str(BASE / subdir)}))
@@ -0,0 +1,226 @@
+"""
+the third-party libraries that all pages load - jquery, bootstrap, d3,
+font-awesome... - as local copies rather than from a cdn
+
+./manage.py vendorlibs fetches the pinned versions listed in
+vendor_settings, and writes them in assets/build/vendor/ under
+fingerprinted names, with their sha384 for subresource integrity;
+this module has the parts that do not depend on where files come from
+
+the font-awesome stylesheets only keep the .fa-<name>:before rules
+for the icons that we use, i.e. that appear in our templates, markdown,
+js, css or python code - and the fonts can be subset accordingly
+"""
+
+import re
+import base64
+import logging
+import hashlib
+from io import BytesIO
+from pathlib import Path
+
+try:
+    from fontTools import subset as font_subset
+except ImportError:
+    font_subset = None
+
+# a rule that gives an icon its glyph, like .fa-close:before
+ICON_SELECTOR_RE = re.compile(r'\.fa-(?P<name>[\w-]+)::?before')
+# how we spot icon names in our own files
+ICON_NAME_RE = re.compile(r'\bfa-(?P<name>[a-z0-9]+(?:-[a-z0-9]+)*)')
+# glyphs referred to directly, like "\uf072" in livemap.js;
+# font-awesome uses the private use area
+CODEPOINT_RE = re.compile(r'\\u(?P<code>f[0-9a-fA-F]{3})\b')
+CONTENT_RE = re.compile(
+    r'''content\s*:\s*["']\\(?P<code>[0-9a-fA-F]{1,6})["']''')
+
+FONT_SRC_RE = re.compile(r'\bsrc\s*:[^;}]*;?')
+FONT_URL_RE = re.compile(
+    r'''url\(\s*["']?(?P<url>[^"')]+)["']?\s*\)\s*'''
+    r'''format\(\s*["'](?P<format>[\w-]+)["']\s*\)''')
+# the font formats we keep, by order of preference
+FONT_FORMATS = ('woff2', 'woff')
+
+SOURCE_MAP_RE = re.compile(
+    r'^\s*(//[#@] sourceMappingURL=.*|/\*[#@] sourceMappingURL=.*?\*/)\s*$',
+    re.MULTILINE)
+
+
+def integrity(encoded):
+    """
+    the value for an integrity= attribute
+    """
+    digest = hashlib.sha384(encoded).digest()
+    return "sha384-" + base64.b64encode(digest).decode()
+
+
+def strip_source_map(text):
+    """
+    we do not vendor source maps, so the references would only 404
+    """
+    return SOURCE_MAP_RE.sub('', text)
+
+
+########## icons
+def used_icons(paths):
+    """
+    the set of icon names that appear in files
+    """
+    names = set()
+    for path in paths:
+        text = Path(path).read_text(encoding='utf-8', errors='replace')
+        names.update(match.group('name')
+                     for match in ICON_NAME_RE.finditer(text))
+    return names
+
+
+def used_codepoints(paths):
+    """
+    the set of glyphs that are referred to directly in files
+    """
+    codepoints = set()
+    for path in paths:
+        text = Path(path).read_text(encoding='utf-8', errors='replace')
+        codepoints.update(int(match.group('code'), 16)
+                          for match in CODEPOINT_RE.finditer(text))
+    return codepoints
+
+
+########## css
+def _skip_string_or_comment(css, index):
+    """
+    if a string or a comment starts at index, return the index
+    right after it; otherwise return index unchanged
+    """
+    if css.startswith('/*', index):
+        end = css.find('*/', index + 2)
+        return len(css) if end < 0 else end + 2
+    if css[index] in '"\'':
+        quote, index = css[index], index + 1
+        while index < len(css) and css[index] != quote:
+            index += 2 if css[index] == '\\' else 1
+        return index + 1
+    return index
+
+
+def css_rules(css):
+    """
+    splits a stylesheet into its top-level pieces, as a list of tuples
+    (prelude, block) - block being None for statements like @charset
+
+    comments are dropped, except the /*! ones that hold licenses,
+    which come as (comment, None)
+    """
+    rules = []
+    index, start = 0, 0
+    depth, brace = 0, 0
+    while index < len(css):
+        if css.startswith('/*', index) and depth == 0:
+            end = _skip_string_or_comment(css, index)
+            if css.startswith('/*!', index):
+                rules.append((css[index:end], None))
+            # a comment in a prelude is dropped too
+            css = css[:index] + css[end:]
+            continue
+        skipped = _skip_string_or_comment(css, index)
+        if skipped != index:
+            index = skipped
+            continue
+        char = css[index]
+        if char == '{':
+            if depth == 0:
+                brace = index
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                rules.append((css[start:brace].strip(),
+                              css[brace + 1:index].strip()))
+                start = index + 1
+        elif char == ';' and depth == 0:
+            rules.append((css[start:index + 1].strip(), None))
+            start = index + 1
+        index += 1
+    return rules
+
+
+def subset_icons(css, names):
+    """
+    the stylesheet without the icon rules for the icons not in names
+
+    returns a tuple (css, codepoints), where codepoints
+    is the set of glyphs that the remaining rules show
+    """
+    output = []
+    codepoints = set()
+    for prelude, block in css_rules(css):
+        if block is None:
+            output.append(prelude)
+            continue
+        selectors = [selector.strip() for selector in prelude.split(',')]
+        matches = [ICON_SELECTOR_RE.fullmatch(selector)
+                   for selector in selectors]
+        if selectors and all(matches):
+            selectors = [match.group() for match in matches
+                         if match.group('name') in names]
+            if not selectors:
+                continue
+        codepoints.update(int(match.group('code'), 16)
+                          for match in CONTENT_RE.finditer(block))
+        output.append(f"{','.join(selectors)}{{{block}}}")
+    return "\n".join(output) + "\n", codepoints
+
+
+def rewrite_font_faces(css, replace):
+    """
+    in the @font-face rules, keep only the woff2 and woff sources,
+    with urls changed into replace(url)
+    """
+    def rewrite(match):
+        sources = {font.group('format'): font.group('url')
+                   for font in FONT_URL_RE.finditer(match.group())}
+        kept = [f'url({replace(sources[font_format])})'
+                f' format("{font_format}")'
+                for font_format in FONT_FORMATS if font_format in sources]
+        # the first src: is the legacy one for IE, and has no format()
+        return f"src:{','.join(kept)};" if kept else ""
+
+    output = []
+    for prelude, block in css_rules(css):
+        if block is not None and prelude.lower() == '@font-face':
+            block = FONT_SRC_RE.sub(rewrite, block)
+            output.append(f"{prelude}{{{block}}}")
+        elif block is not None:
+            output.append(f"{prelude}{{{block}}}")
+        else:
+            output.append(prelude)
+    return "\n".join(output) + "\n"
+
+
+########## fonts
+def subset_font(contents, codepoints, font_format):
+    """
+    a version of the font with only these glyphs, in the same format
+
+    returns None if fontTools is not available, or cannot do the job;
+    note that woff2 also requires the brotli module
+    """
+    if font_subset is None:
+        return None
+    options = font_subset.Options()
+    options.flavor = font_format
+    options.notdef_outline = True
+    # the icons do not use ligatures or other features
+    options.layout_features = []
+    # it warns about the tables it drops, like FFTM, that we do not need
+    logging.getLogger('fontTools.subset').setLevel(logging.ERROR)
+    try:
+        font = font_subset.load_font(BytesIO(contents), options)
+        subsetter = font_subset.Subsetter(options)
+        subsetter.populate(unicodes=codepoints)
+        subsetter.subset(font)
+        output = BytesIO()
+        font_subset.save_font(font, output, options)
+    except Exception:                   # pylint: disable=w0703
+        return None
+    return output.getvalue()
@@ -0,0 +1,20 @@
+"""
+a relay between the browsers and the sidecar
+
+each page that shows live status - livemap, livetable, liveleases... -
+holds a websocket to the sidecar, and sends it one 'request' per
+category at startup; so the sidecar's load grows with the number
+of viewers
+
+the relay holds a single connection to the sidecar, keeps the latest
+state of each category, answers the browsers' requests from there,
+and forwards the sidecar's updates to the browsers that have asked
+for that category
+
+    ./manage.py runrelay
+    ./manage.py standinsidecar      # a local sidecar to test against
+    ./manage.py loadsidecar         # measure latency and throughput
+
+the messages are the sidecar's, i.e. json objects like
+    {"category": "nodes", "action": "info", "message": [{"id": 1, ...}]}
+"""
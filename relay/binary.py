@@ -0,0 +1,245 @@
+"""
+a compact binary encoding of the sidecar messages, for the browsers
+that ask for it with the 'binary' feature, see relay/server.py
+
+frames are MessagePack - https://msgpack.org/ - arrays:
+    [category, "schema", [field, ...]]
+    [category, "info", rows]
+    [category, "delta", seq, full, rows]
+where rows stand for the list of records of the json messages;
+the field names are sent once per connection, in the schema frames,
+and each record is either an array with all the fields of the schema
+in that order, or a map from field index to value with only the
+fields it has - e.g. a delta about one field of one node is
+{0: 4, 2: "off"}
+
+the schema of a category only grows; the relay sends it again to a
+browser before a frame that uses fields it has not been told about
+
+assets/r2lab/sidecar-binary.js does the decoding in the browser
+"""
+
+import struct
+
+
+########## MessagePack, the subset that json can express
+def packb(obj):
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def _pack(obj, out):
+    # pylint: disable=too-many-branches
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        _pack_int(obj, out)
+    elif isinstance(obj, float):
+        out += b'\xcb' + struct.pack('>d', obj)
+    elif isinstance(obj, str):
+        encoded = obj.encode('utf-8')
+        size = len(encoded)
+        if size < 32:
+            out.append(0xa0 | size)
+        elif size < 2**8:
+            out += b'\xd9' + struct.pack('>B', size)
+        elif size < 2**16:
+            out += b'\xda' + struct.pack('>H', size)
+        else:
+            out += b'\xdb' + struct.pack('>I', size)
+        out += encoded
+    elif isinstance(obj, (list, tuple)):
+        _pack_header(len(obj), 0x90, b'\xdc', b'\xdd', out)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        _pack_header(len(obj), 0x80, b'\xde', b'\xdf', out)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f"cannot pack {type(obj).__name__}")
+
+
+def _pack_header(size, fix, marker16, marker32, out):
+    if size < 16:
+        out.append(fix | size)
+    elif size < 2**16:
+        out += marker16 + struct.pack('>H', size)
+    else:
+        out += marker32 + struct.pack('>I', size)
+
+
+def _pack_int(value, out):
+    if 0 <= value < 128:
+        out.append(value)
+    elif -32 <= value < 0:
+        out.append(value & 0xff)
+    elif value >= 0:
+        for marker, code, size in ((b'\xcc', '>B', 8), (b'\xcd', '>H', 16),
+                                   (b'\xce', '>I', 32), (b'\xcf', '>Q', 64)):
+            if value < 2**size:
+                out += marker + struct.pack(code, value)
+                return
+        raise ValueError(f"{value} is too large to pack")
+    else:
+        for marker, code, size in ((b'\xd0', '>b', 8), (b'\xd1', '>h', 16),
+                                   (b'\xd2', '>i', 32), (b'\xd3', '>q', 64)):
+            if value >= -2**(size - 1):
+                out += marker + struct.pack(code, value)
+                return
+        raise ValueError(f"{value} is too small to pack")
+
+
+# marker -> (struct code, size) for the fixed-size types
+_FIXED = {
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+# marker -> (struct code of the length, kind)
+_SIZED = {
+    0xd9: ('>B', 'str'), 0xda: ('>H', 'str'), 0xdb: ('>I', 'str'),
+    0xdc: ('>H', 'array'), 0xdd: ('>I', 'array'),
+    0xde: ('>H', 'map'), 0xdf: ('>I', 'map'),
+}
+
+
+def unpackb(data):
+    """
+    the reverse of packb; raises ValueError on what it cannot decode
+    """
+    try:
+        obj, offset = _unpack(data, 0)
+    except (IndexError, struct.error, UnicodeDecodeError) as exc:
+        raise ValueError(f"invalid frame - {exc}")
+    if offset != len(data):
+        raise ValueError("invalid frame - trailing bytes")
+    return obj
+
+
+def _unpack(data, offset):
+    marker = data[offset]
+    offset += 1
+    if marker < 0x80:
+        return marker, offset
+    if marker >= 0xe0:
+        return marker - 0x100, offset
+    if marker in (0xc0, 0xc2, 0xc3):
+        return {0xc0: None, 0xc2: False, 0xc3: True}[marker], offset
+    if marker in _FIXED:
+        code, size = _FIXED[marker]
+        return struct.unpack_from(code, data, offset)[0], offset + size
+    if 0xa0 <= marker < 0xc0:
+        kind, size = 'str', marker & 0x1f
+    elif 0x90 <= marker < 0xa0:
+        kind, size = 'array', marker & 0x0f
+    elif 0x80 <= marker < 0x90:
+        kind, size = 'map', marker & 0x0f
+    elif marker in _SIZED:
+        code, kind = _SIZED[marker]
+        size = struct.unpack_from(code, data, offset)[0]
+        offset += struct.calcsize(code)
+    else:
+        raise ValueError(f"unsupported marker {marker:#x}")
+    if kind == 'str':
+        if offset + size > len(data):
+            raise IndexError("truncated string")
+        return data[offset:offset + size].decode('utf-8'), offset + size
+    if kind == 'array':
+        items = []
+        for _ in range(size):
+            item, offset = _unpack(data, offset)
+            items.append(item)
+        return items, offset
+    result = {}
+    for _ in range(size):
+        key, offset = _unpack(data, offset)
+        result[key], offset = _unpack(data, offset)
+    return result, offset
+
+
+########## the sidecar messages
+class Schema:
+    """
+    the field names seen so far in the records of one category
+    """
+
+    def __init__(self):
+        self.fields = []
+        self.indexes = {}
+
+    def rows(self, records):
+        """
+        the records as rows, or None if they are not all dicts
+        with string keys, in which case json has to do
+        """
+        if not isinstance(records, list):
+            return None
+        rows = []
+        for record in records:
+            if not isinstance(record, dict):
+                return None
+            for field in record:
+                if not isinstance(field, str):
+                    return None
+                if field not in self.indexes:
+                    self.indexes[field] = len(self.fields)
+                    self.fields.append(field)
+            if len(record) == len(self.fields):
+                rows.append([record[field] for field in self.fields])
+            else:
+                rows.append({self.indexes[field]: value
+                             for field, value in record.items()})
+        return rows
+
+
+def encode(schema, category, action, message):
+    """
+    the binary frame for a message that the relay sends, i.e.
+    an info or a delta; or None if it has to go as json
+    """
+    try:
+        if action == 'info':
+            rows = schema.rows(message)
+            return None if rows is None else packb([category, action, rows])
+        if action == 'delta':
+            rows = schema.rows(message['infos'])
+            return None if rows is None else packb(
+                [category, action, message['seq'], message['full'], rows])
+    except (TypeError, ValueError):
+        # e.g. a huge integer
+        pass
+    return None
+
+
+def schema_frame(schema, category):
+    return packb([category, 'schema', schema.fields])
+
+
+def decode(frame, schemas):
+    """
+    the other way around, for tests and load tests: returns the
+    (category, action, message) as in json, or None for schema frames;
+    schemas is a dict category -> list of fields, that gets updated
+    """
+    category, action, *rest = unpackb(frame)
+    if action == 'schema':
+        schemas[category] = rest[0]
+        return None
+    fields = schemas.get(category, [])
+
+    def record(row):
+        if isinstance(row, list):
+            return dict(zip(fields, row))
+        return {fields[index]: value for index, value in row.items()}
+    if action == 'delta':
+        seq, full, rows = rest
+        return category, action, {'seq': seq, 'full': full,
+                                  'infos': [record(row) for row in rows]}
+    return category, action, [record(row) for row in rest[0]]
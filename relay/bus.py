@@ -0,0 +1,101 @@
+"""
+a local bus for the web app to tell the relay about the changes it
+makes, so that the browsers do not wait for the sidecar to notice
+
+for now this is about the leases: once LeasesProxy has changed a
+lease through the PLCAPI, it sends the relay a datagram like
+    {"category": "leases", "action": "changed",
+     "message": {"verb": "add", "lease": {"uuid": 12, ...}}}
+the relay then sends the updated leases to the browsers right away,
+and asks the sidecar to get them again from the API
+
+this is udp on the loopback, so publishing never blocks or breaks
+the request; if the relay is not running, the datagram is just lost
+
+as any local process can send to that port, datagrams are signed
+with an hmac of SECRET_KEY, and carry the time they were sent at so
+that they cannot be replayed later on:
+    <signature> <time> <json>
+"""
+
+import time
+import socket
+import asyncio
+
+from django.utils.crypto import salted_hmac, constant_time_compare
+
+from r2lab.settings import logger, relay_settings, SECRET_KEY
+
+from relay.state import umbrella, parse_umbrella
+
+BUS_ADDRESS = (relay_settings['bus_host'], relay_settings['bus_port'])
+# in seconds, older datagrams are dropped
+MAX_AGE = 10
+
+
+def signature(payload):
+    return salted_hmac("relay.bus", payload, secret=SECRET_KEY,
+                       algorithm='sha256').hexdigest()
+
+
+def sign(text, now=None):
+    """
+    the datagram for text, a json umbrella
+    """
+    payload = f"{now or time.time():.3f} {text}"
+    return f"{signature(payload)} {payload}".encode('utf-8')
+
+
+def verify(datagram, now=None):
+    """
+    the json text in datagram, or None if it is not properly signed,
+    or too old
+    """
+    try:
+        received, payload = datagram.decode('utf-8').split(' ', 1)
+        sent, text = payload.split(' ', 1)
+        age = (now or time.time()) - float(sent)
+    except ValueError:
+        return None
+    if not constant_time_compare(received, signature(payload)):
+        return None
+    if not -MAX_AGE <= age <= MAX_AGE:
+        return None
+    return text
+
+
+def publish(category, message, address=BUS_ADDRESS):
+    datagram = sign(umbrella(category, 'changed', message))
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(datagram, address)
+    except OSError as exc:
+        logger.warning(f"bus: could not publish on {category} - {exc}")
+
+
+def publish_lease_change(verb, lease):
+    """
+    verb is add, update or delete; lease is as in the sidecar
+    """
+    publish('leases', {'verb': verb, 'lease': lease})
+
+
+class BusProtocol(asyncio.DatagramProtocol):
+    """
+    the relay end, that calls callback(category, message)
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def datagram_received(self, data, addr):
+        text = verify(data)
+        if text is None:
+            logger.warning(f"bus: unsigned datagram from {addr} - dropped")
+            return
+        parsed = parse_umbrella(text)
+        if parsed is None or parsed[1] != 'changed':
+            logger.info(f"bus: unexpected datagram from {addr} - dropped")
+            return
+        category, _, message = parsed
+        self.callback(category, message)
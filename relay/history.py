@@ -0,0 +1,296 @@
+"""
+the history of the nodes' status, as recorded by the relay
+
+each field that we keep track of, for each node - e.g. cmc_on_off
+on node 4 - is a column of samples, one per minute, in a memory-mapped
+file; values are stored as small integers, 0 meaning no data, and the
+legend that maps them back to strings is in meta.json, together with
+the time of the first sample
+
+for each coarser resolution - 15 minutes and 6 hours by default - there
+are two more columns, with the most frequent value in each slot and the
+number of times the value has changed in there; so a node that flaps
+shows even over months
+
+a query reads only the slots in its time range, at the finest
+resolution that gives at most history_max_points samples, so it
+does not get slower as the history grows
+"""
+
+import os
+import re
+import json
+import mmap
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from r2lab.assetmanifest import ManifestFile
+
+NO_DATA = 0
+# up to 255 distinct values per field
+VALUES_TYPECODE = 'B'
+FLIPS_TYPECODE = 'H'
+MAX_FLIPS = 2**16 - 1
+# the ids and fields end up in file names
+NAME_RE = re.compile(r'^[\w-]+$')
+# the id for the categories that are not about nodes
+TESTBED = 'testbed'
+
+
+class Column:
+    """
+    an array of unsigned integers in a memory-mapped file, e.g.
+        with Column(path, 'B', writable=True) as column:
+            column[index] = value
+
+    files grow by chunks as needed; reading past the end yields NO_DATA
+    """
+
+    CHUNK = 4096
+
+    def __init__(self, path, typecode, *, writable=False):
+        self.path = path
+        self.typecode = typecode
+        self.writable = writable
+        self.fd = None
+        self.map = None
+        self.view = None
+
+    def __enter__(self):
+        if self.writable:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        else:
+            try:
+                self.fd = os.open(self.path, os.O_RDONLY)
+            except FileNotFoundError:
+                return self
+        self._map()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._unmap()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _map(self):
+        size = os.fstat(self.fd).st_size
+        if not size:
+            return
+        access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+        self.map = mmap.mmap(self.fd, size, access=access)
+        self.view = memoryview(self.map).cast(self.typecode)
+
+    def _unmap(self):
+        if self.view is not None:
+            self.view.release()
+            self.map.close()
+            self.view = self.map = None
+
+    def __len__(self):
+        return 0 if self.view is None else len(self.view)
+
+    def __setitem__(self, index, value):
+        if index >= len(self):
+            chunks = index // self.CHUNK + 1
+            self._unmap()
+            itemsize = array(self.typecode).itemsize
+            os.ftruncate(self.fd, chunks * self.CHUNK * itemsize)
+            self._map()
+        self.view[index] = value
+
+    def read(self, start, stop):
+        """
+        the values in [start, stop), as a list
+        """
+        if stop <= start:
+            return []
+        known = []
+        if self.view is not None:
+            known = self.view[max(start, 0):max(min(stop, len(self)), 0)]
+            known = known.tolist()
+        before = [NO_DATA] * min(max(-start, 0), stop - start)
+        return before + known + [NO_DATA] * (stop - start - len(before)
+                                             - len(known))
+
+
+def flips(previous, values):
+    """
+    how many times values change, ignoring the lack of data
+    """
+    count = 0
+    for value in values:
+        if value != NO_DATA:
+            if previous != NO_DATA and value != previous:
+                count += 1
+            previous = value
+    return count
+
+
+def history_samples(states, fields, now):
+    """
+    a list of tuples (category, id, {field: value}) for the current
+    state of the categories; this runs in the relay's event loop,
+    so the rest can be done in another thread
+    """
+    samples = []
+    for category, category_fields in fields.items():
+        state = states.get(category)
+        if state is None or not state.known():
+            continue
+        if category == 'leases':
+            occupied = any(lease_is_running(lease, now)
+                           for lease in state.snapshot())
+            samples.append((category, TESTBED,
+                            {'occupied': 'yes' if occupied else 'no'}))
+            continue
+        for record in state.snapshot():
+            record_id = str(record['id'])
+            if NAME_RE.match(record_id):
+                samples.append((category, record_id,
+                                {field: record.get(field)
+                                 for field in category_fields}))
+    return samples
+
+
+def lease_is_running(lease, now):
+    try:
+        valid_from = datetime.fromisoformat(lease['valid_from'])
+        valid_until = datetime.fromisoformat(lease['valid_until'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    now = datetime.fromtimestamp(now, tz=timezone.utc)
+    if valid_from.tzinfo is None:
+        now = now.replace(tzinfo=None)
+    return valid_from <= now < valid_until
+
+
+class History:
+
+    def __init__(self, directory, *, resolutions, writable=False):
+        self.directory = Path(directory)
+        self.resolutions = resolutions
+        self.writable = writable
+        self.meta_file = ManifestFile(self.directory / "meta.json")
+
+    def column(self, resolution, category, record_id, field, kind):
+        path = (self.directory / str(resolution)
+                / f"{category}-{record_id}-{field}.{kind}")
+        typecode = FLIPS_TYPECODE if kind == 'flips' else VALUES_TYPECODE
+        return Column(path, typecode, writable=self.writable)
+
+    ########## writing
+    def record(self, samples, now):
+        """
+        store samples, as returned by history_samples(), at time now
+        """
+        meta = self.meta_file.get()
+        if not meta:
+            # so that slots align at all resolutions
+            coarsest = self.resolutions[-1]
+            meta = {'origin': now // coarsest * coarsest, 'legend': {}}
+        legend_size = sum(len(values) for values in meta['legend'].values())
+        index = int((now - meta['origin']) // self.resolutions[0])
+        # the clock went back
+        if index < 0:
+            return
+        for category, record_id, values in samples:
+            for field, value in values.items():
+                if not NAME_RE.match(field):
+                    continue
+                code = self.code(meta['legend'], category, field, value)
+                with self.column(self.resolutions[0], category,
+                                 record_id, field, 'values') as column:
+                    column[index] = code
+                    self.downsample(column, category, record_id, field,
+                                    index)
+        if (legend_size != sum(len(values)
+                               for values in meta['legend'].values())
+                or not self.meta_file.path.exists()):
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = self.meta_file.path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(meta, indent=2))
+            tmp.replace(self.meta_file.path)
+
+    @staticmethod
+    def code(legend, category, field, value):
+        if value is None:
+            return NO_DATA
+        values = legend.setdefault(f"{category}.{field}", [])
+        value = str(value)
+        if value not in values:
+            if len(values) >= 255:
+                return NO_DATA
+            values.append(value)
+        return values.index(value) + 1
+
+    def downsample(self, base_column, category, record_id, field, index):
+        """
+        update the coarser slots that contain index
+        """
+        base = self.resolutions[0]
+        for resolution in self.resolutions[1:]:
+            factor = resolution // base
+            slot = index // factor
+            start = slot * factor
+            values = base_column.read(start - 1, index + 1)
+            previous, values = values[0], values[1:]
+            counter = Counter(value for value in values if value != NO_DATA)
+            mode = counter.most_common(1)[0][0] if counter else NO_DATA
+            with self.column(resolution, category, record_id,
+                             field, 'values') as column:
+                column[slot] = mode
+            with self.column(resolution, category, record_id,
+                             field, 'flips') as column:
+                column[slot] = min(flips(previous, values), MAX_FLIPS)
+
+    ########## reading
+    def query(self, category, record_id, field, start, end, max_points):
+        """
+        a dict with the values of field for record_id between
+        start and end, e.g.
+        {'resolution': 900, 'start': 1700000000,
+         'legend': [None, 'on', 'off'], 'values': [1, 1, 2, 0, ...],
+         'flips': [0, 0, 3, 0, ...]}
+        values are indexes in legend, and start is the time of the
+        first one - that can be later than the start asked for, if
+        the range is too wide; or None if there is no history at all
+        """
+        meta = self.meta_file.get()
+        if not meta:
+            return None
+        for resolution in self.resolutions:
+            if (end - start) / resolution <= max_points:
+                break
+        origin = meta['origin']
+        first = max(int((start - origin) // resolution), 0)
+        last = max(int((end - origin) // resolution) + 1, first)
+        # even the coarsest resolution is too fine, keep the most recent
+        first = max(first, last - max_points)
+        if resolution == self.resolutions[0]:
+            with self.column(resolution, category, record_id,
+                             field, 'values') as column:
+                values = column.read(first - 1, last)
+            previous, values = values[0], values[1:]
+            changes = []
+            for value in values:
+                changes.append(flips(previous, [value]))
+                if value != NO_DATA:
+                    previous = value
+        else:
+            with self.column(resolution, category, record_id,
+                             field, 'values') as column:
+                values = column.read(first, last)
+            with self.column(resolution, category, record_id,
+                             field, 'flips') as column:
+                changes = column.read(first, last)
+        return {
+            'resolution': resolution,
+            'start': origin + first * resolution,
+            'legend': [None] + meta['legend'].get(f"{category}.{field}", []),
+            'values': values,
+            'flips': changes,
+        }
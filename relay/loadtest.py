@@ -0,0 +1,244 @@
+"""
+a load test for the sidecar, or for the relay in front of it
+
+an injector plays the part of the monitors: it sends info messages
+to the sidecar - normally the stand-in, see relay/standin.py - at a
+given rate for each category; and many clients connect to the target -
+the same sidecar, or a relay - and request these categories, like the
+live pages do
+
+each change carries, in its 'probe' field, the time it was sent at,
+so the clients can tell how long it took to reach them; the report
+has the latency percentiles, and the throughput in messages and bytes
+
+the clients run in the same process, so with many of them the
+latencies include some of our own time as well
+"""
+
+import time
+import asyncio
+from collections import Counter
+
+import websockets
+
+from relay.state import umbrella, parse_umbrella
+from relay.standin import random_change
+from relay.binary import decode
+
+PROBE = 'probe'
+
+
+def percentiles(values, points=(50, 90, 99, 100)):
+    """
+    a dict point -> value, e.g. {50: 0.002, 90: 0.004, ...}
+    """
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {point: ordered[min(len(ordered) - 1,
+                               int(len(ordered) * point / 100))]
+            for point in points}
+
+
+class LoadClient:
+    """
+    one connection to the target, that keeps track of the probes
+    """
+
+    def __init__(self, url, categories, *, deltas, binary):
+        self.url = url
+        self.categories = set(categories)
+        self.deltas = deltas
+        self.binary = binary
+        # for the binary frames
+        self.schemas = {}
+        # set once we have heard of all the categories, or given up
+        self.ready = asyncio.Event()
+        self.heard = set()
+        # the probes sent before that are not for us, see start()
+        self.since = None
+        self.seen = set()
+        self.latencies = []
+        self.messages = 0
+        self.bytes = 0
+        self.error = None
+
+    def start(self, since):
+        """
+        from now on, keep track of the probes sent after since
+        """
+        self.since = since
+        self.messages = self.bytes = 0
+
+    async def run(self):
+        try:
+            # no need to wait long for the closing handshake
+            async with websockets.connect(self.url,
+                                          close_timeout=1) as websocket:
+                features = ((['deltas'] if self.deltas else [])
+                            + (['binary'] if self.binary else []))
+                if features:
+                    await websocket.send(
+                        umbrella('relay', 'features', features))
+                for category in self.categories:
+                    await websocket.send(
+                        umbrella(category, 'request', 'please'))
+                async for text in websocket:
+                    self.receive(text)
+        except (OSError, websockets.ConnectionClosed,
+                websockets.InvalidHandshake) as exc:
+            self.error = exc
+        finally:
+            self.ready.set()
+
+    def receive(self, data):
+        received = time.time()
+        self.messages += 1
+        self.bytes += len(data)
+        if isinstance(data, bytes):
+            try:
+                parsed = decode(data, self.schemas)
+            except ValueError:
+                return
+        else:
+            parsed = parse_umbrella(data)
+        if parsed is None:
+            return
+        category, action, message = parsed
+        if action == 'delta' and isinstance(message, dict):
+            message = message.get('infos')
+        elif action != 'info':
+            return
+        if category not in self.categories or not isinstance(message, list):
+            return
+        self.heard.add(category)
+        if self.heard == self.categories:
+            self.ready.set()
+        if self.since is None:
+            return
+        for record in message:
+            if not isinstance(record, dict):
+                continue
+            sent = record.get(PROBE)
+            # complete states show the same probes again
+            if (isinstance(sent, float) and sent >= self.since
+                    and (category, sent) not in self.seen):
+                self.seen.add((category, sent))
+                self.latencies.append(received - sent)
+
+
+class Injector:
+    """
+    sends changes to the sidecar, rates is a dict category -> per second
+    """
+
+    def __init__(self, url, rates):
+        self.url = url
+        self.rates = rates
+        self.sent = Counter()
+
+    async def run(self, duration):
+        async with websockets.connect(self.url) as websocket:
+            # the sidecar sends our changes back to us as well
+            ignore = asyncio.create_task(self.ignore(websocket))
+            try:
+                await asyncio.gather(*(
+                    self.inject(websocket, category, rate, duration)
+                    for category, rate in self.rates.items() if rate > 0))
+            finally:
+                ignore.cancel()
+
+    @staticmethod
+    async def ignore(websocket):
+        try:
+            async for _ in websocket:
+                pass
+        except websockets.ConnectionClosed:
+            pass
+
+    async def inject(self, websocket, category, rate, duration):
+        start = time.monotonic()
+        while (elapsed := time.monotonic() - start) < duration:
+            # on schedule, and catching up if we are late
+            due = self.sent[category] / rate
+            if due > elapsed:
+                await asyncio.sleep(due - elapsed)
+            _, infos = random_change(category)
+            infos[0][PROBE] = time.time()
+            await websocket.send(umbrella(category, 'info', infos))
+            self.sent[category] += 1
+
+
+class LoadTest:
+
+    def __init__(self, *, inject_url, target_url, rates, nb_clients,
+                 deltas, binary, duration, drain=1, connect_timeout=10):
+        self.inject_url = inject_url
+        self.target_url = target_url
+        self.rates = rates
+        self.nb_clients = nb_clients
+        self.deltas = deltas
+        self.binary = binary
+        self.duration = duration
+        # how long to wait for the last messages
+        self.drain = drain
+        self.connect_timeout = connect_timeout
+
+    async def run(self):
+        """
+        returns the report, see report()
+        """
+        clients = [LoadClient(self.target_url, self.rates,
+                              deltas=self.deltas, binary=self.binary)
+                   for _ in range(self.nb_clients)]
+        tasks = [asyncio.create_task(client.run()) for client in clients]
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(client.ready.wait() for client in clients)),
+                self.connect_timeout)
+        except asyncio.TimeoutError:
+            pass
+        since = time.time()
+        for client in clients:
+            client.start(since)
+        injector = Injector(self.inject_url, self.rates)
+        try:
+            await injector.run(self.duration)
+            await asyncio.sleep(self.drain)
+            elapsed = time.time() - since
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.report(clients, injector, elapsed)
+
+    @staticmethod
+    def report(clients, injector, elapsed):
+        """
+        a dict that can go as is in a json file; times are in seconds,
+        except for the latencies that are in milliseconds
+        """
+        connected = [client for client in clients if client.error is None]
+        latencies = [latency for client in connected
+                     for latency in client.latencies]
+        injected = sum(injector.sent.values())
+        messages = sum(client.messages for client in connected)
+        expected = injected * len(connected)
+        return {
+            'clients': len(clients),
+            'connected': len(connected),
+            'errors': sorted({str(client.error) for client in clients
+                              if client.error is not None}),
+            'elapsed': elapsed,
+            'injected': dict(injector.sent),
+            'injected_per_second': injected / elapsed,
+            'delivered': len(latencies),
+            'delivered_ratio': len(latencies) / expected if expected else 0,
+            'messages': messages,
+            'messages_per_second': messages / elapsed,
+            'bytes_per_second': sum(client.bytes
+                                    for client in connected) / elapsed,
+            'latency_ms': {
+                'max' if point == 100 else f"p{point}": 1000 * value
+                for point, value in percentiles(latencies).items()},
+        }
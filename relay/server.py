@@ -0,0 +1,364 @@
+"""
+the relay itself: one connection upstream, many downstream
+
+browsers can ask for deltas, by sending first
+    {"category": "relay", "action": "features", "message": ["deltas"]}
+they then get, instead of the sidecar's info messages,
+    {"category": "nodes", "action": "delta",
+     "message": {"seq": 12, "full": false, "infos": [{"id": 4, ...}]}}
+where infos only has the records and fields that have changed; seq
+increases by one for each delta on a category, so a browser that sees
+a gap can send a request to get the whole state again; which it also
+gets, with full set to true, every relay_settings['snapshot_every']
+deltas - and always for categories that are not merged, like leases
+
+browsers can also ask for the 'binary' feature, in which case the
+info and delta messages come as binary frames, see relay/binary.py;
+the browser messages, and the answer to features, remain json
+
+the relay also writes what it knows in a file, see relay/snapshot.py,
+records the history of the nodes' status, see relay/history.py, and
+hears from the web app when it changes the leases, see relay/bus.py
+"""
+
+import time
+import asyncio
+
+import websockets
+
+from r2lab.settings import logger
+
+from relay.state import CategoryState, umbrella, parse_umbrella
+from relay.snapshot import write_snapshot
+from relay.binary import Schema, encode, schema_frame
+from relay.history import history_samples
+from relay.bus import BusProtocol
+
+# in seconds, see write_snapshots
+SNAPSHOT_REFRESH = 60
+
+
+class Relay:
+
+    def __init__(self, upstream_url, *, categories, merged_categories,
+                 forwarded_requests, reconnect_delay, snapshot_every,
+                 snapshot_file=None, snapshot_period=None,
+                 history=None, history_fields=None, bus_address=None,
+                 bus_timeout=120):
+        self.upstream_url = upstream_url
+        self.forwarded_requests = forwarded_requests
+        self.reconnect_delay = reconnect_delay
+        self.snapshot_every = snapshot_every
+        self.snapshot_file = snapshot_file
+        self.snapshot_period = snapshot_period
+        # whether the snapshot file needs to be written again
+        self.dirty = False
+        # a writable relay.history.History
+        self.history = history
+        self.history_fields = history_fields
+        # a (host, port) to listen on for relay.bus
+        self.bus_address = bus_address
+        # how long the changes heard on the bus prevail over
+        # what the sidecar says, see handle_bus
+        self.bus_timeout = bus_timeout
+        # category -> {uuid: (verb, lease, deadline)}
+        self.pending = {category: {} for category in categories}
+        # so they do not get garbage-collected while running
+        self.background_tasks = set()
+        self.states = {category: CategoryState(category,
+                                               category in merged_categories)
+                       for category in categories}
+        # category -> the browser connections that have requested it
+        self.subscribers = {category: set() for category in categories}
+        # the browser connections that have asked for deltas
+        self.delta_clients = set()
+        # the ones that have asked for binary frames, see relay/binary.py
+        self.binary_clients = set()
+        self.schemas = {category: Schema() for category in categories}
+        # binary connection -> {category: how many fields it knows of}
+        self.known_fields = {}
+        # the upstream connection, when it is up
+        self.upstream = None
+        # for monitoring
+        self.counters = {'requests': 0, 'from_cache': 0,
+                         'updates': 0, 'sent': 0, 'bytes': 0}
+
+    ########## upstream
+    async def run_upstream(self):
+        """
+        keep a connection to the sidecar, forever
+        """
+        while True:
+            try:
+                async with websockets.connect(self.upstream_url) as upstream:
+                    logger.info(f"relay: connected to {self.upstream_url}")
+                    self.upstream = upstream
+                    # we may have missed something while disconnected
+                    for category in self.states:
+                        await upstream.send(
+                            umbrella(category, 'request', 'please'))
+                    async for text in upstream:
+                        self.handle_upstream(text)
+            except (OSError, websockets.ConnectionClosed,
+                    websockets.InvalidHandshake) as exc:
+                logger.warning(f"relay: lost {self.upstream_url} - {exc}")
+            finally:
+                self.upstream = None
+            await asyncio.sleep(self.reconnect_delay)
+
+    def handle_upstream(self, text):
+        parsed = parse_umbrella(text)
+        if parsed is None:
+            return
+        category, action, message = parsed
+        if action != 'info' or category not in self.states:
+            return
+        overlaid = self.overlay(category, message)
+        if overlaid is not message:
+            message, text = overlaid, None
+        state = self.states[category]
+        seq = state.seq
+        changes = state.update(message)
+        if changes is None:
+            logger.warning(f"relay: unexpected info on {category} - ignored")
+            return
+        self.counters['updates'] += 1
+        subscribers = self.subscribers[category]
+        self.send(subscribers - self.delta_clients,
+                  category, 'info', message, text)
+        if state.seq != seq:
+            self.dirty = True
+            self.send(subscribers & self.delta_clients,
+                      category, 'delta', self.delta(state, changes))
+
+    def delta(self, state, changes):
+        """
+        the message of the delta for the changes just made to state
+        """
+        full = not state.merged or state.seq % self.snapshot_every == 0
+        return {
+            'seq': state.seq, 'full': full,
+            'infos': state.snapshot() if full else changes,
+        }
+
+    def send(self, websockets_set, category, action, message, text=None):
+        """
+        each connection gets the message in the format it has asked for;
+        text is the json version, if we have it already
+
+        this does not wait for slow browsers, whose messages get
+        buffered by the websockets library
+        """
+        binary = websockets_set & self.binary_clients
+        frame = None
+        if binary:
+            schema = self.schemas[category]
+            frame = encode(schema, category, action, message)
+        if frame is None:
+            binary = set()
+        else:
+            # the ones that have not been told about the latest fields
+            behind = {websocket for websocket in binary
+                      if self.known_fields[websocket].get(category, 0)
+                      < len(schema.fields)}
+            if behind:
+                self.broadcast(behind, schema_frame(schema, category))
+                for websocket in behind:
+                    self.known_fields[websocket][category] = \
+                        len(schema.fields)
+            self.broadcast(binary, frame)
+        plain = websockets_set - binary
+        if plain:
+            self.broadcast(plain, text or umbrella(category, action, message))
+
+    def broadcast(self, websockets_set, data):
+        self.counters['sent'] += len(websockets_set)
+        self.counters['bytes'] += len(websockets_set) * len(data)
+        websockets.broadcast(websockets_set, data)
+
+    ########## downstream
+    async def serve_client(self, websocket):
+        try:
+            async for text in websocket:
+                await self.handle_client(websocket, text)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.delta_clients.discard(websocket)
+            self.binary_clients.discard(websocket)
+            self.known_fields.pop(websocket, None)
+            for subscribers in self.subscribers.values():
+                subscribers.discard(websocket)
+
+    async def handle_client(self, websocket, text):
+        parsed = parse_umbrella(text)
+        if parsed is None:
+            return
+        category, action, message = parsed
+        if category == 'relay' and action == 'features':
+            await self.negotiate(websocket, message)
+            return
+        if category not in self.states:
+            logger.info(f"relay: {action} on unknown category {category}"
+                        f" - dropped")
+            return
+        if action != 'request':
+            # e.g. an info from a monitor, that the sidecar has to know
+            if self.upstream is not None:
+                await self.upstream.send(text)
+            return
+        self.counters['requests'] += 1
+        self.subscribers[category].add(websocket)
+        if category in self.forwarded_requests and self.upstream is not None:
+            await self.upstream.send(text)
+        state = self.states[category]
+        snapshot = state.snapshot()
+        # otherwise it will come with the sidecar's answer
+        if snapshot is None:
+            return
+        self.counters['from_cache'] += 1
+        if websocket in self.delta_clients:
+            self.send({websocket}, category, 'delta', {
+                'seq': state.seq, 'full': True, 'infos': snapshot})
+        else:
+            self.send({websocket}, category, 'info', snapshot)
+
+    async def negotiate(self, websocket, features):
+        """
+        the browser tells us what it supports, and we answer
+        with the features that we turn on
+        """
+        accepted = []
+        if isinstance(features, list) and 'deltas' in features:
+            self.delta_clients.add(websocket)
+            accepted.append('deltas')
+        if isinstance(features, list) and 'binary' in features:
+            self.binary_clients.add(websocket)
+            self.known_fields[websocket] = {}
+            accepted.append('binary')
+        await websocket.send(umbrella('relay', 'features', accepted))
+
+    ########## bus
+    def handle_bus(self, category, message):
+        """
+        a change that the web app has just made; we apply it to what
+        we know, but the sidecar still has the final word
+        """
+        if category != 'leases' or category not in self.states:
+            logger.info(f"relay: change on {category} - dropped")
+            return
+        try:
+            verb, lease = message['verb'], message['lease']
+            uuid = str(lease['uuid'])
+        except (TypeError, KeyError):
+            logger.warning(f"relay: invalid change on {category} - dropped")
+            return
+        if verb not in ('add', 'update', 'delete'):
+            logger.warning(f"relay: unknown change {verb} - dropped")
+            return
+        # until the sidecar has it too, see overlay()
+        self.pending[category][uuid] = (
+            verb, lease, time.monotonic() + self.bus_timeout)
+        state = self.states[category]
+        if state.known():
+            # as if it came from the sidecar
+            self.handle_upstream(
+                umbrella(category, 'info', state.snapshot()))
+        if self.upstream is not None:
+            task = asyncio.create_task(
+                self.upstream.send(umbrella(category, 'request', 'please')))
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+
+    def overlay(self, category, infos):
+        """
+        infos, as the sidecar sends them, with the pending changes
+        heard on the bus applied; infos itself if there are none
+
+        the sidecar gets the leases from the API again only after
+        a while, and until then its answers do not have the changes;
+        a change stops being pending once the sidecar has it as well,
+        or after bus_timeout seconds
+        """
+        pending = self.pending.get(category)
+        if not pending or not isinstance(infos, list):
+            return infos
+        now = time.monotonic()
+        result = infos
+        for uuid, (verb, lease, deadline) in list(pending.items()):
+            known = [info for info in result
+                     if isinstance(info, dict)
+                     and str(info.get('uuid')) == uuid]
+            if verb == 'delete':
+                done = not known
+            else:
+                done = any(all(str(info.get(field)) == str(value)
+                               for field, value in lease.items())
+                           for info in known)
+            if done or now >= deadline:
+                del pending[uuid]
+                continue
+            result = [info for info in result if info not in known]
+            if verb != 'delete':
+                result.append(lease)
+        return result
+
+    ########## snapshot
+    async def write_snapshots(self):
+        """
+        when nothing changes, we still write the file from time to time
+        as long as we are connected, so pages can tell it is not stale
+        """
+        loop = asyncio.get_running_loop()
+        written = loop.time()
+        while True:
+            await asyncio.sleep(self.snapshot_period)
+            due = (self.upstream is not None
+                   and loop.time() - written >= SNAPSHOT_REFRESH)
+            if not self.dirty and not due:
+                continue
+            self.dirty = False
+            written = loop.time()
+            try:
+                write_snapshot(self.snapshot_file, self.states)
+            except OSError as exc:
+                logger.warning(f"relay: cannot write snapshot - {exc}")
+
+    ########## history
+    async def record_history(self):
+        loop = asyncio.get_running_loop()
+        period = self.history.resolutions[0]
+        while True:
+            await asyncio.sleep(period - time.time() % period)
+            # no data is better than stale data
+            if self.upstream is None:
+                continue
+            now = time.time()
+            samples = history_samples(self.states, self.history_fields, now)
+            try:
+                # the file system part does not hold the event loop
+                await loop.run_in_executor(
+                    None, self.history.record, samples, now)
+            except OSError as exc:
+                logger.warning(f"relay: cannot record history - {exc}")
+
+    ########## all together
+    async def serve(self, host, port):
+        async with websockets.serve(self.serve_client, host, port):
+            logger.info(f"relay: listening on {host}:{port}")
+            tasks = [self.run_upstream()]
+            if self.snapshot_file:
+                tasks.append(self.write_snapshots())
+            if self.history:
+                tasks.append(self.record_history())
+            transport = None
+            if self.bus_address:
+                loop = asyncio.get_running_loop()
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda: BusProtocol(self.handle_bus),
+                    local_addr=self.bus_address)
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                if transport is not None:
+                    transport.close()
@@ -0,0 +1,56 @@
+"""
+the state that the relay knows, in a file that web pages can embed
+
+the relay writes it - at most every relay_settings['snapshot_period'] -
+and the pages that say e.g.
+    sidecar_snapshot: nodes phones
+in their header embed these categories, so that the widgets can draw
+before their websocket gets its first message
+"""
+
+import json
+import time
+from pathlib import Path
+
+from r2lab.settings import relay_settings
+from r2lab.assetmanifest import ManifestFile
+
+SNAPSHOT_FILE = Path(relay_settings['snapshot_file'])
+
+
+def write_snapshot(path, states):
+    """
+    states is a dict category -> CategoryState
+    """
+    contents = {
+        'time': time.time(),
+        'categories': {category: state.snapshot()
+                       for category, state in states.items()
+                       if state.known()},
+    }
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps(contents))
+    tmp.replace(path)
+
+
+_snapshot = ManifestFile(SNAPSHOT_FILE)
+
+
+def embedded_snapshot(categories):
+    """
+    a dict category -> infos for the categories we know of,
+    or None if there is nothing recent enough
+    """
+    try:
+        contents = _snapshot.get()
+    except ValueError:
+        # being written over, in theory
+        return None
+    if not contents:
+        return None
+    if time.time() - contents['time'] > relay_settings['snapshot_max_age']:
+        return None
+    known = contents['categories']
+    snapshot = {category: known[category]
+                for category in categories if category in known}
+    return snapshot or None
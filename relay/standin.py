@@ -0,0 +1,123 @@
+"""
+a stand-in for the sidecar, to run the relay - or the pages -
+without access to r2lab.inria.fr
+
+like the sidecar, it answers requests with the complete state of a
+category, merges the info messages it receives and broadcasts them
+to everybody; and it can make up changes on its own, e.g. switch
+a node on or off every few seconds
+"""
+
+import random
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import websockets
+
+from r2lab.settings import logger
+
+from relay.state import CategoryState, umbrella, parse_umbrella
+
+NB_NODES = 37
+NB_PHONES = 2
+
+
+def initial_nodes():
+    return [{
+        'id': node_id, 'available': 'ok', 'cmc_on_off': 'on',
+        'control_ping': 'on', 'control_ssh': 'on',
+        'os_release': 'ubuntu-22.04', 'image_radical': 'ubuntu',
+        'usrp_type': 'none', 'usrp_on_off': 'off',
+        'data_interface': 'data',
+    } for node_id in range(1, NB_NODES + 1)]
+
+
+def initial_phones():
+    return [{'id': phone_id, 'airplane_mode': 'off'}
+            for phone_id in range(1, NB_PHONES + 1)]
+
+
+def initial_leases():
+    now = datetime.now(timezone.utc).replace(minute=0, second=0,
+                                             microsecond=0)
+    return [{
+        'uuid': str(hour), 'slicename': 'inria_r2lab.standin',
+        'valid_from': (now + timedelta(hours=hour)).isoformat(),
+        'valid_until': (now + timedelta(hours=hour + 1)).isoformat(),
+    } for hour in (0, 2)]
+
+
+def random_change(category='nodes'):
+    """
+    a (category, infos) that a monitor could have sent
+    """
+    if category == 'phones':
+        return category, [{'id': random.randint(1, NB_PHONES),
+                           'airplane_mode': random.choice(('on', 'off'))}]
+    if category == 'leases':
+        # leases always come as the complete list
+        leases = initial_leases()
+        random.shuffle(leases)
+        return category, leases[:random.randint(1, len(leases))]
+    node_id = random.randint(1, NB_NODES)
+    field, values = random.choice([
+        ('cmc_on_off', ('on', 'off')),
+        ('control_ping', ('on', 'off')),
+        ('control_ssh', ('on', 'off')),
+        ('os_release', ('ubuntu-22.04', 'fedora-39', 'other')),
+    ])
+    return category, [{'id': node_id, field: random.choice(values)}]
+
+
+class StandinSidecar:
+
+    def __init__(self, *, period):
+        # in seconds, 0 means no changes of our own
+        self.period = period
+        self.states = {
+            'nodes': CategoryState('nodes', True),
+            'phones': CategoryState('phones', True),
+            'leases': CategoryState('leases', False),
+        }
+        self.states['nodes'].update(initial_nodes())
+        self.states['phones'].update(initial_phones())
+        self.states['leases'].update(initial_leases())
+        self.clients = set()
+
+    def publish(self, category, infos):
+        self.states[category].update(infos)
+        websockets.broadcast(self.clients,
+                             umbrella(category, 'info', infos))
+
+    async def serve_client(self, websocket):
+        self.clients.add(websocket)
+        try:
+            async for text in websocket:
+                parsed = parse_umbrella(text)
+                if parsed is None:
+                    continue
+                category, action, message = parsed
+                if category not in self.states:
+                    continue
+                if action == 'request':
+                    await websocket.send(umbrella(
+                        category, 'info', self.states[category].snapshot()))
+                elif action == 'info':
+                    self.publish(category, message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.clients.discard(websocket)
+
+    async def make_changes(self):
+        while True:
+            await asyncio.sleep(self.period)
+            self.publish(*random_change())
+
+    async def serve(self, host, port):
+        async with websockets.serve(self.serve_client, host, port):
+            logger.info(f"stand-in sidecar: listening on {host}:{port}")
+            if self.period:
+                await self.make_changes()
+            else:
+                await asyncio.Future()
@@ -0,0 +1,95 @@
+"""
+the state of the sidecar categories, as seen through the info messages
+"""
+
+import json
+from collections import OrderedDict
+
+
+def umbrella(category, action, message):
+    """
+    the json text for a sidecar message
+    """
+    return json.dumps({'category': category, 'action': action,
+                       'message': message})
+
+
+def parse_umbrella(text):
+    """
+    a tuple (category, action, message), or None if text
+    is not something that the sidecar would send or accept
+    """
+    try:
+        umbrella_dict = json.loads(text)
+        return (umbrella_dict['category'], umbrella_dict['action'],
+                umbrella_dict.get('message'))
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+class CategoryState:
+    """
+    the latest known contents of one category
+
+    when merged is True, info messages are about some of the records,
+    identified by their 'id', and only mention the fields that change -
+    that's how nodes and phones work; otherwise each info message has
+    the complete list, as for leases
+
+    seq counts the updates that actually changed something
+    """
+
+    def __init__(self, category, merged):
+        self.category = category
+        self.merged = merged
+        # id -> record
+        self.records = OrderedDict()
+        # when not merged
+        self.contents = None
+        self.seq = 0
+
+    def known(self):
+        return bool(self.records) if self.merged else self.contents is not None
+
+    def update(self, infos):
+        """
+        returns what has changed, in the same shape as infos -
+        i.e. for merged categories the records that have changed,
+        with their id and the fields that have a new value;
+        or None if infos cannot be used
+
+        seq tells whether there was any change at all
+        """
+        if not isinstance(infos, list):
+            return None
+        if not self.merged:
+            if infos == self.contents:
+                return []
+            self.contents = infos
+            self.seq += 1
+            return infos
+        for info in infos:
+            if not isinstance(info, dict) or 'id' not in info:
+                return None
+        changes = []
+        for info in infos:
+            record = self.records.setdefault(info['id'], {})
+            changed = {field: value for field, value in info.items()
+                       if field not in record or record[field] != value}
+            if changed:
+                record.update(changed)
+                changes.append({'id': info['id'], **changed})
+        if changes:
+            self.seq += 1
+        return changes
+
+    def snapshot(self):
+        """
+        the complete contents, as the message of an info message;
+        None if we have not heard of this category yet
+        """
+        if not self.known():
+            return None
+        if self.merged:
+            return list(self.records.values())
+        return self.contents
@@ -0,0 +1,382 @@
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from relay.state import umbrella
+from relay.server import Relay
+from relay.bus import sign, verify
+from relay.history import History
+from relay.binary import Schema, packb, unpackb, encode, decode
+
+
+def relay_for_tests(**kwds):
+    relay = Relay('ws://localhost:10002',
+                  categories=('nodes', 'phones', 'leases'),
+                  merged_categories=('nodes', 'phones'),
+                  forwarded_requests=('leases',),
+                  reconnect_delay=5, snapshot_every=100, **kwds)
+    # what gets sent to the browsers, as (websockets, data)
+    relay.sent = []
+    relay.broadcast = lambda websockets_set, data: \
+        relay.sent.append((set(websockets_set), data))
+    return relay
+
+
+class BusTests(SimpleTestCase):
+
+    LEASES = [{'uuid': '0', 'slicename': 'inria_a',
+               'valid_from': '2030-01-01T10:00:00Z',
+               'valid_until': '2030-01-01T11:00:00Z'}]
+    NEW = {'uuid': 99, 'slicename': 'inria_b',
+           'valid_from': '2030-01-01T12:00:00Z',
+           'valid_until': '2030-01-01T13:00:00Z'}
+
+    def setUp(self):
+        self.relay = relay_for_tests()
+        self.relay.subscribers['leases'].add('browser')
+        self.relay.handle_upstream(umbrella('leases', 'info', self.LEASES))
+
+    def uuids(self):
+        return [str(lease['uuid'])
+                for lease in self.relay.states['leases'].snapshot()]
+
+    def sidecar_says(self, leases):
+        self.relay.handle_upstream(umbrella('leases', 'info', leases))
+
+    def test_signature(self):
+        text = umbrella('leases', 'changed', {})
+        self.assertEqual(verify(sign(text)), text)
+        self.assertIsNone(verify(text.encode()))
+        forged = sign(text).replace(b'{}', b'{"verb": "add"}')
+        self.assertIsNone(verify(forged))
+        self.assertIsNone(verify(sign(text, now=1000), now=2000))
+
+    def test_add_survives_stale_sidecar(self):
+        self.relay.handle_bus('leases', {'verb': 'add', 'lease': self.NEW})
+        self.assertEqual(self.uuids(), ['0', '99'])
+        # the sidecar has not heard of it yet
+        self.sidecar_says(self.LEASES)
+        self.assertEqual(self.uuids(), ['0', '99'])
+        # now it has, and it gets forgotten as pending
+        self.sidecar_says(self.LEASES + [dict(self.NEW, uuid='99')])
+        self.assertEqual(self.uuids(), ['0', '99'])
+        self.assertEqual(self.relay.pending['leases'], {})
+        # so that a later removal by the sidecar goes through
+        self.sidecar_says(self.LEASES)
+        self.assertEqual(self.uuids(), ['0'])
+
+    def test_update_and_delete(self):
+        moved = dict(self.LEASES[0], valid_until='2030-01-01T12:00:00Z')
+        self.relay.handle_bus('leases', {'verb': 'update', 'lease': moved})
+        self.sidecar_says(self.LEASES)
+        self.assertEqual(self.relay.states['leases'].snapshot(), [moved])
+        self.relay.handle_bus('leases', {'verb': 'delete',
+                                         'lease': {'uuid': '0'}})
+        self.sidecar_says([moved])
+        self.assertEqual(self.uuids(), [])
+        self.sidecar_says([])
+        self.assertEqual(self.relay.pending['leases'], {})
+
+    def test_timeout(self):
+        self.relay.handle_bus('leases', {'verb': 'add', 'lease': self.NEW})
+        with mock.patch('relay.server.time.monotonic',
+                        return_value=10**12):
+            self.sidecar_says(self.LEASES)
+        self.assertEqual(self.uuids(), ['0'])
+        self.assertEqual(self.relay.pending['leases'], {})
+
+    def test_browsers_see_the_overlay(self):
+        self.relay.handle_bus('leases', {'verb': 'add', 'lease': self.NEW})
+        self.relay.sent.clear()
+        self.sidecar_says(self.LEASES)
+        # the browsers get the sidecar's answer with the change
+        [(websockets_set, data)] = self.relay.sent
+        self.assertEqual(websockets_set, {'browser'})
+        self.assertEqual(data, umbrella('leases', 'info',
+                                        self.LEASES + [self.NEW]))
+
+    def test_dropped(self):
+        self.relay.handle_bus('nodes', {'verb': 'add', 'lease': self.NEW})
+        self.relay.handle_bus('leases', {'verb': 'add'})
+        self.relay.handle_bus('leases', {'verb': 'steal', 'lease': self.NEW})
+        self.assertEqual(self.uuids(), ['0'])
+
+
+class HistoryTests(SimpleTestCase):
+
+    RESOLUTIONS = (60, 900, 21600)
+    # aligned on the coarsest resolution
+    ORIGIN = 21600 * 80000
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.writer = History(self.directory.name,
+                              resolutions=self.RESOLUTIONS, writable=True)
+        # like the views do
+        self.reader = History(self.directory.name,
+                              resolutions=self.RESOLUTIONS)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def record(self, minute, value):
+        self.writer.record([('nodes', '4', {'cmc_on_off': value})],
+                           self.ORIGIN + 60 * minute)
+
+    def query(self, start, end, max_points):
+        return self.reader.query('nodes', '4', 'cmc_on_off',
+                                 self.ORIGIN + start, self.ORIGIN + end,
+                                 max_points)
+
+    def record_flapping(self):
+        # minute 2 has no data, and does not count as a change
+        for minute, value in enumerate(['on', 'on', None, 'off', 'on']):
+            self.record(minute, value)
+
+    def test_no_history(self):
+        self.assertIsNone(self.query(0, 3600, 100))
+
+    def test_minutes(self):
+        self.record_flapping()
+        answer = self.query(0, 240, 100)
+        self.assertEqual(answer['resolution'], 60)
+        self.assertEqual(answer['start'], self.ORIGIN)
+        self.assertEqual(answer['legend'], [None, 'on', 'off'])
+        self.assertEqual(answer['values'], [1, 1, 0, 2, 1])
+        self.assertEqual(answer['flips'], [0, 0, 0, 1, 1])
+
+    def test_quarters(self):
+        self.record_flapping()
+        answer = self.query(0, 6 * 3600, 30)
+        self.assertEqual(answer['resolution'], 900)
+        self.assertEqual(answer['start'], self.ORIGIN)
+        self.assertEqual(len(answer['values']), 25)
+        self.assertEqual(answer['values'][:2], [1, 0])
+        self.assertEqual(answer['flips'][:2], [2, 0])
+
+    def test_six_hours(self):
+        self.record_flapping()
+        answer = self.query(0, 10 * 86400, 50)
+        self.assertEqual(answer['resolution'], 21600)
+        self.assertEqual(answer['start'], self.ORIGIN)
+        self.assertEqual(len(answer['values']), 41)
+        self.assertEqual(answer['values'][:2], [1, 0])
+        self.assertEqual(answer['flips'][:2], [2, 0])
+
+    def test_slots_follow_the_samples(self):
+        self.record_flapping()
+        # a sample in the second quarter only changes that one
+        self.record(14, 'on')
+        self.record(15, 'off')
+        answer = self.query(0, 1800, 3)
+        self.assertEqual(answer['resolution'], 900)
+        self.assertEqual(answer['values'], [1, 2, 0])
+        # as compared with the last value of the previous slot
+        self.assertEqual(answer['flips'], [2, 1, 0])
+
+    def test_before_origin(self):
+        self.record_flapping()
+        answer = self.query(-3600, 120, 100)
+        self.assertEqual(answer['resolution'], 60)
+        self.assertEqual(answer['start'], self.ORIGIN)
+        self.assertEqual(answer['values'], [1, 1, 0])
+        answer = self.query(-7200, -3600, 100)
+        self.assertEqual(answer['values'], [])
+        self.assertEqual(answer['flips'], [])
+
+    def test_clock_going_back(self):
+        self.record_flapping()
+        self.record(-10, 'off')
+        self.assertEqual(self.query(-3600, 0, 100)['values'], [1])
+
+    def test_far_future(self):
+        self.record_flapping()
+        future = 60 * 10**7
+        answer = self.query(future, future + 3600, 100)
+        self.assertEqual(answer['resolution'], 60)
+        self.assertEqual(answer['start'], self.ORIGIN + future)
+        self.assertEqual(answer['values'], [0] * 61)
+        self.assertEqual(answer['flips'], [0] * 61)
+
+    def test_max_points(self):
+        self.record_flapping()
+        self.record(100 * 24 * 60, 'off')
+        # too wide even for the coarsest resolution: the most recent
+        # max_points slots are returned
+        answer = self.query(0, 100 * 86400, 10)
+        self.assertEqual(answer['resolution'], 21600)
+        self.assertEqual(len(answer['values']), 10)
+        self.assertEqual(answer['start'], self.ORIGIN + (401 - 10) * 21600)
+        self.assertEqual(answer['values'][-1], 2)
+        for max_points in (1, 7, 100):
+            answer = self.query(0, 3 * 3600, max_points)
+            self.assertLessEqual(len(answer['values']), max_points)
+            self.assertEqual(len(answer['flips']), len(answer['values']))
+
+
+class BinaryTests(SimpleTestCase):
+
+    def round_trip(self, obj):
+        self.assertEqual(unpackb(packb(obj)), obj)
+
+    def test_scalars(self):
+        for obj in (None, True, False, 0, 1.5, -2.25, "", "épée", [], {}):
+            self.round_trip(obj)
+
+    def test_ints(self):
+        for bits in (7, 8, 16, 32, 64):
+            self.round_trip(2**bits - 1)
+        self.round_trip(2**7)
+        with self.assertRaises(ValueError):
+            packb(2**64)
+
+    def test_negative_ints(self):
+        for value in (-1, -32, -33):
+            self.round_trip(value)
+        for bits in (8, 16, 32, 64):
+            self.round_trip(-2**(bits - 1))
+            self.round_trip(-2**(bits - 1) + 1)
+        for bits in (8, 16, 32):
+            self.round_trip(-2**(bits - 1) - 1)
+        self.assertEqual(packb(-1), b'\xff')
+        self.assertEqual(packb(-33)[0], 0xd0)
+        with self.assertRaises(ValueError):
+            packb(-2**63 - 1)
+
+    def test_string_lengths(self):
+        for size, marker in ((31, 0xbf), (32, 0xd9), (2**8 - 1, 0xd9),
+                             (2**8, 0xda), (2**16 - 1, 0xda),
+                             (2**16, 0xdb)):
+            packed = packb("x" * size)
+            self.assertEqual(packed[0], marker, size)
+            self.assertEqual(unpackb(packed), "x" * size)
+        # the size is in bytes, not in characters
+        self.assertEqual(packb("é" * 16)[0], 0xd9)
+
+    def test_array_lengths(self):
+        for size, marker in ((15, 0x9f), (16, 0xdc), (2**16 - 1, 0xdc),
+                             (2**16, 0xdd)):
+            packed = packb([0] * size)
+            self.assertEqual(packed[0], marker, size)
+            self.assertEqual(unpackb(packed), [0] * size)
+        for size, marker in ((15, 0x8f), (16, 0xde), (2**16, 0xdf)):
+            obj = {index: None for index in range(size)}
+            packed = packb(obj)
+            self.assertEqual(packed[0], marker, size)
+            self.assertEqual(unpackb(packed), obj)
+
+    def test_invalid_frames(self):
+        packed = packb(["nodes", "info", ["x" * 40]])
+        for frame in (packed[:-1], packed + b'\x00', b'\xc1', b''):
+            with self.assertRaises(ValueError):
+                unpackb(frame)
+
+    def test_partial_rows(self):
+        schema = Schema()
+        records = [{'id': 1, 'cmc_on_off': 'on', 'os_release': 'u18'},
+                   {'id': 2, 'os_release': 'f31'},
+                   {'os_release': None, 'id': 3, 'cmc_on_off': 'off'}]
+        self.assertEqual(schema.rows(records),
+                         [[1, 'on', 'u18'], {0: 2, 2: 'f31'},
+                          [3, 'off', None]])
+        frame = encode(schema, 'nodes', 'info', records)
+        schemas = {}
+        self.assertIsNone(decode(packb(['nodes', 'schema', schema.fields]),
+                                 schemas))
+        self.assertEqual(decode(frame, schemas), ('nodes', 'info', records))
+
+    def test_json_only(self):
+        schema = Schema()
+        self.assertIsNone(encode(schema, 'nodes', 'info', {'id': 1}))
+        self.assertIsNone(encode(schema, 'nodes', 'info', [{1: 'x'}]))
+        self.assertIsNone(encode(schema, 'nodes', 'info', [{'id': 2**70}]))
+
+    def test_growing_schema(self):
+        schema, schemas = Schema(), {}
+        delta = {'seq': 1, 'full': False,
+                 'infos': [{'id': 4, 'cmc_on_off': 'on'}]}
+        first = encode(schema, 'nodes', 'delta', delta)
+        decode(packb(['nodes', 'schema', list(schema.fields)]), schemas)
+        self.assertEqual(decode(first, schemas), ('nodes', 'delta', delta))
+        # a new field in the middle of the connection gets appended,
+        # so that the rows sent before remain valid
+        grown = {'seq': 2, 'full': False,
+                 'infos': [{'id': 4, 'usrp_type': 'b210'}]}
+        second = encode(schema, 'nodes', 'delta', grown)
+        self.assertEqual(schema.fields, ['id', 'cmc_on_off', 'usrp_type'])
+        decode(packb(['nodes', 'schema', list(schema.fields)]), schemas)
+        self.assertEqual(decode(second, schemas), ('nodes', 'delta', grown))
+        self.assertEqual(decode(first, schemas), ('nodes', 'delta', delta))
+
+
+class SendTests(SimpleTestCase):
+
+    def setUp(self):
+        self.relay = relay_for_tests()
+        for websocket in ('early', 'late'):
+            self.relay.binary_clients.add(websocket)
+            self.relay.known_fields[websocket] = {}
+
+    def received(self, websocket):
+        """
+        what websocket has received so far, decoded
+        """
+        schemas, messages = {}, []
+        for websockets_set, data in self.relay.sent:
+            if websocket not in websockets_set:
+                continue
+            if isinstance(data, str):
+                messages.append(data)
+            else:
+                decoded = decode(data, schemas)
+                messages.append('schema' if decoded is None else decoded)
+        return messages
+
+    def test_schema_frames(self):
+        relay = self.relay
+        infos = [{'id': 1, 'cmc_on_off': 'on'}]
+        relay.send({'early', 'plain'}, 'nodes', 'info', infos)
+        # the schema comes first, and only once
+        relay.send({'early'}, 'nodes', 'info', infos)
+        self.assertEqual(self.received('early'),
+                         ['schema', ('nodes', 'info', infos),
+                          ('nodes', 'info', infos)])
+        self.assertEqual(self.received('plain'),
+                         [umbrella('nodes', 'info', infos)])
+        # a browser that connects later needs the schema too
+        delta = {'seq': 3, 'full': False,
+                 'infos': [{'id': 1, 'cmc_on_off': 'off'}]}
+        relay.send({'early', 'late'}, 'nodes', 'delta', delta)
+        self.assertEqual(self.received('late'),
+                         ['schema', ('nodes', 'delta', delta)])
+        self.assertEqual(self.received('early')[-1],
+                         ('nodes', 'delta', delta))
+        self.assertEqual(self.received('early').count('schema'), 1)
+        self.assertEqual(relay.known_fields['early'], {'nodes': 2})
+
+    def test_schema_grows(self):
+        relay = self.relay
+        infos = [{'id': 1, 'cmc_on_off': 'on'}]
+        relay.send({'early'}, 'nodes', 'info', infos)
+        grown = [{'id': 1, 'cmc_on_off': 'on', 'usrp_type': 'b210'}]
+        relay.send({'early', 'late'}, 'nodes', 'info', grown)
+        # both get the grown schema before the frame that needs it
+        self.assertEqual(self.received('early'),
+                         ['schema', ('nodes', 'info', infos),
+                          'schema', ('nodes', 'info', grown)])
+        self.assertEqual(self.received('late'),
+                         ['schema', ('nodes', 'info', grown)])
+        # and the schemas are per category
+        leases = [{'uuid': '0', 'slicename': 'inria_a'}]
+        relay.send({'early'}, 'leases', 'info', leases)
+        self.assertEqual(self.received('early')[-2:],
+                         ['schema', ('leases', 'info', leases)])
+        self.assertEqual(relay.known_fields['early'],
+                         {'nodes': 3, 'leases': 2})
+
+    def test_fallback_to_json(self):
+        self.relay.send({'early'}, 'nodes', 'info', [{'id': 2**70}])
+        self.assertEqual(self.received('early'),
+                         [umbrella('nodes', 'info', [{'id': 2**70}])])
+        self.assertEqual(self.relay.known_fields['early'], {})
@@ -0,0 +1,53 @@
+"""
+the history that the relay records, for the web pages, e.g.
+    /history/query?category=nodes&id=4&field=cmc_on_off&days=28
+"""
+
+import math
+import time
+
+from django.http import JsonResponse, HttpResponseBadRequest
+
+from r2lab.settings import relay_settings
+from relay.history import History, NAME_RE
+
+DAY = 24 * 3600
+
+history = History(relay_settings['history_dir'],
+                  resolutions=relay_settings['history_resolutions'])
+
+
+def history_query(request):
+    """
+    the time range is given either with start and end, as epoch
+    seconds - end defaulting to now - or with days before end
+    see History.query() for the result
+    """
+    category = request.GET.get('category', 'nodes')
+    record_id = request.GET.get('id')
+    field = request.GET.get('field')
+    fields = relay_settings['history_fields']
+    limit = relay_settings['history_max_points']
+    if category not in fields or field not in fields[category]:
+        return HttpResponseBadRequest("unknown category or field")
+    if not record_id or not NAME_RE.match(record_id):
+        return HttpResponseBadRequest("invalid id")
+    try:
+        end = float(request.GET.get('end', time.time()))
+        start = float(request.GET['start']) if 'start' in request.GET \
+            else end - float(request.GET.get('days', 7)) * DAY
+        max_points = int(request.GET.get('max_points', limit))
+    except ValueError:
+        return HttpResponseBadRequest("invalid time range")
+    max_points = min(max_points, limit)
+    # float() accepts nan and inf
+    if not (math.isfinite(start) and math.isfinite(end)):
+        return HttpResponseBadRequest("invalid time range")
+    if end <= start or max_points <= 0:
+        return HttpResponseBadRequest("invalid time range")
+    result = history.query(category, record_id, field, start, end,
+                           max_points)
+    if result is None:
+        result = {'values': [], 'flips': []}
+    result.update({'category': category, 'id': record_id, 'field': field})
+    return JsonResponse(result)
@@ -9,6 +9,7 @@ from django.views.decorators.csrf import csrf_protect
 
 # importing PlcApiProxy through this module because of the symlink hack
 from plc.plcapiview import PlcApiView
+from dashboard.cache import forgets_dashboard, forgets_users
 
 # Create your views here.
 
@@ -19,6 +20,8 @@ class SlicesProxy(PlcApiView):
     """
 
     @method_decorator(csrf_protect)
+    @forgets_dashboard('renew')
+    @forgets_users('renew')
     def post(self, request, verb):
         """
         xhtp requests come using a POST http command
@@ -42,12 +45,13 @@ class SlicesProxy(PlcApiView):
                 {'error': "Failure when running verb {}".format(verb),
                  'message': exc})
 
-    def return_slice(self, plc_slice):
+    @staticmethod
+    def return_slice(plc_slice):
         """
         what to return upon ADD or UPDATE
         """
         return {'name': plc_slice['name'],
-                'valid_until': self.epoch_to_ui_ts(plc_slice['expires'])}
+                'valid_until': PlcApiView.epoch_to_ui_ts(plc_slice['expires'])}
 
     def get_slices(self, record):
         """
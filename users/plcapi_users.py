@@ -9,6 +9,7 @@ from django.views.decorators.csrf import csrf_protect
 
 from plc.plcapiview import PlcApiView
 import plc.xrn
+from dashboard.cache import users_version
 
 # Create your views here.
 class UsersProxy(PlcApiView):
@@ -79,6 +80,15 @@ class UsersProxy(PlcApiView):
         error = self.check_record(record, (), ('urn', ))
         if error:
             return self.http_response_from_struct(error)
+        # the answer does not depend on who asks, and can be big
+        return self.http_response_from_cache(
+            f"users:{users_version()}", record,
+            lambda: self.users_struct(record))
+
+    def users_struct(self, record):
+        """
+        the list of users matching record, as a python struct
+        """
         self.init_plcapi_proxy()
 
         # compute plc_filter 
@@ -100,6 +110,5 @@ class UsersProxy(PlcApiView):
         slices = self.plcapi_proxy.GetSlices(all_slice_ids, slice_columns)
         # hash on slice_id
         slices_index = { slice['slice_id']: slice for slice in slices }
-        return self.http_response_from_struct(
-            [self.user_with_accounts(person, slices_index)
-             for person in persons])
+        return [self.user_with_accounts(person, slices_index)
+                for person in persons]